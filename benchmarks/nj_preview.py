@@ -0,0 +1,59 @@
+#!/usr/bin/env python3.6
+
+'''
+Timing of the distance matrix and neighbour-joining steps of nj_preview.py on
+random clustered alignments, with a sprinkling of ambiguity codes and gaps.
+'''
+
+import os
+import sys
+import time
+import argparse
+import resource
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+from nj_preview import distances, neighbour_joining
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--sequences', required=False, default='1000,10000', help='comma separated alignment sizes. Default = 1000,10000')
+parser.add_argument('--sites', required=False, type=int, default=1300, help='alignment length. Default = 1300')
+parser.add_argument('--exact-max', required=False, type=int, default=2000, help='also time classic one-pair-per-round NJ up to this many sequences. Default = 2000')
+parser.add_argument('--seed', required=False, type=int, default=1, help='random seed. Default = 1')
+args = parser.parse_args()
+
+
+def random_alignment(n, sites, rng):
+    """
+    n sequences mutated from 20 ancestors, with 1% ambiguity codes and gaps.
+    """
+    alphabet = np.frombuffer(b"ACGT", dtype=np.uint8)
+    ancestors = rng.choice(alphabet, size=(20, sites))
+    seqs = ancestors[rng.integers(0, 20, size=n)]
+    mutate = rng.random((n, sites)) < 0.05
+    seqs[mutate] = rng.choice(alphabet, size=mutate.sum())
+    noise = rng.random((n, sites)) < 0.01
+    seqs[noise] = rng.choice(np.frombuffer(b"RYKMN-", dtype=np.uint8), size=noise.sum())
+    return [row.tobytes().decode("ascii") for row in seqs]
+
+
+rng = np.random.default_rng(args.seed)
+print("sequences\tdistances (s)\trelaxed NJ (s)\tclassic NJ (s)\tpeak RSS (MB)")
+for n in [int(x) for x in args.sequences.split(",")]:
+    sequences = random_alignment(n, args.sites, rng)
+    names = ["S" + str(i) for i in range(n)]
+    start = time.perf_counter()
+    dist = distances(sequences)
+    dist_time = time.perf_counter() - start
+    start = time.perf_counter()
+    neighbour_joining(dist, names, relaxed=True)
+    nj_time = time.perf_counter() - start
+    exact = ""
+    if n <= args.exact_max:
+        start = time.perf_counter()
+        neighbour_joining(dist, names)
+        exact = "{0:.2f}".format(time.perf_counter() - start)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print(str(n) + "\t" + "{0:.2f}".format(dist_time) + "\t" + "{0:.2f}".format(nj_time) + "\t" + exact + "\t" + "{0:.0f}".format(peak))
+    sys.stdout.flush()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3.6
+
+'''
+Scale benchmark of the pipeline scripts on synthetic runs of growing size.
+For each size a fasta, sierrapy json and patient table are generated
+(synthetic_data.py); the alignment and tree come from local stand-ins for mafft
+and raxmlHPC, so only the repository's own scripts are measured. Each script
+runs in its own process and its wall time, CPU time, peak memory and exit code
+are written to a json results file that can be compared across versions.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import struct
+import argparse
+import datetime
+import platform
+import tempfile
+import subprocess
+import zlib
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(bench_dir)
+bin_dir = os.path.join(repo_dir, 'bin')
+sys.path.insert(0, bench_dir)
+import synthetic_data
+
+
+# stand-in for mafft --add IN [--keeplength] REF: the references, then the
+# samples padded or cut to the reference width
+MAFFT_STUB = r'''#!/usr/bin/env python3
+import sys
+args = sys.argv[1:]
+added = args[args.index("--addfragments" if "--addfragments" in args else "--add") + 1]
+def read(path):
+    records = []
+    for line in open(path):
+        line = line.strip()
+        if line.startswith(">"):
+            records.append([line[1:], ""])
+        elif line:
+            records[-1][1] += line
+    return records
+refs = read(args[-1])
+width = len(refs[0][1])
+for name, seq in refs + [(n, s[:width].ljust(width, "-")) for n, s in read(added)]:
+    sys.stdout.write(">" + name + "\n" + seq + "\n")
+'''
+
+# stand-in for raxmlHPC: a random balanced tree with support values over the
+# sequences of -s, written under the file names RAxML would use
+RAXML_STUB = r'''#!/usr/bin/env python3
+import os, sys, random
+args = sys.argv[1:]
+def opt(flag, default=None):
+    return args[args.index(flag) + 1] if flag in args else default
+names = [line[1:].strip() for line in open(opt("-s")) if line.startswith(">")]
+rng = random.Random(int(opt("-p", "1")))
+def clade(leaves):
+    if len(leaves) == 1:
+        return leaves[0] + ":%.4f" % (rng.random() / 20)
+    half = len(leaves) // 2
+    return "(" + clade(leaves[:half]) + "," + clade(leaves[half:]) + "):%.4f[%d]" % (rng.random() / 20, rng.randint(0, 100))
+sys.setrecursionlimit(100000)
+rng.shuffle(names)
+third = len(names) // 3
+tree = "(" + ",".join(clade(part) for part in (names[:third], names[third:2 * third], names[2 * third:])) + ");\n"
+work, name = opt("-w", "."), opt("-n")
+for prefix in ("RAxML_bipartitionsBranchLabels.", "RAxML_bestTree.", "RAxML_info."):
+    with open(os.path.join(work, prefix + name), "w") as out:
+        out.write(tree)
+'''
+
+
+def write_stubs(stub_dir):
+    os.makedirs(stub_dir, exist_ok=True)
+    for name, source in (("mafft", MAFFT_STUB), ("raxmlHPC", RAXML_STUB)):
+        path = os.path.join(stub_dir, name)
+        with open(path, "w") as out:
+            out.write(source)
+        os.chmod(path, 0o755)
+
+
+def write_logos(assets_dir):
+    """
+    Placeholder UVRIlogo_best.png and CVRlogo.png for the reports: the logos
+    are not part of the repository. Each is a single white pixel.
+    """
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+    png = (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)) +
+           chunk(b"IDAT", zlib.compress(b"\x00\xff\xff\xff")) + chunk(b"IEND", b""))
+    os.makedirs(assets_dir, exist_ok=True)
+    for name in ("UVRIlogo_best.png", "CVRlogo.png"):
+        with open(os.path.join(assets_dir, name), "wb") as out:
+            out.write(png)
+
+
+def measure(command, cwd, env, stdout=None):
+    """
+    :return: dict of wall time, CPU time and peak resident memory of the command
+    """
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull:
+        process = subprocess.Popen(command, cwd=cwd, env=env, stdout=stdout or devnull, stderr=devnull)
+        pid, status, usage = os.wait4(process.pid, 0)
+    return {
+        "wall_s": round(time.perf_counter() - start, 3),
+        "cpu_s": round(usage.ru_utime + usage.ru_stime, 3),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(usage.ru_maxrss / 1024.0, 1),
+        "exit_code": os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") else status >> 8,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=repo_dir, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def scale_run(n, work, env, assets, args):
+    """
+    Generate a run of n samples and time each script on it.
+
+    :param assets: directory holding the logo images for the reports
+
+    :return: list of result dicts
+    """
+    fasta, json_in, patients = synthetic_data.write_run(work, n, args.dated, args.seed)
+    reference = os.path.join(work, "references.fasta")
+    synthetic_data.write_references(reference, seed=args.seed)
+    python = sys.executable
+
+    results = []
+
+    def record(script, mode, command, stdout=None):
+        result = {"samples": n, "script": script, "mode": mode}
+        result.update(measure(command, work, env, stdout))
+        # a crashed script is not a timing; the row is kept but flagged
+        result["failed"] = result["exit_code"] != 0
+        results.append(result)
+        print("\t".join(str(result[key]) for key in ("samples", "script", "mode", "wall_s", "cpu_s", "peak_rss_mb", "exit_code")))
+        sys.stdout.flush()
+
+    if "normalise" in args.scripts:
+        # as in the pipeline, the scripts below then read the normalised
+        # results; without it the first of them writes them
+        record("sierra_ir.py", "normalise",
+               [python, os.path.join(bin_dir, "sierra_ir.py"), "--json", json_in])
+    if "reports" in args.scripts:
+        record("parse_json_write_docx.py", "workers=" + str(args.workers),
+               [python, os.path.join(bin_dir, "parse_json_write_docx.py"), "--json", json_in, "--data", patients,
+                "--output", os.path.join(work, "subtypes.txt"), "--reports", "--reports-dir", os.path.join(work, "reports"),
+                "--assets", assets, "--subset-data", "--workers", str(args.workers), "--renderer", args.renderer])
+    if "overview" in args.scripts:
+        record("parse_json_store_metadata.py", "overview",
+               [python, os.path.join(bin_dir, "parse_json_store_metadata.py"), "--json", json_in,
+                "--output", os.path.join(work, "overview.txt")])
+    if "outputs" in args.scripts:
+        # the reports and overview above, from one read of the json
+        record("parse_json_outputs.py", "workers=" + str(args.workers),
+               [python, os.path.join(bin_dir, "parse_json_outputs.py"), "--json", json_in, "--data", patients,
+                "--output", os.path.join(work, "subtypes.txt"), "--reports", "--reports-dir", os.path.join(work, "reports"),
+                "--assets", assets, "--workers", str(args.workers), "--renderer", args.renderer,
+                "--overview", os.path.join(work, "overview.txt")])
+    if "tree" in args.scripts:
+        alignment = os.path.join(work, "aligned.fasta")
+        os.makedirs(os.path.join(work, "RAxML"), exist_ok=True)
+        with open(alignment, "w") as out:
+            record("mafft (stub)", "add", ["mafft", "--thread", "1", "--add", fasta, "--reorder", reference], stdout=out)
+        record("raxmlHPC (stub)", "-f a", ["raxmlHPC", "-f", "a", "-p", "12345", "-s", alignment, "-n", "bench",
+                                           "-w", os.path.join(work, "RAxML")])
+        tree = os.path.join(work, "RAxML", "RAxML_bipartitionsBranchLabels.bench")
+        for mode, options in (("every leaf", []), ("scalable", ["--scalable"])):
+            record("visualise_phylogeny.py", mode,
+                   [python, os.path.join(bin_dir, "visualise_phylogeny.py"), "--tree", tree, "--reroot",
+                    "--output", os.path.join(work, "tree.pdf")] + options)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', required=False, default='1,10,100', help='comma separated multiples of --base samples. Default = 1,10,100')
+    parser.add_argument('--base', required=False, type=int, default=10, help='samples at scale 1, the size of Test_seqs.fas. Default = 10')
+    parser.add_argument('--scripts', required=False, default='normalise,reports,overview,outputs,tree', help='comma separated subset of normalise (the json to sierra_ir.py\'s binary form), reports, overview, outputs (both in one pass), tree. Default = all')
+    parser.add_argument('--workers', required=False, type=int, default=1, help='--workers passed to the report scripts. Default = 1')
+    parser.add_argument('--renderer', required=False, default='docx', choices=['docx', 'fast'], help='--renderer passed to the report scripts. Default = docx')
+    parser.add_argument('--dated', required=False, action='store_true', help='use day_month_year_ID sample headers')
+    parser.add_argument('--seed', required=False, type=int, default=0, help='random seed of the synthetic data. Default = 0')
+    parser.add_argument('--output', required=False, default='benchmark_results.json', help='json results file. Default = benchmark_results.json')
+    parser.add_argument('--work-dir', required=False, help='directory for the synthetic runs, kept afterwards. Default = a temporary directory')
+    args = parser.parse_args()
+    args.scripts = args.scripts.split(",")
+
+    work_root = args.work_dir or tempfile.mkdtemp(prefix="uvri-bench.")
+    stub_dir = os.path.join(work_root, "stubs")
+    write_stubs(stub_dir)
+    write_logos(stub_dir)
+    env = dict(os.environ, PATH=stub_dir + os.pathsep + os.environ.get("PATH", ""),
+               QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen"))
+
+    report = {
+        "commit": git_commit(),
+        "started": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "seed": args.seed,
+        "results": [],
+    }
+    print("samples\tscript\tmode\twall (s)\tCPU (s)\tpeak RSS (MB)\texit code")
+    try:
+        for scale in [int(x) for x in args.scales.split(",")]:
+            n = scale * args.base
+            report["results"].extend(scale_run(n, os.path.join(work_root, "scale" + str(scale)), env, stub_dir, args))
+    finally:
+        with open(args.output, "w") as out:
+            json.dump(report, out, indent=2)
+        if not args.work_dir:
+            shutil.rmtree(work_root)
+    print("Results saved to " + args.output)
+    failed = [result for result in report["results"] if result["failed"]]
+    if failed:
+        for result in failed:
+            print("FAILED: " + result["script"] + " (" + result["mode"] + ") on " + str(result["samples"]) +
+                  " samples exited with code " + str(result["exit_code"]), file=sys.stderr)
+        sys.exit(1)
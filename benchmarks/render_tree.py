@@ -0,0 +1,76 @@
+#!/usr/bin/env python3.6
+
+'''
+Render time and peak memory of visualise_phylogeny.py on random trees of the
+16 reference sequences plus samples, drawing every leaf against the --scalable
+mode with collapsed clades. Each render runs in its own process so its peak
+memory is measured alone.
+'''
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+script = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin', 'visualise_phylogeny.py')
+
+REFERENCES = ['A1', 'A2', 'AE', 'AG', 'B1', 'B2', 'C1', 'C2', 'D1', 'D2', 'F1', 'G1', 'G2', 'H', 'J', 'K']
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--leaves', required=False, default='1000,5000,20000', help='comma separated tree sizes. Default = 1000,5000,20000')
+parser.add_argument('--format', required=False, default='png', choices=['pdf', 'svg', 'png'], help='output format. Default = png')
+parser.add_argument('--skip-full', required=False, action='store_true', help='only time the --scalable mode')
+parser.add_argument('--seed', required=False, type=int, default=1, help='random seed. Default = 1')
+args = parser.parse_args()
+
+
+def random_tree(n, rng):
+    """
+    Unrooted RAxML style newick of the references plus n - 16 samples, with
+    samples joined to nearby samples more often than at random.
+    """
+    clades = [name + ":0.05" for name in REFERENCES]
+    clades += ["V" + str(i) + ":" + "{0:.6f}".format(rng.random() / 10) for i in range(n - len(REFERENCES))]
+    rng.shuffle(clades)
+    while len(clades) > 3:
+        i = rng.randrange(len(clades) - 1)
+        j = i + 1 if rng.random() < 0.8 else rng.randrange(len(clades))
+        if i == j:
+            continue
+        clades[min(i, j)] = ("(" + clades[i] + "," + clades[j] + "):" + "{0:.6f}".format(rng.random() / 10) +
+                             "[" + str(rng.randint(0, 100)) + "]")
+        del clades[max(i, j)]
+    return "(" + ",".join(clades) + ");"
+
+
+def render(tree, options, out_dir):
+    output = os.path.join(out_dir, "tree." + args.format)
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, script, "--tree", tree, "--reroot", "--output", output] + options,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               env=dict(os.environ, QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen")))
+    pid, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    if status != 0:
+        return "failed", "", ""
+    # ru_maxrss is in kilobytes on Linux
+    return "{0:.2f}".format(elapsed), "{0:.0f}".format(usage.ru_maxrss / 1024.0), str(os.path.getsize(output) // 1024)
+
+
+rng = random.Random(args.seed)
+modes = [("scalable", ["--scalable"]), ("scalable circular", ["--scalable", "--layout", "circular"])]
+if not args.skip_full:
+    modes.insert(0, ("every leaf", []))
+print("leaves\tmode\ttime (s)\tpeak RSS (MB)\toutput (kB)")
+with tempfile.TemporaryDirectory() as out_dir:
+    for n in [int(x) for x in args.leaves.split(",")]:
+        tree = os.path.join(out_dir, "tree" + str(n) + ".nwk")
+        with open(tree, "w") as out:
+            out.write(random_tree(n, rng))
+        for name, options in modes:
+            print(str(n) + "\t" + name + "\t" + "\t".join(render(tree, options, out_dir)))
+            sys.stdout.flush()
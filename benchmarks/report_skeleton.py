@@ -0,0 +1,51 @@
+#!/usr/bin/env python3.6
+
+'''
+Timing comparison of building every .docx report from scratch against cloning
+the prebuilt report skeleton. Run from the directory holding the logo images.
+'''
+
+import os
+import io
+import sys
+import time
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+import parse_json_write_docx as reports
+from patient_data import load_patient_data
+from sierra_ir import load_results
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--json', required=True, help='input json file containing query results')
+parser.add_argument('--data', required=True, help='input text-tab delimited file with the dataset of patient data')
+parser.add_argument('--repeat', required=False, type=int, default=5, help='number of passes over the samples. Default = 5')
+args = parser.parse_args()
+
+patientdata = load_patient_data(args.data)
+
+data = list(load_results(args.json))
+
+
+def run(skeleton):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(args.repeat):
+            for i in data:
+                reports.build_report(i, patientdata, skeleton).save(io.BytesIO())
+    return time.perf_counter() - start
+
+
+n = len(data) * args.repeat
+rebuild = run(None)
+# the one-off cost of building the skeleton is charged to the template path
+start = time.perf_counter()
+skeleton = reports.build_skeleton()
+build = time.perf_counter() - start
+template = run(skeleton) + build
+print("reports built:\t" + str(n))
+print("rebuild per report (ms):\t" + "{0:.2f}".format(1000 * rebuild / n))
+print("skeleton per report (ms):\t" + "{0:.2f}".format(1000 * template / n))
+print("speed-up:\t" + "{0:.2f}x".format(rebuild / template))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3.6
+
+'''
+Timing comparison of reading a RAxML support tree the old way (regex rewrite of
+the "[support]" labels into NHX tags, then ete3's parser) against the single
+pass parser plus in-process rerooting of phylo_tree.py, on random trees. The
+old path also ran raxmlHPC -f I and read its output file, which is not timed.
+'''
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+from ete3 import Tree
+from phylo_tree import parse_newick, reroot_balanced, reroot_midpoint
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--leaves', required=False, default='1000,5000,20000', help='comma separated tree sizes. Default = 1000,5000,20000')
+parser.add_argument('--seed', required=False, type=int, default=1, help='random seed. Default = 1')
+args = parser.parse_args()
+
+
+def random_tree(n, rng):
+    """
+    Unrooted RAxML style newick with n leaves and "[support]" branch labels.
+    """
+    clades = ["S" + str(i) + ":" + "{0:.6f}".format(rng.random() / 10) for i in range(n)]
+    while len(clades) > 3:
+        a = clades.pop(rng.randrange(len(clades)))
+        b = clades.pop(rng.randrange(len(clades)))
+        clades.append("(" + a + "," + b + "):" + "{0:.6f}".format(rng.random() / 10) + "[" + str(rng.randint(0, 100)) + "]")
+    return "(" + ",".join(clades) + ");"
+
+
+def timed(func, nw):
+    start = time.perf_counter()
+    func(nw)
+    return time.perf_counter() - start
+
+
+def old(nw):
+    nhx = re.sub(r":(\d+\.\d+)\[(\d+)\]", ":\\1[&&NHX:support=\\2]", nw)
+    return Tree(nhx, quoted_node_names=True, format=1)
+
+
+def new_balanced(nw):
+    reroot_balanced(parse_newick(nw))
+
+
+def new_midpoint(nw):
+    reroot_midpoint(parse_newick(nw))
+
+
+rng = random.Random(args.seed)
+print("leaves\tregex+ete3 parse (s)\tparse+balanced reroot (s)\tparse+midpoint root (s)")
+for n in [int(x) for x in args.leaves.split(",")]:
+    nw = random_tree(n, rng)
+    print(str(n) + "\t" + "\t".join("{0:.3f}".format(timed(func, nw)) for func in (old, new_balanced, new_midpoint)))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3.6
+
+'''
+Generators of synthetic runs at any size: a multi-sample fasta, the matching
+sierrapy json (drugResistance/drugScores/partialScores nested the way the
+HIVdb webservice returns them) and a patient information table, all keyed on
+the same sample IDs. Run directly to write one synthetic run to a directory.
+'''
+
+import os
+import json
+import random
+import argparse
+
+
+PATIENT_COLUMNS = ['Your Sample ID', 'Our/Alternative ID', 'Sample collection date', 'Date of Birth',
+                   'Initials or Name', 'Sex', 'Facility or clinic name', 'Sample Type', 'Viral Load',
+                   'Viral load Date', 'Lab Request Date', 'Requesting Clinician', 'Email Requesting Clinician',
+                   'Report prepared by', 'Report Date', 'Approved by']
+
+FACILITIES = ['MSF MALAWI', 'GHWP', 'GPC', 'MILDMAY', 'TASO ENTEBBE', 'KISENYI HC IV']
+
+SUBTYPES = ['A1', 'C', 'D', 'CRF01_AE', 'CRF02_AG', 'B', 'G', 'NA']
+
+# gene -> (length, [(drug class, name, display abbreviation, full name)], mutation pool)
+GENES = [
+    ('PR', 99, [('PI', 'ATV', 'ATV/r', 'atazanavir/r'), ('PI', 'DRV', 'DRV/r', 'darunavir/r'),
+                ('PI', 'FPV', 'FPV/r', 'fosamprenavir/r'), ('PI', 'IDV', 'IDV/r', 'indinavir/r'),
+                ('PI', 'LPV', 'LPV/r', 'lopinavir/r'), ('PI', 'NFV', 'NFV', 'nelfinavir'),
+                ('PI', 'SQV', 'SQV/r', 'saquinavir/r'), ('PI', 'TPV', 'TPV/r', 'tipranavir/r')],
+     [('M46I', 'Major'), ('I54V', 'Major'), ('V82A', 'Major'), ('L90M', 'Major'), ('L10F', 'Accessory')]),
+    ('RT', 560, [('NRTI', 'ABC', 'ABC', 'abacavir'), ('NRTI', 'AZT', 'AZT', 'zidovudine'),
+                 ('NRTI', 'D4T', 'D4T', 'stavudine'), ('NRTI', 'DDI', 'DDI', 'didanosine'),
+                 ('NRTI', 'FTC', 'FTC', 'emtricitabine'), ('NRTI', 'LMV', '3TC', 'lamivudine'),
+                 ('NRTI', 'TDF', 'TDF', 'tenofovir'), ('NNRTI', 'DOR', 'DOR', 'doravirine'),
+                 ('NNRTI', 'EFV', 'EFV', 'efavirenz'), ('NNRTI', 'ETR', 'ETR', 'etravirine'),
+                 ('NNRTI', 'NVP', 'NVP', 'nevirapine'), ('NNRTI', 'RPV', 'RPV', 'rilpivirine')],
+     [('M184V', 'NRTI'), ('K65R', 'NRTI'), ('T215Y', 'NRTI'), ('D67N', 'NRTI'),
+      ('K103N', 'NNRTI'), ('Y181C', 'NNRTI'), ('G190A', 'NNRTI'), ('V106M', 'NNRTI')]),
+    ('IN', 288, [('INSTI', 'BIC', 'BIC', 'bictegravir'), ('INSTI', 'CAB', 'CAB', 'cabotegravir'),
+                 ('INSTI', 'DTG', 'DTG', 'dolutegravir'), ('INSTI', 'EVG', 'EVG', 'elvitegravir'),
+                 ('INSTI', 'RAL', 'RAL', 'raltegravir')],
+     [('N155H', 'Major'), ('Q148H', 'Major'), ('G140S', 'Accessory'), ('E138K', 'Accessory')]),
+]
+
+LEVELS = [(60, 'High-Level Resistance'), (30, 'Intermediate Resistance'), (15, 'Low-Level Resistance'),
+          (10, 'Potential Low-Level Resistance'), (0, 'Susceptible')]
+
+
+def sample_ids(n, dated=False, seed=0):
+    """
+    :param dated: headers of the form day_month_year_ID, as used for surveillance runs
+    """
+    rng = random.Random(seed)
+    ids = []
+    for i in range(n):
+        sample = "V19-09-" + str(100000 + i)
+        if dated:
+            sample = "{0:02d}_{1:02d}_{2}_{3}".format(rng.randint(1, 28), rng.randint(1, 12), rng.randint(2005, 2020), sample)
+        ids.append(sample)
+    return ids
+
+
+def write_fasta(path, ids, length=1300, seed=0):
+    """
+    Sequences mutated from a few ancestors, with the odd ambiguity code. The
+    ancestors have no stop codons in frame, like real pol sequences.
+    """
+    rng = random.Random(seed)
+    codons = [a + b + c for a in "ACGT" for b in "ACGT" for c in "ACGT" if a + b + c not in ("TAA", "TAG", "TGA")]
+    ancestors = ["".join(rng.choice(codons) for _ in range(length // 3 + 1))[:length] for _ in range(8)]
+    with open(path, "w") as out:
+        for sample in ids:
+            seq = list(rng.choice(ancestors))
+            for _ in range(length // 100):
+                seq[rng.randrange(length)] = rng.choice("ACGTACGTACGTRYKM")
+            out.write(">" + sample + "\n" + "".join(seq) + "\n")
+
+
+def sequence_result(sample, rng, resistance=0.3):
+    """
+    One sierrapy result: aligned genes, drug scores with their partial scores
+    and the mutations grouped by type.
+    """
+    genes, resistance_list = [], []
+    for gene, length, drugs, pool in GENES:
+        genes.append({"firstAA": 1, "lastAA": length, "gene": {"name": gene, "length": length},
+                      "mutations": [], "SDRMs": []})
+        present = [m for m in pool if rng.random() < resistance / 2]
+        scores = []
+        for drug_class, name, abbr, full in drugs:
+            partial = []
+            for text, primary in present:
+                if rng.random() < 0.6:
+                    partial.append({"mutations": [{"text": text, "primaryType": primary,
+                                                   "comments": [{"type": primary, "text": text + " is a " + primary +
+                                                                 " resistance mutation selected by " + full + "."}]}],
+                                    "score": float(rng.choice([5, 10, 15, 30, 60]))})
+            score = sum(p["score"] for p in partial)
+            text = next(label for threshold, label in LEVELS if score >= threshold)
+            scores.append({"drugClass": {"name": drug_class}, "drug": {"name": name, "displayAbbr": abbr, "fullName": full},
+                           "score": score, "partialScores": partial, "text": text})
+        types = sorted(set(primary for text, primary in pool))
+        by_type = [{"mutationType": t, "mutations": [{"text": text} for text, primary in present if primary == t]}
+                   for t in types]
+        resistance_list.append({"gene": {"name": gene}, "drugScores": scores, "mutationsByTypes": by_type})
+    subtype = rng.choice(SUBTYPES)
+    validation = []
+    if rng.random() < 0.1:
+        validation.append({"level": "WARNING", "message": "There are 3 unusual mutations in RT."})
+    return {"inputSequence": {"header": sample},
+            "subtypeText": subtype if subtype == "NA" else subtype + " (" + "{0:.1f}".format(rng.uniform(1, 6)) + "%)",
+            "validationResults": validation, "alignedGeneSequences": genes, "drugResistance": resistance_list}
+
+
+def write_json(path, ids, seed=0):
+    """
+    Written one result at a time, like the streamed webservice response.
+    """
+    rng = random.Random(seed)
+    with open(path, "w") as out:
+        out.write("[")
+        for n, sample in enumerate(ids):
+            if n:
+                out.write(",\n")
+            json.dump(sequence_result(sample, rng), out)
+        out.write("]\n")
+
+
+def write_patients(path, ids, seed=0):
+    rng = random.Random(seed)
+    months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+    def date(first_year, last_year):
+        return "{0:02d}-{1}-{2:02d}".format(rng.randint(1, 28), rng.choice(months), rng.randint(first_year, last_year) % 100)
+
+    with open(path, "w") as out:
+        out.write("\t".join(PATIENT_COLUMNS) + "\n")
+        for sample in ids:
+            collected = date(2005, 2020)
+            row = ["NMTH " + str(rng.randint(1000, 9999)), sample, collected, date(1960, 2005),
+                   "".join(rng.choice("ABCDEFGHKLMNPRST") for _ in range(2)), rng.choice(["M", "F", ""]),
+                   rng.choice(FACILITIES), rng.choice(["DBS", "Plasma"]), str(rng.randint(1000, 500000)), collected,
+                   date(2019, 2020), "Dr. Williams", "clinician@example.org", "Maria N", date(2019, 2020), "Dr. Kintu"]
+            out.write("\t".join(row) + "\n")
+
+
+def write_references(path, length=1300, seed=0):
+    """
+    Aligned stand-ins for HIV_aligned_references.fasta, with the same names.
+    """
+    rng = random.Random(seed)
+    names = ['A1', 'A2', 'AE', 'AG', 'B1', 'B2', 'C1', 'C2', 'D1', 'D2', 'F1', 'G1', 'G2', 'H', 'J', 'K']
+    with open(path, "w") as out:
+        for name in names:
+            out.write(">" + name + "\n" + "".join(rng.choice("ACGT") for _ in range(length)) + "\n")
+
+
+def write_run(out_dir, n, dated=False, seed=0):
+    """
+    :return: tuple of (fasta, json, patient table) paths
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    ids = sample_ids(n, dated, seed)
+    paths = (os.path.join(out_dir, "synthetic.fas"), os.path.join(out_dir, "synthetic.json"),
+             os.path.join(out_dir, "synthetic_patients.txt"))
+    write_fasta(paths[0], ids, seed=seed)
+    write_json(paths[1], ids, seed=seed)
+    write_patients(paths[2], ids, seed=seed)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samples', required=True, type=int, help='number of samples')
+    parser.add_argument('--out-dir', required=True, help='directory to write synthetic.fas, synthetic.json and synthetic_patients.txt to')
+    parser.add_argument('--dated', required=False, action='store_true', help='use day_month_year_ID sample headers')
+    parser.add_argument('--seed', required=False, type=int, default=0, help='random seed. Default = 0')
+    args = parser.parse_args()
+
+    for path in write_run(args.out_dir, args.samples, args.dated, args.seed):
+        print(path)
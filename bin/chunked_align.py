@@ -0,0 +1,136 @@
+#!/usr/bin/env python3.6
+
+'''
+Align a run's samples to the reference alignment in parallel chunks. The
+reference alignment is preprocessed once (sequences upper-cased, all-gap
+columns dropped) and cached under a hash of the file; the samples are then
+split into chunks that are each added with mafft --addfragments --keeplength,
+so every chunk comes back in the reference coordinates and the chunks can be
+stitched into one alignment of the references followed by the samples.
+'''
+
+import os
+import hashlib
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from hivdb_cache import DEFAULT_CACHE_DIR
+from fasta_io import read_fasta, write_fasta, chunk_records
+import telemetry
+
+
+PROFILE_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, "reference-profiles")
+
+# smallest useful chunk: below this the per-process start up of mafft dominates
+MIN_CHUNK = 25
+
+
+def drop_gap_columns(records):
+    """
+    :param records: aligned (header, sequence) tuples
+    :return: the records without the columns that are a gap in every sequence
+    """
+    widths = set(len(sequence) for header, sequence in records)
+    if len(widths) != 1:
+        raise ValueError("not an alignment: sequence lengths differ")
+    keep = [n for n in range(widths.pop()) if any(sequence[n] != "-" for header, sequence in records)]
+    return [(header, "".join(sequence[n] for n in keep)) for header, sequence in records]
+
+
+def reference_profile(reference, cache_dir=PROFILE_CACHE_DIR):
+    """
+    Preprocessed copy of the reference alignment, built on first use.
+
+    :return: tuple of (path of the cached profile, list of (header, sequence))
+    """
+    with open(reference, "rb") as ref:
+        key = hashlib.sha256(ref.read()).hexdigest()
+    path = os.path.join(cache_dir, key + ".fasta")
+    if os.path.exists(path):
+        return path, read_fasta(path)
+
+    try:
+        records = drop_gap_columns([(header, sequence.upper()) for header, sequence in read_fasta(reference)])
+    except ValueError as exc:
+        raise ValueError(reference + ": " + str(exc))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    os.close(fd)
+    write_fasta(records, tmp)
+    os.replace(tmp, path)
+    return path, records
+
+
+def plan_chunks(n_samples, cpus, chunk_size=None):
+    """
+    Split the samples over the cores: one mafft process per chunk, each with
+    an equal share of the threads.
+
+    :return: tuple of (chunk size, concurrent processes, threads per process)
+    """
+    cpus = max(1, cpus)
+    if chunk_size is None:
+        chunk_size = max(MIN_CHUNK, -(-n_samples // cpus))
+    chunks = max(1, -(-n_samples // chunk_size))
+    processes = min(chunks, cpus)
+    return chunk_size, processes, max(1, cpus // processes)
+
+
+def align_chunk(profile, chunk, work_dir, n, threads):
+    """
+    Add one chunk of samples to the reference profile.
+
+    :return: list of (header, aligned sequence) of the chunk's samples
+    """
+    chunk_in = os.path.join(work_dir, "chunk" + str(n) + ".fasta")
+    chunk_out = os.path.join(work_dir, "chunk" + str(n) + ".aln")
+    write_fasta(chunk, chunk_in)
+    with open(chunk_out, "w") as out:
+        telemetry.get().run(["mafft", "--thread", str(threads), "--addfragments", chunk_in, "--keeplength", profile],
+                            stdout=out, stderr=subprocess.DEVNULL, check=True)
+    wanted = set(header for header, sequence in chunk)
+    return [record for record in read_fasta(chunk_out) if record[0] in wanted]
+
+
+def align(fasta, reference, output, cpus=1, chunk_size=None, cache_dir=PROFILE_CACHE_DIR):
+    profile, references = reference_profile(reference, cache_dir)
+    samples = read_fasta(fasta)
+    width = len(references[0][1])
+    chunk_size, processes, threads = plan_chunks(len(samples), cpus, chunk_size)
+    chunks = chunk_records(samples, chunk_size)
+    print ("Aligning " + str(len(samples)) + " samples in " + str(len(chunks)) + " chunk(s), " +
+           str(processes) + " process(es) x " + str(threads) + " thread(s)")
+
+    work_dir = tempfile.mkdtemp(prefix="align.", dir=os.path.dirname(os.path.abspath(output)))
+    try:
+        with ThreadPoolExecutor(max_workers=processes) as executor:
+            aligned = list(executor.map(lambda job: align_chunk(profile, job[1], work_dir, job[0], threads),
+                                        enumerate(chunks)))
+    finally:
+        for name in os.listdir(work_dir):
+            os.remove(os.path.join(work_dir, name))
+        os.rmdir(work_dir)
+
+    records = list(references)
+    for chunk in aligned:
+        for header, sequence in chunk:
+            if len(sequence) != width:
+                raise ValueError(header + " was aligned to " + str(len(sequence)) + " columns, expected " + str(width))
+            records.append((header, sequence))
+    write_fasta(records, output)
+    print ("Alignment saved to " + output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fasta', required=True, help='input sequences in single multi-sample fasta format file')
+    parser.add_argument('--reference', required=True, help='aligned HIV-1 reference sequences')
+    parser.add_argument('--output', required=True, help='alignment of the references followed by the samples, in the reference columns')
+    parser.add_argument('--cpus', required=False, type=int, default=os.cpu_count() or 1, help='number of cores shared by the mafft processes. Default = all cores')
+    parser.add_argument('--chunk-size', required=False, type=int, help='samples per mafft process. Default = spread evenly over the cores, at least ' + str(MIN_CHUNK))
+    parser.add_argument('--cache-dir', required=False, default=PROFILE_CACHE_DIR, help='directory holding preprocessed reference profiles. Default = ' + PROFILE_CACHE_DIR)
+    args = parser.parse_args()
+
+    align(args.fasta, args.reference, args.output, args.cpus, args.chunk_size, args.cache_dir)
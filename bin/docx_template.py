@@ -0,0 +1,135 @@
+#!/usr/bin/env python3.6
+
+'''
+Building blocks for writing .docx files as raw XML: run and paragraph markup
+written the same way python-docx writes it, templates with named slots cut out
+of XML that python-docx produced, and a zip package whose unchanging parts
+(styles, theme, logos, ...) are compressed once and copied into every file.
+'''
+
+import re
+import zlib
+import struct
+import datetime
+
+
+# characters lxml refuses in XML text
+INVALID_XML = re.compile(u"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+SLOT = "@@{0}@@"
+SLOT_PATTERN = re.compile(r"<w:t>@@(\w+)@@</w:t>")
+
+
+def escape(text):
+    if INVALID_XML.search(text):
+        raise ValueError("All strings must be XML compatible: " + repr(text))
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def run_content(text):
+    """
+    Inner XML of a run holding text, as python-docx writes it: tabs become
+    <w:tab/>, line breaks <w:br/>, and each stretch of other characters a
+    <w:t>, marked to preserve spaces if it starts or ends with whitespace.
+    """
+    parts = []
+    for piece in re.split(r"([\t\r\n])", text):
+        if piece == "\t":
+            parts.append("<w:tab/>")
+        elif piece in ("\r", "\n"):
+            parts.append("<w:br/>")
+        elif piece:
+            if len(piece.strip()) < len(piece):
+                parts.append('<w:t xml:space="preserve">' + escape(piece) + "</w:t>")
+            else:
+                parts.append("<w:t>" + escape(piece) + "</w:t>")
+    return "".join(parts)
+
+
+def run(text, bold=False):
+    content = ("<w:rPr><w:b/></w:rPr>" if bold else "") + run_content(text)
+    return "<w:r>" + content + "</w:r>" if content else "<w:r/>"
+
+
+def paragraph(content="", style=None):
+    """
+    :param content: XML of the paragraph's runs
+    :param style: paragraph style id, e.g. Heading1
+    """
+    props = '<w:pPr><w:pStyle w:val="' + style + '"/></w:pPr>' if style else ""
+    if not props and not content:
+        return "<w:p/>"
+    return "<w:p>" + props + content + "</w:p>"
+
+
+class Template(object):
+    """
+    XML with named slots. Each slot is a <w:t>@@name@@</w:t> element of the
+    source and is filled with the run content of a text value.
+    """
+
+    def __init__(self, xml):
+        self.parts = SLOT_PATTERN.split(xml)
+        self.names = self.parts[1::2]
+
+    def fill(self, values):
+        out = list(self.parts)
+        for n in range(1, len(out), 2):
+            out[n] = run_content(values[out[n]])
+        # a run left without content is written as an empty element
+        return "".join(out).replace("<w:r></w:r>", "<w:r/>")
+
+
+def strip_namespaces(xml):
+    """
+    Drop the namespace declarations lxml repeats on an element serialised on
+    its own, so it matches the element's markup inside the whole part.
+    """
+    return re.sub(r' xmlns:\w+="[^"]*"', "", xml, count=0)
+
+
+def _dos_time(date_time):
+    year, month, day, hour, minute, second = date_time[:6]
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+class Package(object):
+    """
+    Zip package of fixed parts plus parts that change per file. The fixed
+    parts are deflated once here; write() only compresses the changing ones.
+
+    :param parts: list of (name, bytes or None) in archive order; None marks a
+                  part supplied to every write()
+    """
+
+    def __init__(self, parts, date_time=None):
+        self.time, self.date = _dos_time(date_time or datetime.datetime.now().timetuple())
+        self.entries = []
+        for name, data in parts:
+            self.entries.append((name.encode("ascii"), None if data is None else self._deflate(data)))
+
+    @staticmethod
+    def _deflate(data):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        return zlib.crc32(data) & 0xffffffff, len(data), compressor.compress(data) + compressor.flush()
+
+    def write(self, out, parts):
+        """
+        :param out: binary file object
+        :param parts: dict of name -> bytes of the changing parts
+        """
+        offset = 0
+        central = []
+        for name, entry in self.entries:
+            crc, size, data = entry if entry is not None else self._deflate(parts[name.decode("ascii")])
+            header = struct.pack("<IHHHHHIIIHH", 0x04034b50, 20, 0, 8, self.time, self.date, crc, len(data), size,
+                                 len(name), 0)
+            out.write(header)
+            out.write(name)
+            out.write(data)
+            central.append(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014b50, 20, 20, 0, 8, self.time, self.date, crc,
+                                       len(data), size, len(name), 0, 0, 0, 0, 0, offset) + name)
+            offset += len(header) + len(name) + len(data)
+        directory = b"".join(central)
+        out.write(directory)
+        out.write(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, len(central), len(central), len(directory), offset, 0))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3.6
+
+'''
+Long-format, columnar table of drug resistance scores with one row per
+(sample, gene, drug, mutation). String columns are dictionary encoded as they
+are appended, so the table is built in flat typed buffers rather than as Python
+objects per row, and written to Parquet, Arrow IPC or a directory of .npy files
+that can be memory-mapped column by column.
+'''
+
+import os
+import json
+import array
+
+
+STRING_COLUMNS = ['sample', 'gene', 'drug_class', 'drug', 'mutation']
+NUMBER_COLUMNS = ['score', 'partial_score']
+COLUMNS = ['sample', 'gene', 'drug_class', 'drug', 'score', 'mutation', 'partial_score']
+
+
+class LongTable(object):
+    """
+    Accumulates rows into per-column buffers. String columns hold integer codes
+    into a per-column list of distinct values; missing values have code -1.
+    """
+
+    def __init__(self):
+        self.codes = dict((name, array.array('i')) for name in STRING_COLUMNS)
+        self.values = dict((name, array.array('d')) for name in NUMBER_COLUMNS)
+        self.categories = dict((name, []) for name in STRING_COLUMNS)
+        self._index = dict((name, {}) for name in STRING_COLUMNS)
+
+    def __len__(self):
+        return len(self.values['score'])
+
+    def _code(self, name, value):
+        if value is None:
+            return -1
+        index = self._index[name]
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(self.categories[name])
+            self.categories[name].append(value)
+        return code
+
+    def append(self, sample, gene, drug_class, drug, score, mutation=None, partial_score=None):
+        row = {'sample': sample, 'gene': gene, 'drug_class': drug_class, 'drug': drug, 'mutation': mutation}
+        for name in STRING_COLUMNS:
+            self.codes[name].append(self._code(name, row[name]))
+        self.values['score'].append(score)
+        self.values['partial_score'].append(float('nan') if partial_score is None else partial_score)
+
+    def add_result(self, i, sample):
+        """
+        Add every drug score of one normalised sierrapy sequence result (see
+        sierra_ir.py). Drugs with a non-zero score get one row per scored
+        mutation (or mutation combination); other drugs get a single row
+        without a mutation.
+        """
+        for j in i.resistance:
+            for k in j.scores:
+                partials = k.partials if k.score != 0.0 else ()
+                for m in partials:
+                    self.append(sample, j.gene, k.drug.drug_class, k.drug.name, k.score, " + ".join(m.mutations), m.score)
+                if not partials:
+                    self.append(sample, j.gene, k.drug.drug_class, k.drug.name, k.score)
+
+    def arrays(self):
+        """
+        :return: dict of column name -> numpy array (int32 codes for string columns)
+        """
+        import numpy as np
+        columns = {}
+        for name in STRING_COLUMNS:
+            columns[name] = np.frombuffer(self.codes[name], dtype=np.int32)
+        for name in NUMBER_COLUMNS:
+            columns[name] = np.frombuffer(self.values[name], dtype=np.float64)
+        return columns
+
+    def write(self, path):
+        """
+        Write the table; the format follows the file extension: .parquet,
+        .arrow/.feather (Arrow IPC), anything else is a directory of .npy files.
+        """
+        ext = os.path.splitext(path)[1].lower()
+        if ext in ('.parquet', '.arrow', '.feather'):
+            self._write_arrow(path, ext)
+        else:
+            self._write_npy(path)
+
+    def _write_arrow(self, path, ext):
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise SystemExit("pyarrow is required to write " + path + " - install it or use a .npy directory")
+        columns = self.arrays()
+        fields = []
+        for name in COLUMNS:
+            if name in STRING_COLUMNS:
+                codes = pa.array(columns[name], mask=columns[name] < 0)
+                fields.append(pa.DictionaryArray.from_arrays(codes, pa.array(self.categories[name], type=pa.string())))
+            else:
+                fields.append(pa.array(columns[name]))
+        table = pa.Table.from_arrays(fields, names=COLUMNS)
+        if ext == '.parquet':
+            import pyarrow.parquet as pq
+            pq.write_table(table, path)
+        else:
+            import pyarrow.feather as feather
+            feather.write_feather(table, path, compression='uncompressed')
+
+    def _write_npy(self, path):
+        import numpy as np
+        os.makedirs(path, exist_ok=True)
+        for name, values in self.arrays().items():
+            np.save(os.path.join(path, name + '.npy'), values)
+        with open(os.path.join(path, 'categories.json'), 'w') as out:
+            json.dump({'columns': COLUMNS, 'categories': self.categories}, out)
+
+
+def read_npy(path, mmap=True):
+    """
+    Open a table written as a .npy directory.
+
+    :return: tuple of (dict of column -> numpy array, dict of column -> category list)
+    """
+    import numpy as np
+    with open(os.path.join(path, 'categories.json')) as meta:
+        categories = json.load(meta)['categories']
+    columns = dict((name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None))
+                   for name in COLUMNS)
+    return columns, categories
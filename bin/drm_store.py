@@ -0,0 +1,156 @@
+#!/usr/bin/env python3.6
+
+'''
+Cumulative SQLite store of drug resistance results across sequencing runs.
+Each run is appended by parse_json_store_metadata.py; re-ingesting a run
+replaces its rows. A prevalence table of per (year, month, facility, drug)
+counts is kept up to date on every ingest, so surveillance queries do not
+need to re-read any historical results.
+'''
+
+import sqlite3
+import datetime
+
+
+# HIVdb penalty score thresholds for each resistance level
+LEVELS = [
+    ('potential', 10),
+    ('low', 15),
+    ('intermediate', 30),
+    ('high', 60),
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    source TEXT,
+    ingested TEXT,
+    n_samples INTEGER
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run_id TEXT NOT NULL,
+    sample_id TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    study_month INTEGER,
+    facility TEXT NOT NULL,
+    PRIMARY KEY (run_id, sample_id)
+);
+CREATE TABLE IF NOT EXISTS drug_scores (
+    run_id TEXT NOT NULL,
+    sample_id TEXT NOT NULL,
+    gene TEXT,
+    drug_class TEXT,
+    drug TEXT NOT NULL,
+    score REAL NOT NULL,
+    mutations TEXT,
+    PRIMARY KEY (run_id, sample_id, drug)
+);
+CREATE TABLE IF NOT EXISTS prevalence (
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    facility TEXT NOT NULL,
+    drug TEXT NOT NULL,
+    n_samples INTEGER NOT NULL,
+    """ + ",\n    ".join("n_" + level + " INTEGER NOT NULL" for level, threshold in LEVELS) + """,
+    PRIMARY KEY (year, month, facility, drug)
+);
+CREATE INDEX IF NOT EXISTS samples_sample_id ON samples (sample_id);
+CREATE INDEX IF NOT EXISTS samples_study_month ON samples (study_month);
+CREATE INDEX IF NOT EXISTS drug_scores_sample_id ON drug_scores (sample_id);
+CREATE INDEX IF NOT EXISTS drug_scores_drug ON drug_scores (drug);
+"""
+
+# per (year, month, facility, drug) counts contributed by one run
+RUN_COUNTS = """
+SELECT s.year, s.month, s.facility, d.drug, count(*), """ + ", ".join(
+    "sum(d.score >= " + str(threshold) + ")" for level, threshold in LEVELS) + """
+FROM drug_scores d JOIN samples s ON s.run_id = d.run_id AND s.sample_id = d.sample_id
+WHERE d.run_id = ?
+GROUP BY s.year, s.month, s.facility, d.drug
+"""
+
+
+def drug_rows(i):
+    """
+    :return: list of (gene, drug class, drug, score, mutations) for one normalised sierrapy result (see sierra_ir.py)
+    """
+    rows = []
+    for j in i.resistance:
+        for k in j.scores:
+            mutations = []
+            if k.score != 0.0:
+                mutations = [" + ".join(p.mutations) for p in k.partials]
+            rows.append((j.gene, k.drug.drug_class, k.drug.name, k.score, ", ".join(mutations)))
+    return rows
+
+
+class DRMStore(object):
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _apply_counts(self, run_id, sign):
+        """
+        Add (sign=1) or remove (sign=-1) a run's contribution to the prevalence table.
+        """
+        counts = self.conn.execute(RUN_COUNTS, (run_id,)).fetchall()
+        names = ["n_samples"] + ["n_" + level for level, threshold in LEVELS]
+        update = ("UPDATE prevalence SET " + ", ".join(name + " = " + name + " + ?" for name in names) +
+                  " WHERE year = ? AND month = ? AND facility = ? AND drug = ?")
+        insert = ("INSERT INTO prevalence (year, month, facility, drug, " + ", ".join(names) + ") VALUES (" +
+                  ", ".join("?" * (4 + len(names))) + ")")
+        for row in counts:
+            key, values = row[:4], tuple(sign * n for n in row[4:])
+            if self.conn.execute(update, values + key).rowcount == 0:
+                self.conn.execute(insert, key + values)
+        self.conn.execute("DELETE FROM prevalence WHERE n_samples <= 0")
+
+    def ingest_run(self, run_id, samples, source=None):
+        """
+        Add one run, replacing any earlier copy of it.
+
+        :param run_id: identifier of the run, e.g. the json file name
+        :param samples: list of (sample_id, year, month, study_month, facility, drug rows);
+                        unknown year/month are 0 and unknown facility is ""
+        :param source: file the run was read from, recorded for reference
+        """
+        with self.conn:
+            if self.conn.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone():
+                self._apply_counts(run_id, -1)
+                self.conn.execute("DELETE FROM drug_scores WHERE run_id = ?", (run_id,))
+                self.conn.execute("DELETE FROM samples WHERE run_id = ?", (run_id,))
+                self.conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?)",
+                [(run_id,) + tuple(sample[:5]) for sample in samples])
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO drug_scores VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, sample[0]) + row for sample in samples for row in sample[5]])
+            self.conn.execute("INSERT INTO runs VALUES (?, ?, ?, ?)",
+                              (run_id, source, datetime.datetime.now().isoformat(), len(samples)))
+            self._apply_counts(run_id, 1)
+
+    def prevalence(self, by=('year', 'month', 'facility'), level='low', drug=None):
+        """
+        Resistance prevalence per drug, summed over the prevalence table.
+
+        :param by: grouping columns, any of year, month and facility
+        :param level: minimum resistance level counted as resistant
+        :param drug: restrict to this drug
+        :return: list of tuples (*by, drug, samples, resistant, fraction)
+        """
+        if not set(by) <= set(['year', 'month', 'facility']):
+            raise ValueError("can only group by year, month and facility")
+        if level not in dict(LEVELS):
+            raise ValueError("level must be one of " + ", ".join(name for name, threshold in LEVELS))
+        columns = list(by) + ["drug"]
+        query = ("SELECT " + ", ".join(columns) + ", sum(n_samples), sum(n_" + level + ") FROM prevalence" +
+                 (" WHERE drug = ?" if drug else "") +
+                 " GROUP BY " + ", ".join(columns) + " ORDER BY " + ", ".join(columns))
+        rows = self.conn.execute(query, (drug,) if drug else ()).fetchall()
+        return [row + (float(row[-1]) / row[-2],) for row in rows]
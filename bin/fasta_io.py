@@ -0,0 +1,46 @@
+#!/usr/bin/env python3.6
+
+'''
+Reading and writing of fasta files as (header, sequence) tuples, shared by the
+query, QC, alignment and tree stages.
+'''
+
+
+def iter_fasta(fasta_in):
+    """
+    Yield the (header, sequence) tuples of a fasta file one at a time, in file
+    order, so that only one sequence is held in memory.
+    """
+    header = None
+    seq = []
+    with open(fasta_in) as fasta_file:
+        for line in fasta_file:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith(">"):
+                if header is not None:
+                    yield header, "".join(seq)
+                header = line[1:].strip()
+                seq = []
+            else:
+                seq.append(line)
+    if header is not None:
+        yield header, "".join(seq)
+
+
+def read_fasta(fasta_in):
+    """
+    Read a fasta file into a list of (header, sequence) tuples, in file order.
+    """
+    return list(iter_fasta(fasta_in))
+
+
+def write_fasta(records, path):
+    with open(path, "w") as out:
+        for header, sequence in records:
+            out.write(">" + header + "\n" + sequence + "\n")
+
+
+def chunk_records(records, chunk_size):
+    return [records[n:n + chunk_size] for n in range(0, len(records), chunk_size)]
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3.6
+
+'''
+Quality control and normalisation of the input fasta, ahead of the HIVdb query
+and the alignment. The file is streamed in batches of sequences; each batch is
+joined into one byte array and the per-sequence length, N and IUPAC ambiguity
+fractions, invalid characters and stop codons in each reading frame are
+counted with array lookups and bincounts rather than per-base loops. Sequences
+are upper-cased, U becomes T, gaps are removed and invalid characters become N.
+A QC table lists every sequence with its status (pass, warn or fail) and the
+reasons; with --exclude the failing sequences are left out of the normalised
+fasta, so they are neither queried nor put in the tree.
+'''
+
+import argparse
+import numpy as np
+from fasta_io import iter_fasta
+import telemetry
+
+
+# sequence bytes held in memory at once
+BATCH_BYTES = 4 << 20
+
+BASE, N, AMBIGUOUS, GAP, INVALID = range(5)
+
+# byte -> class of the character
+CLASS = np.full(256, INVALID, dtype=np.uint8)
+# byte -> normalised byte: upper case, U as T, anything invalid as N
+NORMALISE = np.full(256, ord("N"), dtype=np.uint8)
+for chars, kind in (("ACGTU", BASE), ("N", N), ("RYSWKMBDHV", AMBIGUOUS), ("-.", GAP)):
+    for char in chars:
+        for byte in (ord(char), ord(char.lower())):
+            CLASS[byte] = kind
+            NORMALISE[byte] = ord("T") if char == "U" else ord(char)
+
+# normalised byte -> base code, 4 for anything but A, C, G, T; codons are
+# coded in base 5 so that one with an ambiguous base never looks like a stop
+CODE = np.full(256, 4, dtype=np.int16)
+for n, base in enumerate("ACGT"):
+    CODE[ord(base)] = n
+
+STOPS = [25 * CODE[ord(a)] + 5 * CODE[ord(b)] + CODE[ord(c)] for a, b, c in ("TAA", "TAG", "TGA")]
+
+QC_COLUMNS = ["sample", "length", "n_fraction", "ambiguous_fraction", "invalid", "frame", "stop_codons", "status", "reasons"]
+
+
+def measure(sequences):
+    """
+    QC metrics of a batch of sequences.
+
+    :return: tuple of (dict of per-sequence metric arrays, list of normalised sequences)
+    """
+    n = len(sequences)
+    # characters outside latin-1 become "?", one byte each, which is invalid
+    raw = np.frombuffer("".join(sequences).encode("latin-1", errors="replace"), dtype=np.uint8)
+    ids = np.repeat(np.arange(n), [len(sequence) for sequence in sequences])
+    kind = CLASS[raw]
+    keep = kind != GAP
+    ids, kind = ids[keep], kind[keep]
+    clean = NORMALISE[raw[keep]]
+
+    length = np.bincount(ids, minlength=n)
+    n_count = np.bincount(ids[kind == N], minlength=n)
+    ambiguous = np.bincount(ids[kind != BASE], minlength=n)
+    invalid = np.bincount(ids[kind == INVALID], minlength=n)
+
+    # stop codons starting at each position of each sequence, counted per frame
+    stops = np.zeros((n, 3), dtype=np.int64)
+    if len(clean) >= 3:
+        code = CODE[clean]
+        codon = 25 * code[:-2] + 5 * code[1:-1] + code[2:]
+        whole = (ids[:-2] == ids[2:]) & np.isin(codon, STOPS)
+        starts = np.concatenate(([0], np.cumsum(length)[:-1]))
+        positions = np.flatnonzero(whole)
+        frame = (positions - starts[ids[positions]]) % 3
+        stops = np.bincount(ids[positions] * 3 + frame, minlength=3 * n).reshape(n, 3)
+
+    normalised = [part.tobytes().decode("ascii") for part in np.split(clean, np.cumsum(length)[:-1])]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        metrics = {
+            "length": length,
+            "n_fraction": np.where(length > 0, n_count / length, 1.0),
+            "ambiguous_fraction": np.where(length > 0, ambiguous / length, 1.0),
+            "invalid": invalid,
+            # the frame with the fewest stops is taken as the reading frame
+            "frame": stops.argmin(axis=1),
+            "stop_codons": stops.min(axis=1),
+        }
+    return metrics, normalised
+
+
+def batches(records, batch_bytes=BATCH_BYTES):
+    batch = []
+    size = 0
+    for record in records:
+        batch.append(record)
+        size += len(record[1])
+        if size >= batch_bytes:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+
+def judge(metrics, row, seen, min_length, max_ambiguous, max_stops):
+    """
+    :return: tuple of (status, list of reasons)
+    """
+    failures, warnings = [], []
+    length = metrics["length"][row]
+    if length == 0:
+        failures.append("empty sequence")
+    elif length < min_length:
+        failures.append("shorter than " + str(min_length))
+    if metrics["ambiguous_fraction"][row] > max_ambiguous:
+        failures.append("more than " + "{0:.0%}".format(max_ambiguous) + " ambiguous bases")
+    if metrics["invalid"][row]:
+        failures.append(str(metrics["invalid"][row]) + " invalid characters")
+    if seen is not None:
+        failures.append("duplicate header, first at sequence " + str(seen))
+    stops = metrics["stop_codons"][row]
+    if stops > max_stops:
+        failures.append(str(stops) + " stop codons in every frame")
+    elif stops:
+        warnings.append(str(stops) + " stop codon(s) in frame " + str(metrics["frame"][row] + 1))
+    if failures:
+        return "fail", failures + warnings
+    return ("warn" if warnings else "pass"), warnings
+
+
+def run_qc(fasta_in, fasta_out, table_out, exclude=False, min_length=300, max_ambiguous=0.05, max_stops=3):
+    """
+    :return: dict of the number of sequences with each status, and of those written
+    """
+    first_seen = {}
+    totals = {"pass": 0, "warn": 0, "fail": 0, "written": 0}
+    index = 0
+    with open(fasta_out, "w") as out, open(table_out, "w") as table:
+        table.write("\t".join(QC_COLUMNS) + "\n")
+        for batch in batches(iter_fasta(fasta_in)):
+            metrics, normalised = measure([sequence for header, sequence in batch])
+            for row, (header, sequence) in enumerate(batch):
+                index += 1
+                status, reasons = judge(metrics, row, first_seen.get(header), min_length, max_ambiguous, max_stops)
+                first_seen.setdefault(header, index)
+                totals[status] += 1
+                table.write("\t".join([header, str(metrics["length"][row]),
+                                       "{0:.4f}".format(metrics["n_fraction"][row]),
+                                       "{0:.4f}".format(metrics["ambiguous_fraction"][row]),
+                                       str(metrics["invalid"][row]), str(metrics["frame"][row] + 1),
+                                       str(metrics["stop_codons"][row]), status, "; ".join(reasons)]) + "\n")
+                if exclude and status == "fail":
+                    continue
+                out.write(">" + header + "\n" + normalised[row] + "\n")
+                totals["written"] += 1
+    return totals
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fasta', required=True, help='input sequences in single multi-sample fasta format file')
+    parser.add_argument('--output', required=True, help='normalised fasta: upper case, no gaps, one line per sequence')
+    parser.add_argument('--table', required=True, help='tab-delimited QC table with one row per input sequence')
+    parser.add_argument('--exclude', required=False, action='store_true', help='leave sequences that fail QC out of the normalised fasta')
+    parser.add_argument('--min-length', required=False, type=int, default=300, help='fail sequences shorter than this, gaps excluded. Default = 300')
+    parser.add_argument('--max-ambiguous', required=False, type=float, default=0.05, help='fail sequences with a larger fraction of N and IUPAC ambiguity codes. Default = 0.05')
+    parser.add_argument('--max-stops', required=False, type=int, default=3, help='fail sequences with more stop codons than this in their best reading frame. Default = 3')
+    args = parser.parse_args()
+
+    with telemetry.get().stage("qc") as span:
+        totals = run_qc(args.fasta, args.output, args.table, args.exclude, args.min_length, args.max_ambiguous, args.max_stops)
+        span.count(**totals)
+    print (str(totals["pass"]) + " sequences passed QC, " + str(totals["warn"]) + " with warnings and " +
+           str(totals["fail"]) + " failed (see " + args.table + "); " + str(totals["written"]) + " written to " + args.output)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3.6
+
+'''
+Persistent on-disk cache of HIVdb sequence analysis results. Each result is
+stored under a hash of the normalised sequence, the custom query text and the
+HIVdb algorithm version, so re-running a sample only goes to the webservice when
+the sequence, the query or the algorithm has changed.
+'''
+
+import os
+import json
+import time
+import errno
+import hashlib
+import tempfile
+import collections
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "uvri-hivdb")
+
+
+def normalise_sequence(sequence):
+    return "".join(sequence.split()).upper()
+
+
+def with_header(result, header):
+    """
+    Copy of a cached result with the input header replaced, sharing everything else.
+    """
+    result = dict(result)
+    if "inputSequence" in result:
+        result["inputSequence"] = dict(result["inputSequence"], header=header)
+    return result
+
+
+class ResultCache(object):
+    """
+    Directory of json files, one per cached sequence result.
+
+    :param cache_dir: directory holding the cache
+    :param query: text of the custom query file
+    :param algorithm_version: HIVdb algorithm version the results were produced with
+    """
+
+    def __init__(self, cache_dir, query, algorithm_version):
+        self.cache_dir = cache_dir
+        self.salt = query + "\0" + algorithm_version + "\0"
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, sequence):
+        data = self.salt + normalise_sequence(sequence)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def get(self, sequence):
+        path = self._path(self.key(sequence))
+        try:
+            with open(path) as cached:
+                result = json.load(cached)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+        # mark as recently used for size based eviction
+        os.utime(path, None)
+        self.hits += 1
+        return result
+
+    def put(self, sequence, result):
+        path = self._path(self.key(sequence))
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        # write then rename so a crash never leaves a half written entry
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as out:
+            json.dump(result, out)
+        os.replace(tmp, path)
+
+    def evict(self, max_bytes=None, max_age=None):
+        """
+        Remove entries older than max_age seconds, then the least recently used
+        entries until the cache is no larger than max_bytes.
+
+        :return: number of entries removed
+        """
+        entries = []
+        for root, dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    st = os.stat(path)
+                    entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+
+        removed = 0
+        now = time.time()
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            too_old = max_age is not None and now - mtime > max_age
+            too_big = max_bytes is not None and total > max_bytes
+            if not (too_old or too_big):
+                continue
+            os.remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+
+def analyse_cached(client, records, cache=None):
+    """
+    Query HIVdb for a list of records, sending each distinct sequence at most
+    once and only when it is not already in the cache. Results are cached as
+    each chunk is answered, so after a failed query a rerun only sends the
+    sequences of the chunks that failed.
+
+    :param client: hivdb_client.SierraClient
+    :param records: list of (header, sequence) tuples
+    :param cache: ResultCache, or None to only deduplicate within the run
+    :return: list of results in input order
+    """
+    results = [None] * len(records)
+    pending = collections.OrderedDict()
+    for n, (header, sequence) in enumerate(records):
+        norm = normalise_sequence(sequence)
+        if norm in pending:
+            pending[norm].append(n)
+            continue
+        cached = cache.get(sequence) if cache is not None else None
+        if cached is not None:
+            results[n] = with_header(cached, header)
+        else:
+            pending[norm] = [n]
+
+    unique = [records[indexes[0]] for indexes in pending.values()]
+    if unique:
+        print ("Querying " + str(len(unique)) + " distinct sequences not found in the cache...\n")
+
+    def store(start, chunk_results):
+        for (header, sequence), result in zip(unique[start:], chunk_results):
+            cache.put(sequence, result)
+
+    fresh = client.analyse(unique, on_chunk=store if cache is not None else None)
+    for indexes, result in zip(pending.values(), fresh):
+        for n in indexes:
+            results[n] = with_header(result, records[n][0])
+    return results
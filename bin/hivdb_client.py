@@ -0,0 +1,223 @@
+#!/usr/bin/env python3.6
+
+'''
+Concurrent client for the HIVdb Sierra GraphQL webservice. The input sequences
+are split into chunks that are sent in parallel over a small pool of keep-alive
+connections, retried with exponential backoff, and merged back in input order
+into the same json list that `sierrapy fasta` writes.
+'''
+
+import json
+import random
+import asyncio
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from fasta_io import chunk_records
+
+
+SIERRA_URL = "https://hivdb.stanford.edu/graphql"
+
+# same wrapper sierrapy puts around a custom query file
+QUERY_TEMPLATE = """query sequenceAnalysis($sequences: [UnalignedSequenceInput]!) {
+  viewer {
+    sequenceAnalysis(sequences: $sequences) {
+      ...F
+    }
+  }
+}
+fragment F on SequenceAnalysis {
+%s
+}
+"""
+
+VERSION_QUERY = "query { currentVersion { text, publishDate } }"
+
+# responses worth retrying - rate limiting and server side errors
+RETRY_STATUS = set([429, 500, 502, 503, 504])
+
+
+class QueryError(Exception):
+    pass
+
+
+class _Connection(object):
+    """
+    A single keep-alive HTTP(S) connection to the GraphQL endpoint.
+    """
+
+    def __init__(self, url, timeout):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme == "https":
+            self.conn = http.client.HTTPSConnection(parts.netloc, timeout=timeout)
+        else:
+            self.conn = http.client.HTTPConnection(parts.netloc, timeout=timeout)
+        self.path = parts.path or "/"
+        if parts.query:
+            self.path += "?" + parts.query
+
+    def post(self, body):
+        try:
+            self.conn.request("POST", self.path, body=body, headers={
+                "Content-Type": "application/json",
+                "Accept": "application/json",
+            })
+            response = self.conn.getresponse()
+            return response.status, response.read()
+        except Exception:
+            # drop the broken socket; http.client reconnects on the next request
+            self.conn.close()
+            raise
+
+    def close(self):
+        self.conn.close()
+
+
+class SierraClient(object):
+    """
+    Send sequences to the Sierra webservice in concurrent chunks.
+
+    :param query: text of the custom query file (the SequenceAnalysis fields)
+    :param url: GraphQL endpoint
+    :param chunk_size: number of sequences per request
+    :param concurrency: maximum number of requests in flight, one connection each
+    :param retries: number of times a failed chunk is retried
+    :param backoff: initial delay in seconds between retries, doubled each time
+    :param timeout: socket timeout in seconds for a single request
+    """
+
+    def __init__(self, query, url=SIERRA_URL, chunk_size=40, concurrency=4,
+                 retries=5, backoff=1.0, timeout=120):
+        self.query = QUERY_TEMPLATE % query
+        self.url = url
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def current_version(self):
+        """
+        Ask the webservice which HIVdb algorithm version it is running.
+
+        :return: version string, e.g. "9.0 (2021-04-06)"
+        """
+        conn = _Connection(self.url, self.timeout)
+        try:
+            status, payload = conn.post(json.dumps({"query": VERSION_QUERY}).encode("utf-8"))
+        except (OSError, http.client.HTTPException) as exc:
+            raise QueryError("could not reach " + self.url + ": " + str(exc))
+        finally:
+            conn.close()
+        if status != 200:
+            raise QueryError("version query rejected by " + self.url + " with HTTP " + str(status))
+        try:
+            version = json.loads(payload.decode("utf-8"))["data"]["currentVersion"]
+            return version["text"] + " (" + version["publishDate"] + ")"
+        except (ValueError, KeyError, TypeError):
+            raise QueryError("unexpected answer to the version query from " + self.url + ": " +
+                             payload[:500].decode("utf-8", "replace"))
+
+    def analyse(self, records, on_chunk=None):
+        """
+        Query all records and return the sequence analysis results in input order.
+
+        :param records: list of (header, sequence) tuples
+        :param on_chunk: called as on_chunk(start, results) with the results of
+                         records[start:start + len(results)] as soon as each
+                         chunk has been answered, so that they are kept even if
+                         another chunk fails
+        :return: list of result dicts, one per record
+        """
+        if not records:
+            return []
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self._analyse(loop, records, on_chunk))
+        finally:
+            loop.close()
+
+    async def _analyse(self, loop, records, on_chunk=None):
+        chunks = chunk_records(records, self.chunk_size)
+        slots = min(self.concurrency, len(chunks))
+        pool = asyncio.Queue()
+        for _ in range(slots):
+            pool.put_nowait(_Connection(self.url, self.timeout))
+        executor = ThreadPoolExecutor(max_workers=slots)
+        tasks = [loop.create_task(self._query_chunk(loop, executor, pool, n, chunk, on_chunk))
+                 for n, chunk in enumerate(chunks)]
+        try:
+            # a failed chunk does not stop the others, so that every chunk that
+            # can be answered reaches on_chunk before the error is raised
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        except BaseException:
+            # interrupted: stop the chunks before the loop is closed
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            executor.shutdown(wait=False)
+            while not pool.empty():
+                pool.get_nowait().close()
+        for chunk_results in results:
+            if isinstance(chunk_results, BaseException):
+                raise chunk_results
+        merged = []
+        for chunk_results in results:
+            merged.extend(chunk_results)
+        return merged
+
+    async def _query_chunk(self, loop, executor, pool, n, chunk, on_chunk=None):
+        body = json.dumps({
+            "query": self.query,
+            "variables": {"sequences": [{"header": h, "sequence": s} for h, s in chunk]},
+        }).encode("utf-8")
+        attempt = 0
+        while True:
+            conn = await pool.get()
+            try:
+                status, payload = await loop.run_in_executor(executor, conn.post, body)
+                error = None
+            except (OSError, http.client.HTTPException) as exc:
+                status, payload, error = None, None, exc
+            finally:
+                pool.put_nowait(conn)
+
+            if error is None and status == 200:
+                results = self._parse_response(n, chunk, payload)
+                if on_chunk is not None:
+                    on_chunk(n * self.chunk_size, results)
+                return results
+            if error is None and status not in RETRY_STATUS:
+                raise QueryError("chunk " + str(n) + " rejected by " + self.url +
+                                 " with HTTP " + str(status) + ": " + payload[:500].decode("utf-8", "replace"))
+            if attempt >= self.retries:
+                reason = str(error) if error is not None else "HTTP " + str(status)
+                raise QueryError("chunk " + str(n) + " failed after " + str(attempt + 1) +
+                                 " attempts: " + reason)
+            delay = self.backoff * (2 ** attempt) * (1 + random.random())
+            attempt += 1
+            print("Retrying chunk " + str(n) + " in " + "{0:.1f}".format(delay) + "s (attempt " + str(attempt + 1) + ")")
+            await asyncio.sleep(delay)
+
+    def _parse_response(self, n, chunk, payload):
+        try:
+            response = json.loads(payload.decode("utf-8"))
+        except ValueError as exc:
+            # truncated, or not json at all, e.g. an error page from a proxy
+            raise QueryError("chunk " + str(n) + " returned invalid json (" + str(exc) + "): " +
+                             payload[:500].decode("utf-8", "replace"))
+        if isinstance(response, dict) and response.get("errors"):
+            raise QueryError("chunk " + str(n) + " returned errors: " + json.dumps(response["errors"])[:500])
+        try:
+            results = response["data"]["viewer"]["sequenceAnalysis"]
+        except (KeyError, TypeError):
+            results = None
+        if not isinstance(results, list):
+            raise QueryError("chunk " + str(n) + " returned no data.viewer.sequenceAnalysis: " +
+                             payload[:500].decode("utf-8", "replace"))
+        if len(results) != len(chunk):
+            raise QueryError("chunk " + str(n) + " sent " + str(len(chunk)) +
+                             " sequences but received " + str(len(results)) + " results")
+        return results
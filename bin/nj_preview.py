@@ -0,0 +1,221 @@
+#!/usr/bin/env python3.6
+
+'''
+Quick neighbour-joining preview of the phylogeny, drawn from the MAFFT
+alignment minutes after a run instead of waiting for RAxML. Each sequence is
+encoded as one probability vector over A, C, G and T per site, so an IUPAC
+ambiguity code counts as a partial match with each base it stands for, and
+gaps/N as missing; the same code in both sequences is a full match. All
+pairwise p-distances then come from a few matrix products, and are corrected
+with JC69. The tree is joined in memory by classic neighbour joining, or
+faster with --relaxed, and drawn by visualise_phylogeny.py.
+'''
+
+import os
+import sys
+import argparse
+import subprocess
+import numpy as np
+from ete3 import Tree
+from fasta_io import read_fasta
+
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+IUPAC = {
+    'A': 'A', 'C': 'C', 'G': 'G', 'T': 'T', 'U': 'T',
+    'R': 'AG', 'Y': 'CT', 'S': 'CG', 'W': 'AT', 'K': 'GT', 'M': 'AC',
+    'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'V': 'ACG',
+}
+
+# byte -> probability of A, C, G, T; anything else (N, gaps, ?) is all zero
+ENCODING = np.zeros((256, 4), dtype=np.float32)
+for code, bases in IUPAC.items():
+    for base in bases:
+        for byte in (ord(code), ord(code.lower())):
+            ENCODING[byte, 'ACGT'.index(base)] = 1.0 / len(bases)
+
+# byte -> number of the ambiguity code it is (1 for B ... 11 for Y), 0 for anything else
+AMBIGUOUS = sorted(code for code, bases in IUPAC.items() if len(bases) > 1)
+AMBIGUITY = np.zeros(256, dtype=np.intp)
+for number, code in enumerate(AMBIGUOUS, 1):
+    AMBIGUITY[ord(code)] = AMBIGUITY[ord(code.lower())] = number
+# match probability a code misses against itself, e.g. 0.5 for R (A or G)
+SELF_MISMATCH = np.array([1.0 - 1.0 / len(IUPAC[code]) for code in AMBIGUOUS], dtype=np.float32)
+
+# p-distance at which JC69 saturates; larger distances are capped just below it
+MAX_P = 0.75 - 1e-4
+
+
+def as_bytes(sequences):
+    """
+    :param sequences: aligned sequences of equal length
+    :return: uint8 array (sequences, sites)
+    """
+    width = len(sequences[0])
+    return np.frombuffer("".join(sequences).encode("ascii"), dtype=np.uint8).reshape(len(sequences), width)
+
+
+def encode(sequences):
+    """
+    :param sequences: aligned sequences of equal length
+    :return: float32 array (sequences, sites, 4)
+    """
+    return ENCODING[as_bytes(sequences)]
+
+
+def shared_codes(data):
+    """
+    One column per ambiguity code seen at a site, marking the sequences that
+    have it there, so that a product of the columns counts for each pair the
+    sites where both have the same code.
+
+    :param data: uint8 array (sequences, sites)
+    :return: float32 array (sequences, columns), and the SELF_MISMATCH of
+             each column's code
+    """
+    rows, sites = np.nonzero(AMBIGUITY[data])
+    numbers = AMBIGUITY[data[rows, sites]] - 1
+    columns, column, counts = np.unique(sites * len(AMBIGUOUS) + numbers, return_inverse=True, return_counts=True)
+    # a code only one sequence has at a site is shared with none
+    kept = counts > 1
+    index = np.cumsum(kept) - 1
+    shared = kept[column]
+    marks = np.zeros((data.shape[0], int(kept.sum())), dtype=np.float32)
+    marks[rows[shared], index[column[shared]]] = 1.0
+    return marks, SELF_MISMATCH[columns[kept] % len(AMBIGUOUS)]
+
+
+def distances(sequences, model="jc69", block=1024):
+    """
+    Pairwise p-distances (or JC69 distances) over the sites both sequences cover.
+
+    :param block: rows computed per matrix product, to bound memory
+    :return: float64 array (sequences, sequences)
+    """
+    data = as_bytes(sequences)
+    probs = ENCODING[data]
+    n = probs.shape[0]
+    valid = (probs.sum(axis=2) > 0).astype(np.float32)
+    probs = probs.reshape(n, -1)
+    marks, mismatch = shared_codes(data)
+    dist = np.empty((n, n), dtype=np.float64)
+    for start in range(0, n, block):
+        stop = min(n, start + block)
+        shared = valid[start:stop] @ valid.T
+        same = probs[start:stop] @ probs.T
+        if marks.shape[1]:
+            # the same code in both sequences matches fully, not by chance
+            same += (marks[start:stop] * mismatch) @ marks.T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            p = np.where(shared > 0, 1.0 - same / shared, MAX_P)
+        dist[start:stop] = np.clip(p, 0.0, MAX_P)
+    np.fill_diagonal(dist, 0.0)
+    if model == "jc69":
+        dist = -0.75 * np.log(1.0 - dist / 0.75)
+    return dist
+
+
+def neighbour_joining(dist, names, relaxed=False):
+    """
+    Neighbour-joining tree of a distance matrix, joining one pair per round.
+    With relaxed=True every pair of clusters that are each other's closest
+    neighbour (by the NJ criterion) is joined in the same round instead. That
+    needs far fewer rounds, but the later pairs of a round are chosen on the
+    Q values from before the earlier joins, so the tree can differ from the
+    classic one whenever more than one pair qualifies.
+
+    :return: unrooted ete3 Tree
+    """
+    # float32 halves the memory traffic of each round, which dominates the run time
+    d = np.array(dist, dtype=np.float32)
+    nodes = [Tree(name=name) for name in names]
+    for node in nodes:
+        node.dist = 0.0
+    # Q matrix buffer, reused every round as the matrix shrinks
+    q = np.empty(d.size, dtype=np.float32)
+
+    while len(nodes) > 3:
+        m = len(nodes)
+        r = d.sum(axis=1)
+        qm = q[:m * m].reshape(m, m)
+        np.multiply(d, m - 2, out=qm)
+        qm -= r[:, None]
+        qm -= r[None, :]
+        np.fill_diagonal(qm, np.inf)
+        best = qm.argmin(axis=1)
+        if relaxed:
+            rows = np.arange(m)
+            first = rows[(best[best] == rows) & (rows < best)]
+        else:
+            first = np.array([np.argmin(qm[np.arange(m), best])])
+        second = best[first]
+
+        dij = d[first, second]
+        # branch lengths from each joined cluster to the new node
+        to_first = np.maximum(0.5 * dij + (r[first] - r[second]) / (2.0 * (m - 2)), 0.0)
+        to_second = np.maximum(dij - to_first, 0.0)
+        # distances of the new nodes to every old cluster, then to each other
+        new = 0.5 * (d[first] + d[second] - dij[:, None])
+        among = 0.5 * (new[:, first] + new[:, second] - dij[None, :])
+        np.fill_diagonal(among, 0.0)
+
+        joined = []
+        for a, b, la, lb in zip(first, second, to_first, to_second):
+            parent = Tree()
+            nodes[a].dist, nodes[b].dist = float(la), float(lb)
+            parent.add_child(nodes[a])
+            parent.add_child(nodes[b])
+            joined.append(parent)
+
+        keep = np.ones(m, dtype=bool)
+        keep[first] = False
+        keep[second] = False
+        kept = np.flatnonzero(keep)
+        k = len(kept)
+        merged = np.empty((k + len(first), k + len(first)), dtype=np.float32)
+        np.take(d[kept], kept, axis=1, out=merged[:k, :k])
+        merged[k:, :k] = new[:, kept]
+        merged[:k, k:] = merged[k:, :k].T
+        merged[k:, k:] = among
+        d = merged
+        nodes = [nodes[n] for n in kept] + joined
+
+    root = Tree()
+    if len(nodes) == 3:
+        lengths = [(d[0, 1] + d[0, 2] - d[1, 2]) / 2, (d[0, 1] + d[1, 2] - d[0, 2]) / 2,
+                   (d[0, 2] + d[1, 2] - d[0, 1]) / 2]
+    elif len(nodes) == 2:
+        lengths = [d[0, 1] / 2, d[0, 1] / 2]
+    else:
+        lengths = [0.0]
+    for node, length in zip(nodes, lengths):
+        node.dist = max(float(length), 0.0)
+        root.add_child(node)
+    return root
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--alignment', required=True, help='aligned references and samples, e.g. from mafft --add')
+    parser.add_argument('--tree', required=True, help='newick file to write the preview tree to')
+    parser.add_argument('--output', required=False, help='if given, render the tree with visualise_phylogeny.py to this file')
+    parser.add_argument('--model', required=False, default='jc69', choices=['p', 'jc69'], help='distance: p-distance or JC69 corrected. Default = jc69')
+    parser.add_argument('--relaxed', required=False, action='store_true', help='join every mutually closest pair in a round instead of one pair (classic NJ): much faster for thousands of sequences, but the tree can differ')
+    parser.add_argument('--scalable', required=False, action='store_true', help='render with visualise_phylogeny.py --scalable')
+    args = parser.parse_args()
+
+    records = read_fasta(args.alignment)
+    if len(set(len(sequence) for header, sequence in records)) != 1:
+        sys.exit(args.alignment + " is not an alignment: sequence lengths differ")
+    print ("Computing distances between " + str(len(records)) + " sequences...")
+    dist = distances([sequence for header, sequence in records], args.model)
+    print ("Joining neighbours...")
+    tree = neighbour_joining(dist, [header for header, sequence in records], relaxed=args.relaxed)
+    tree.write(outfile=args.tree, format=5)
+    print ("Preview tree saved to " + args.tree)
+
+    if args.output:
+        subprocess.run([sys.executable, os.path.join(script_dir, "visualise_phylogeny.py"), "--tree", args.tree,
+                        "--midpoint", "--hide-support", "--output", args.output] + (["--scalable"] if args.scalable else []),
+                       check=True)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3.6
+
+'''
+Writes every per-run output of the sierrapy json in one process and a single
+pass over the file: the .docx reports and subtype table of
+parse_json_write_docx.py, and the DRM overview, database rows and long-format
+table of parse_json_store_metadata.py. Each result is read once, from the
+normalised form kept beside the json if it is up to date (see sierra_ir.py),
+and handed to all of them. python-docx is only imported when reports are asked for and
+pandas only when the overview is written.
+'''
+
+import os
+import sys
+import errno
+import argparse
+from sierra_ir import load_results
+from patient_data import load_patient_data, COLUMNS
+import telemetry
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--json', required=True, help='input json file containing query results')
+    parser.add_argument('--data', required=False, help='input text-tab delimited file with the dataset of patient data; needed for --reports')
+    parser.add_argument('--output', required=False, default='subtypes.txt', help='name of tab-delimited text file containing sample subtypes. Default = subtypes.txt')
+    parser.add_argument('--reports', required=False, action='store_true', help='if this flag is included, .docx reports will be produced for each sample')
+    parser.add_argument('--reports-dir', required=False, help='directory the .docx reports are written to. Default = <date>_reports')
+    parser.add_argument('--assets', required=False, default='.', help='directory containing the logo images. Default = current directory')
+    parser.add_argument('--workers', required=False, type=int, default=1, help='number of processes used to build the .docx reports. Default = 1')
+    parser.add_argument('--renderer', required=False, default='docx', choices=['docx', 'fast'], help='docx: build each report with python-docx; fast: fill pre-serialised XML templates of the same report. Default = docx')
+    parser.add_argument('--overview', required=False, help='also write the DRM overview table to this file (implied by --db and --long, which default it to <date>_DRM-overview.txt)')
+    parser.add_argument('--db', required=False, help='SQLite database of all runs to append this run to')
+    parser.add_argument('--run-id', required=False, help='identifier of this run in the database. Default = json file name')
+    parser.add_argument('--long', required=False, help='also write a long-format (sample, gene, drug, score, mutation) table: .parquet, .arrow/.feather or a directory of .npy files')
+    args = parser.parse_args()
+
+    if args.reports and not args.data:
+        parser.error("--reports needs the patient data (--data)")
+
+    span = telemetry.get().stage("outputs")
+
+    # the patient table is read once for the reports and the database
+    patientdata = {}
+    if args.data and (args.reports or args.db):
+        try:
+            patientdata = load_patient_data(args.data)
+            print("Loaded patient data for " + str(len(patientdata)) + " samples")
+        except ValueError as exc:
+            print("The column labels in " + args.data + " are not as expected (" + str(exc) + "). Expecting:")
+            print("\t".join(label for label, attribute in COLUMNS))
+            if args.reports:
+                span.end("error", error="unexpected column labels in " + args.data)
+                sys.exit(1)
+
+    overview = None
+    if args.overview or args.db or args.long:
+        from parse_json_store_metadata import Overview, default_output
+        overview = Overview(bool(args.long), bool(args.db), patientdata)
+
+    sample2subtype = {}
+    samples = 0
+
+    def results():
+        global samples
+        for i in load_results(args.json):
+            if i.subtype != 'NA':
+                sample2subtype[i.header] = i.subtype
+            if overview is not None:
+                overview.add(i)
+            samples += 1
+            yield i
+
+    failed = []
+    if args.reports:
+        import parse_json_write_docx
+        path = os.path.join(args.reports_dir, "") if args.reports_dir else parse_json_write_docx.default_reports_dir()
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        tasks = ((i, path + i.header + "_report.docx") for i in results())
+        failed = parse_json_write_docx.write_reports(tasks, patientdata, args.assets, args.workers, args.renderer)
+    else:
+        for i in results():
+            pass
+
+    with open(args.output, "w+") as out:
+        for i in sample2subtype:
+            out.write(i + "\t" + sample2subtype[i] + "\n")
+
+    if overview is not None:
+        overview.write(args.overview or default_output(), span, args.db, args.run_id or os.path.basename(args.json),
+                       os.path.abspath(args.json), args.long)
+
+    span.count(samples=samples, subtyped=len(sample2subtype),
+               reports=samples - len(failed) if args.reports else 0, failed=len(failed))
+    if failed:
+        span.end("error", error=str(len(failed)) + " report(s) failed")
+        print("Failed to generate " + str(len(failed)) + " report(s):", file=sys.stderr)
+        for sample, error in failed:
+            print("  " + sample + "\t" + error, file=sys.stderr)
+        sys.exit(1)
+    span.end()
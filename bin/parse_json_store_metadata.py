@@ -5,41 +5,37 @@ Fields include sampleID, month, actualMonth and year plus a column for each drug
 Modified so it can handle UVRI style labels
 '''
 
-import json
+import os
 import argparse
 import datetime
-import pandas as pd
+from sierra_ir import load_results
+from drm_columns import LongTable
+from drm_store import DRMStore, drug_rows
+from patient_data import load_patient_data
+import telemetry
 
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--json', required=True, help='input json file containing query results')
-parser.add_argument('--output', required=False, help='name of tab-delimited text file containing sample metadata')
-args = parser.parse_args()
+def default_output():
+    now = datetime.datetime.now()
 
-# get user input and set file names
-json_in = ""
-output_file=""
+    if now.month < 10:
+        time_now = (str(now.day) + "-0" +str(now.month) + "-" + str(now.year))
+    elif now.day <10:
+        time_now = ("0" +str(now.day) + "-" +str(now.month) + "-" + str(now.year))
+    elif now.month < 10 and now.day <10: 
+        time_now = ("0" +str(now.day) + "-0" +str(now.month) + "-" + str(now.year))
+    else:
+        time_now = (str(now.day) + "-" +str(now.month) + "-" + str(now.year))
+    return time_now + "_DRM-overview.txt"
 
-if args.json:
-    json_in = args.json
-else:
-    print ("json file cannot be read by parser")
 
-now = datetime.datetime.now()
-
-if now.month < 10:
-    time_now = (str(now.day) + "-0" +str(now.month) + "-" + str(now.year))
-elif now.day <10:
-    time_now = ("0" +str(now.day) + "-" +str(now.month) + "-" + str(now.year))
-elif now.month < 10 and now.day <10: 
-    time_now = ("0" +str(now.day) + "-0" +str(now.month) + "-" + str(now.year))
-else:
-    time_now = (str(now.day) + "-" +str(now.month) + "-" + str(now.year))
-
-if args.output:
-    output_file = args.output
-else:
-    output_file = time_now + "_DRM-overview.txt"
+def parse_date(text):
+    for fmt in ('%d-%b-%y', '%d-%b-%Y', '%d/%m/%Y', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(text.strip(), fmt)
+        except ValueError:
+            pass
+    return None
 
 
 # parse sierrapy json output for relevant info
@@ -47,12 +43,34 @@ else:
 start_month = 11
 start_year = 2004
 
-append_list = []
-with open(json_in) as json_file:
-    data = json.load(json_file)
-    for i in data:
-        sample = i["inputSequence"]["header"]
-        
+drug_list = ['ATV', 'DRV', 'FPV', 'IDV' , 'LPV', 'NFV', 'SQV', 'TPV', 'ABC', 'AZT', 'D4T', 'DDI', 'FTC', 'LMV', 'TDF', 'DOR', 'EFV', 'ETR', 'NVP', 'RPV']
+dated_header_list = ['SampleID', 'Year', 'Real_Month', 'Month'] + drug_list
+plain_header_list = ['SampleID'] + drug_list
+
+
+class Overview(object):
+    """
+    The DRM overview of a run, built up one normalised sierrapy result (see
+    sierra_ir.py) at a time so it can share a single pass over the results
+    with other outputs.
+
+    :param long: also collect the long-format table (see drm_columns.py)
+    :param store: also collect the rows for the database of all runs
+    :param patientdata: patient records by sample ID, for the facility and
+                        collection date stored in the database
+    """
+
+    def __init__(self, long=False, store=False, patientdata=None):
+        self.append_list = []
+        # the columns follow the header style of the last sample
+        self.header_list = plain_header_list
+        self.long_table = LongTable() if long else None
+        self.store_samples = [] if store else None
+        self.patientdata = patientdata or {}
+
+    def add(self, i):
+        sample = i.header
+    
         name_list = sample.split("_")
         if len(name_list)==4:
           day = name_list[0]
@@ -61,32 +79,97 @@ with open(json_in) as json_file:
           ID = name_list[3]
           sample_month = ((int(year) - start_year) *12) + (int(month) - start_month) + 1
           append_dict = {'SampleID': ID, 'Year': year, 'Real_Month': month, 'Month': sample_month}
-          header_list = ['SampleID', 'Year', 'Real_Month', 'Month', 'ATV', 'DRV', 'FPV', 'IDV' , 'LPV', 'NFV', 'SQV', 'TPV', 'ABC', 'AZT', 'D4T', 'DDI', 'FTC', 'LMV', 'TDF', 'DOR', 'EFV', 'ETR', 'NVP', 'RPV']
+          self.header_list = dated_header_list
 
         else:
           append_dict = {'SampleID': sample}
-          header_list = ['SampleID', 'ATV', 'DRV', 'FPV', 'IDV' , 'LPV', 'NFV', 'SQV', 'TPV', 'ABC', 'AZT', 'D4T', 'DDI', 'FTC', 'LMV', 'TDF', 'DOR', 'EFV', 'ETR', 'NVP', 'RPV']
-
-        for j in i["drugResistance"]:
-            for k in j["drugScores"]:
-                drug_name = k["drug"]["name"]
-                drug_score = k["score"]
-                if drug_score != 0.0:
-                    mutation_list=[]
-                    for m in k["partialScores"]:
-                        for key,value in m.items():
-                            if key =='mutations':
-                                for x, y in value[0].items():
-                                    if x == 'text':
-                                        mutation_list.append(y)
-                    append_dict[drug_name] = mutation_list
-                else:
-                    append_dict[drug_name] = 0
-        append_list.append(append_dict)
-        
-df = pd.DataFrame(append_list, columns = header_list)
-df.set_index('SampleID', inplace=True)
-df.to_csv(output_file, sep='\t')
-
-
+          self.header_list = plain_header_list
 
+        for j in i.resistance:
+            for k in j.scores:
+                if k.score != 0.0:
+                    # the first mutation of each scored mutation or combination
+                    append_dict[k.drug.name] = [m.mutations[0] for m in k.partials]
+                else:
+                    append_dict[k.drug.name] = 0
+        self.append_list.append(append_dict)
+        if self.long_table is not None:
+            self.long_table.add_result(i, append_dict['SampleID'])
+        if self.store_samples is not None:
+            patient = self.patientdata.get(append_dict['SampleID']) or self.patientdata.get(sample)
+            store_year, store_month = 0, 0
+            if 'Year' in append_dict:
+                store_year, store_month = int(year), int(month)
+            elif patient is not None:
+                collected = parse_date(patient['Sample collection date'])
+                if collected is not None:
+                    store_year, store_month = collected.year, collected.month
+            study_month = ((store_year - start_year) *12) + (store_month - start_month) + 1 if store_year else None
+            facility = patient['Facility or clinic name'] if patient is not None else ""
+            self.store_samples.append((append_dict['SampleID'], store_year, store_month, study_month, facility, drug_rows(i)))
+
+    def write(self, output_file, span, db=None, run_id=None, source=None, long_path=None):
+        """
+        Write the overview table and, if they were collected, store the run in
+        db and write the long-format table to long_path.
+
+        :param span: telemetry span the counts are added to
+        :param source: json file the run came from, recorded in the database
+        """
+        # pandas takes as long to import as the rest of the script takes to
+        # run on a small run, so it is only loaded when the table is written
+        import pandas as pd
+
+        df = pd.DataFrame(self.append_list, columns = self.header_list)
+        df.set_index('SampleID', inplace=True)
+        df.to_csv(output_file, sep='\t')
+
+        if self.store_samples is not None:
+            store = DRMStore(db)
+            store.ingest_run(run_id, self.store_samples, source=source)
+            store.close()
+            print ("Run " + run_id + " (" + str(len(self.store_samples)) + " samples) stored in " + db)
+            span.count(stored=len(self.store_samples))
+
+        if self.long_table is not None:
+            self.long_table.write(long_path)
+            print ("Long-format table of " + str(len(self.long_table)) + " rows written to " + long_path)
+            span.count(long_rows=len(self.long_table))
+
+        span.count(samples=len(self.append_list),
+                   resistant=sum(1 for row in self.append_list if any(row.get(drug) for drug in drug_list)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--json', required=True, help='input json file containing query results')
+    parser.add_argument('--output', required=False, help='name of tab-delimited text file containing sample metadata')
+    parser.add_argument('--db', required=False, help='SQLite database of all runs to append this run to')
+    parser.add_argument('--run-id', required=False, help='identifier of this run in the database. Default = json file name')
+    parser.add_argument('--data', required=False, help='patient information table, used for the facility and collection date in the database')
+    parser.add_argument('--long', required=False, help='also write a long-format (sample, gene, drug, score, mutation) table: .parquet, .arrow/.feather or a directory of .npy files')
+    args = parser.parse_args()
+
+    overview_span = telemetry.get().stage("overview")
+
+    # get user input and set file names
+    json_in = ""
+    output_file=""
+
+    if args.json:
+        json_in = args.json
+    else:
+        print ("json file cannot be read by parser")
+
+    if args.output:
+        output_file = args.output
+    else:
+        output_file = default_output()
+
+    patientdata = load_patient_data(args.data) if args.db and args.data else {}
+    overview = Overview(bool(args.long), bool(args.db), patientdata)
+    for i in load_results(json_in):
+        overview.add(i)
+    overview.write(output_file, overview_span, args.db, args.run_id or os.path.basename(json_in),
+                   os.path.abspath(json_in), args.long)
+    overview_span.end()
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3.6
 
 
-import json
+import io
 import argparse
+import zipfile
 import os as os
 import docx
 from docx import Document
@@ -11,8 +12,16 @@ from docx.oxml.shared import OxmlElement
 from docx.oxml import ns
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.enum.section import WD_SECTION
+from lxml import etree
 import datetime 
 import errno
+import sys
+import collections
+import multiprocessing
+from sierra_ir import load_results
+from patient_data import load_patient_data, COLUMNS
+import docx_template
+import telemetry
 
 # for the table widths as docx is fussy
 def set_col_widths(table):
@@ -91,6 +100,513 @@ def add_hyperlink(paragraph, url, text, color, underline):
 
     return hyperlink
 
+# genename dictionary
+genedict = {}
+genedict["PR"]="Protease"
+genedict["IN"]="Intergase"
+genedict["RT"]="Reverse Transcriptase"
+
+
+# the first-page header and footer tables, logos, styles, margins and address
+# are the same for every report
+def add_skeleton(document, assets='.'):
+    # sorting out the header in a table on the first page
+    document.sections[0].different_first_page_header_footer=True
+    header = document.sections[0].first_page_header
+    htable=header.add_table(1, 3, Inches(6))
+    htab_cells=htable.rows[0].cells
+    htab_cells[1].width = Inches(5.6)
+    ht0=htab_cells[1].add_paragraph('')
+    ht0.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    kh=ht0.add_run()
+    kh.add_picture(os.path.join(assets, 'UVRIlogo_best.png'), width=Inches(4))
+    # sample name is added to this paragraph by add_sample_header
+    ht1=htab_cells[2].add_paragraph()
+    ht1.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+   
+    
+    footer = document.sections[0].first_page_footer
+    htable=footer.add_table(1, 2, Inches(6))
+    htab_cells=htable.rows[0].cells
+    htab_cells[0].width = Inches(2)
+    ht0=htab_cells[0].add_paragraph('report produced in collaboration with')
+    ht0.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+    ht1=htab_cells[1].add_paragraph()
+    ht1.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    kh=ht1.add_run()
+    kh.add_picture(os.path.join(assets, 'CVRlogo.png'), width=Inches(3.6))
+    
+    # sample name is added to the default header by add_sample_header
+    header = document.sections[0].header
+    paragraph = header.paragraphs[0]
+    
+    # document formating
+    paragraph_format = document.styles['Normal'].paragraph_format
+    paragraph_format.line_spacing = 1
+    paragraph_format.space_after = 1
+    style = document.styles['Normal']
+    font = style.font
+    font.name = 'Calibri'
+    font.size = Pt(12)
+
+    
+    
+    # sorting out the margins
+    document.sections[0].top_margin = Cm(2)
+    document.sections[0].bottom_margin = Cm(2)
+    document.sections[0].left_margin = Cm(2.5)
+    document.sections[0].right_margin = Cm(2.5)
+
+    # add address
+    document.add_paragraph("Molecular Virology Laboratory\nPO Box 49, Entebbe, Uganda.\nTel: (+256) (0)417 704 000\nEmail:\nWorld Health Organisation Designated National and Regional HIV Drug Resistance Laboratory\n")
+
+
+def add_sample_header(document, sample):
+    first_page = document.sections[0].first_page_header.tables[0].rows[0].cells[2]
+    first_page.paragraphs[-1].add_run(sample)
+    
+    header = document.sections[0].header
+    paragraph = header.paragraphs[0]
+    paragraph.text = "\t\t"+sample
+
+
+def build_skeleton(assets='.'):
+    """
+    Build the static part of the report once, so the logos are only read and
+    embedded a single time per run.
+
+    :param assets: directory containing UVRIlogo_best.png and CVRlogo.png
+    :return: the skeleton .docx as bytes, to be passed to build_report
+    """
+    document = Document()
+    add_skeleton(document, assets)
+    stream = io.BytesIO()
+    document.save(stream)
+    return stream.getvalue()
+
+
+# the patient information table at the top of every report
+def add_patient_table(document, patient):
+    table = document.add_table(rows=11, cols=4)
+    table.style = 'Table Grid'
+    table.cell(0,0).width = Cm(4.5)
+    rows_to_merge=[0,1,3,4,5,7,9]
+    respecitve_labels=['Your Sample ID','Our/Alternative ID','Facility or clinic name','Sample Type','Sample collection date','Lab Request Date','Report prepared by']
+    # merge three columns
+    for r in range(len(rows_to_merge)):
+      #row = table.rows[i]
+      a = table.cell(rows_to_merge[r], 1)
+      b = table.cell(rows_to_merge[r], 2)
+      c = table.cell(rows_to_merge[r], 3)
+      A = a.merge(b)
+      C = A.merge(c)
+
+      rowname=table.cell(rows_to_merge[r], 0)
+      rowname_text=rowname.paragraphs[0].add_run(respecitve_labels[r])
+      rowname_text.bold = True
+      C.text = patient[respecitve_labels[r]]
+
+    # rows that don't need merging
+    patient_text=table.cell(2, 0).paragraphs[0].add_run("Patient Details:")
+    patient_text.bold=True
+    dob_text=table.cell(2, 1).paragraphs[0].add_run("Date of Birth:\n")
+    dob_text.bold=True
+    dob_text=table.cell(2, 1).paragraphs[0].add_run(patient["Date of Birth"])
+    name_text=table.cell(2, 2).paragraphs[0].add_run("Initials (Given then Family Name):\n")
+    name_text.bold=True
+    name_text=table.cell(2, 2).paragraphs[0].add_run(patient["Initials or Name"])
+    sex_text=table.cell(2, 3).paragraphs[0].add_run("Sex:\n")
+    sex_text.bold=True
+    sex_text=table.cell(2, 3).paragraphs[0].add_run(patient["Sex"])
+
+    report_text=table.cell(10, 0).paragraphs[0].add_run("Report Date:")
+    report_text.bold=True
+    table.cell(10, 1).paragraphs[0].add_run(patient["Report Date"])
+    approved_text=table.cell(10, 2).paragraphs[0].add_run("Approved by:")
+    approved_text.bold=True
+    table.cell(10, 3).paragraphs[0].add_run(patient["Approved by"])
+
+    # dealing with the 3 column row7 and row 9
+    a = table.cell(6, 2)
+    b = table.cell(6, 3)
+    A = a.merge(b)
+    load_text=table.cell(6, 0).paragraphs[0].add_run("Viral load:")
+    load_text.bold=True
+    table.cell(6, 1).paragraphs[0].add_run(patient["Viral Load"])
+    loaddate_text=A.paragraphs[0].add_run("Date:")
+    loaddate_text.bold=True
+    loaddate_text=A.paragraphs[0].add_run(patient["Viral load Date"])
+
+    a = table.cell(8, 2)
+    b = table.cell(8, 3)
+    A = a.merge(b)
+    load_text=table.cell(8, 0).paragraphs[0].add_run("Requesting Clinician:")
+    load_text.bold=True
+    table.cell(8, 1).paragraphs[0].add_run(patient["Requesting Clinician"])
+    loaddate_text=A.paragraphs[0].add_run("Email:")
+    loaddate_text.bold=True
+    loaddate_text=A.paragraphs[0].add_run(patient["Email Requesting Clinician"])
+
+
+# the paragraph introducing the HIVdb results, with its link to the website
+def add_intro(document):
+    p0=document.add_paragraph("Below are the results from the ")
+    HIVbold=p0.add_run("HIVdb Program ")
+    HIVbold.bold=True
+    p0.add_run("drug resistance interpretation from Stanford University HIV Drug Resistance Database ")
+    hyperlink = add_hyperlink(p0, 'http://hivdb.stanford.edu/','(http://hivdb.stanford.edu/). ',None,True)
+    p0.add_run("For any queries or assistance interpreting these results please contact the MRC/UVRI Basic Science Virology Lab.")
+
+
+def add_drug_table(document, rows):
+    table = document.add_table(rows=len(rows), cols=2)
+    for r, (label, value, bold) in enumerate(rows):
+        load_text = table.cell(r, 0).paragraphs[0].add_run(label)
+        load_text.bold = True
+        value_text = table.cell(r, 1).paragraphs[0].add_run(value)
+        if bold:
+            value_text.bold = True
+    set_col_widths(table)
+
+
+def score_rows(scores):
+    # drug name and score, the score in bold if it is not zero
+    return [(key, str(value[0]), value[0] != 0.0) for key, value in scores.items()]
+
+
+def text_rows(scores):
+    return [(key, value[1], False) for key, value in scores.items()]
+
+
+# the body of the report for a single sample from its normalised sierrapy
+# result (see sierra_ir.py), as a list of blocks that either renderer can write:
+#   ("heading", text, level), ("paragraph", text, style), ("patient", patient),
+#   ("intro",) and ("drug_table", [(drug, value, bold value), ...])
+def report_blocks(i, patient):
+    sample = i.header
+    blocks = []
+    blocks.append(("heading", "Results Report", 1))
+    blocks.append(("patient", patient))
+    blocks.append(("heading", "HIV Drug Resistance Genotype Report", 1))
+    blocks.append(("intro",))
+
+    blocks.append(("heading", "Sequence Summary", 1))
+# gene name and codon information
+    for j in i.genes:
+        start = j.first
+        end = j.last
+        gene = j.gene
+
+        blocks.append(("paragraph", "Sequence includes " + genedict[gene] + " (" + gene +"): codons " + str(start) + "-" + str(end), None))
+# subtype information
+    blocks.append(("heading", "HIV Subtype Determination", 1))
+    subtype = i.subtype
+    subtype_message = ""
+    if subtype == 'NA':
+        subtype_message = "No subtype information for sample:\t" + sample
+    else:
+        subtype_message = "Subtype: "+subtype
+    blocks.append(("paragraph", subtype_message, None))
+
+# Drug resistance information
+    for j in i.resistance:
+        currentGene = j.gene
+        blocks.append(("heading", "Drug Resistance Interpretation: " + currentGene + "\n", 1))
+        mutations_dict = {}
+        for mutation_type, mutation_list in j.mutation_types:
+            mutation_string = ""
+            if not mutation_list:
+                mutation_string = "None"
+            else:
+                mutation_string = ", ".join(mutation_list)
+            mutations_dict[mutation_type] = mutation_string
+
+        # drug scores by the drug's label in the report
+        drug_class = ""
+        scores_dict = {}
+        N = {}
+        NN = {}
+        if currentGene == 'RT' or currentGene == 'PR' or currentGene == 'IN':
+            for key, value in mutations_dict.items():
+                # PR and IN label the mutations with the drug class, which is
+                # not known yet at this point
+                prefix = "" if currentGene == 'RT' else drug_class + " "
+                if key == 'Other':
+                    blocks.append(("paragraph", prefix + key + " Mutations: " + value, None))
+                else:
+                    blocks.append(("paragraph", prefix + key + " Resistance Mutations: " + value, None))
+
+            for k in j.scores:
+                drug_class = k.drug.drug_class
+                drug_value = [k.score, k.text]
+                if drug_class == "NRTI":
+                    N[k.drug.label] = drug_value
+                elif drug_class =="NNRTI":
+                    NN[k.drug.label] = drug_value
+                scores_dict[k.drug.label] = drug_value
+
+        if currentGene == 'RT':
+            blocks.append(("heading", "Nucleoside Reverse Transcriptase Inhibitors", 2))
+            blocks.append(("paragraph", "", None))
+            blocks.append(("drug_table", text_rows(N)))
+
+            blocks.append(("heading", "Non-Nucleoside Reverse Transcriptase Inhibitors", 2))
+            blocks.append(("paragraph", "", None))
+            blocks.append(("drug_table", text_rows(NN)))
+
+            blocks.append(("heading", "Mutation Scoring: " + currentGene + "\n", 1))
+            blocks.append(("paragraph", "Nucleoside Reverse Transcriptase Inhibitors\n", None))
+            blocks.append(("drug_table", score_rows(N)))
+
+            blocks.append(("paragraph", "\nNon-Nucleoside Reverse Transcriptase Inhibitors\n", None))
+            blocks.append(("drug_table", score_rows(NN)))
+
+        elif currentGene =='PR' or currentGene == 'IN':
+            blocks.append(("heading", drug_class, 2))
+            blocks.append(("paragraph", "", None))
+            blocks.append(("drug_table", text_rows(scores_dict)))
+
+            blocks.append(("heading", "Mutation Scoring: " + currentGene + "\n", 1))
+            blocks.append(("paragraph", "", None))
+            blocks.append(("drug_table", score_rows(scores_dict)))
+        else:
+            print("Gene is not PR or RT")
+            continue
+
+        if j.comments:
+            blocks.append(("heading", currentGene + " Comments", 2))
+            for comment in j.comments:
+                blocks.append(("paragraph", comment, 'List Bullet'))
+    return blocks
+
+
+def patient_for(i, patientdata):
+    sample = i.header
+    if sample not in patientdata:
+        raise KeyError("no patient data for " + sample)
+    patient = patientdata[sample]
+    print(patient["Your Sample ID"])
+    return patient
+
+
+# build the .docx report for a single sample from its sierrapy result
+def build_report(i, patientdata, skeleton=None):
+    sample = i.header
+    patient = patient_for(i, patientdata)
+    if skeleton is None:
+        document = Document()
+        add_skeleton(document)
+    else:
+        document = Document(io.BytesIO(skeleton))
+    add_sample_header(document, sample)
+
+    for block in report_blocks(i, patient):
+        if block[0] == "heading":
+            document.add_heading(block[1], level=block[2])
+        elif block[0] == "paragraph":
+            document.add_paragraph(block[1], style=block[2])
+        elif block[0] == "patient":
+            add_patient_table(document, block[1])
+        elif block[0] == "intro":
+            add_intro(document)
+        elif block[0] == "drug_table":
+            add_drug_table(document, block[1])
+    add_page_number(document.sections[0].footer.paragraphs[0].add_run())
+    return document
+
+
+class FastRenderer(object):
+    """
+    Writes the same reports as build_report, without python-docx's object
+    model. A prototype report is built once with python-docx from the
+    skeleton, with placeholders for the sample name and patient fields; its
+    XML is cut into templates and its unchanging parts (styles, logos,
+    relationships, ...) are compressed once. Each report then only fills in
+    the templates, writes its body as XML text and zips it with those parts.
+    """
+
+    STYLES = {'List Bullet': 'ListBullet'}
+
+    def __init__(self, skeleton):
+        document = Document(io.BytesIO(skeleton))
+        add_sample_header(document, docx_template.SLOT.format("sample"))
+        add_patient_table(document, dict((label, docx_template.SLOT.format(n)) for n, (label, attribute) in enumerate(COLUMNS)))
+        add_intro(document)
+        table = document.add_table(rows=0, cols=2)
+        add_page_number(document.sections[0].footer.paragraphs[0].add_run())
+        self.labels = [label for label, attribute in COLUMNS]
+
+        body = document.element.body
+        patient_xml, intro_xml, table_xml = [docx_template.strip_namespaces(etree.tostring(child, encoding="unicode"))
+                                             for child in list(body)[-4:-1]]
+        stream = io.BytesIO()
+        document.save(stream)
+
+        parts = []
+        self.templates = {}
+        with zipfile.ZipFile(stream) as package:
+            for name in package.namelist():
+                data = package.read(name)
+                if name == "word/document.xml":
+                    xml = data.decode("utf-8")
+                    # everything before the body blocks (namespaces, address) and after them (section)
+                    self.head = xml[:xml.index(patient_xml)]
+                    self.tail = xml[xml.index("<w:sectPr"):]
+                    parts.append((name, None))
+                elif docx_template.SLOT.format("sample").encode("utf-8") in data:
+                    self.templates[name] = docx_template.Template(data.decode("utf-8"))
+                    parts.append((name, None))
+                else:
+                    parts.append((name, data))
+        self.package = docx_template.Package(parts)
+        self.patient_table = docx_template.Template(patient_xml)
+        self.intro = intro_xml
+        # table properties and grid up to the first row
+        self.table_head = table_xml[:-len("</w:tbl>")]
+
+    def body(self, blocks):
+        xml = []
+        for block in blocks:
+            if block[0] == "heading":
+                xml.append(docx_template.paragraph(docx_template.run(block[1]) if block[1] else "", "Heading" + str(block[2])))
+            elif block[0] == "paragraph":
+                style = self.STYLES.get(block[2], block[2])
+                xml.append(docx_template.paragraph(docx_template.run(block[1]) if block[1] else "", style))
+            elif block[0] == "patient":
+                xml.append(self.patient_table.fill(dict((str(n), block[1][label]) for n, label in enumerate(self.labels))))
+            elif block[0] == "intro":
+                xml.append(self.intro)
+            elif block[0] == "drug_table":
+                xml.append(self.table_head)
+                for label, value, bold in block[1]:
+                    xml.append('<w:tr><w:tc><w:tcPr><w:tcW w:type="dxa" w:w="2880"/></w:tcPr>' +
+                               docx_template.paragraph(docx_template.run(label, True)) +
+                               '</w:tc><w:tc><w:tcPr><w:tcW w:type="dxa" w:w="2880"/></w:tcPr>' +
+                               docx_template.paragraph(docx_template.run(value, bold)) + '</w:tc></w:tr>')
+                xml.append("</w:tbl>")
+        return "".join(xml)
+
+    def write(self, i, patientdata, report_file_name):
+        sample = i.header
+        patient = patient_for(i, patientdata)
+        parts = {"word/document.xml": (self.head + self.body(report_blocks(i, patient)) + self.tail).encode("utf-8")}
+        for name, template in self.templates.items():
+            parts[name] = template.fill({"sample": sample}).encode("utf-8")
+        with open(report_file_name, "wb") as out:
+            self.package.write(out, parts)
+
+
+def write_report(i, patientdata, report_file_name, skeleton=None, renderer=None):
+    """
+    :param renderer: FastRenderer to write the report with; default python-docx
+    """
+    if renderer is not None:
+        renderer.write(i, patientdata, report_file_name)
+        return
+    document = build_report(i, patientdata, skeleton)
+    document.save(report_file_name)
+
+
+# patient data and the report skeleton are handed to each worker process once
+# rather than with every sample
+_worker_patientdata = None
+_worker_skeleton = None
+_worker_renderer = None
+
+def _init_worker(patientdata, skeleton, renderer=None):
+    global _worker_patientdata, _worker_skeleton, _worker_renderer
+    _worker_patientdata = patientdata
+    _worker_skeleton = skeleton
+    _worker_renderer = renderer
+
+
+def _report_task(task):
+    """
+    Build and save one report. Errors are returned rather than raised so that
+    a single bad sample does not stop the rest of the run.
+
+    :param task: tuple of (normalised sierrapy result for one sample, report file name)
+    :return: tuple of (sample name, error message or None)
+    """
+    i, report_file_name = task
+    sample = i.header
+    span = telemetry.get().sample(sample)
+    try:
+        write_report(i, _worker_patientdata, report_file_name, _worker_skeleton, _worker_renderer)
+    except Exception as exc:
+        error = "{0}: {1}".format(type(exc).__name__, exc)
+        span.end("error", error=error)
+        return sample, error
+    span.end()
+    return sample, None
+
+
+def _bounded_imap(pool, func, tasks, limit):
+    """
+    Like pool.imap, but only keeps `limit` tasks in flight so that the input
+    generator is not read ahead into memory all at once.
+    """
+    pending = collections.deque()
+    for task in tasks:
+        pending.append(pool.apply_async(func, (task,)))
+        if len(pending) >= limit:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def default_reports_dir():
+    now = datetime.datetime.now()
+    if now.month < 10:
+        time_now = (str(now.day) + "-0" +str(now.month) + "-" + str(now.year))
+    elif now.day <10:
+        time_now = ("0" +str(now.day) + "-" +str(now.month) + "-" + str(now.year))
+    elif now.month < 10 and now.day <10:
+        time_now = ("0" +str(now.day) + "-0" +str(now.month) + "-" + str(now.year))
+    else:
+        time_now =(str(now.day) + "-" +str(now.month) + "-" + str(now.year))
+    return time_now + "_reports/"
+
+
+_templates = {}
+
+def report_templates(assets='.', renderer="docx"):
+    """
+    The report skeleton and, for the fast renderer, its FastRenderer, built
+    once per process for each assets directory. A long-running process (see
+    watch_inbox.py) builds them up front and reuses them for every run.
+
+    :return: tuple of (skeleton bytes, FastRenderer or None)
+    """
+    key = (os.path.abspath(assets), renderer)
+    if key not in _templates:
+        skeleton = build_skeleton(assets)
+        _templates[key] = (skeleton, FastRenderer(skeleton) if renderer == 'fast' else None)
+    return _templates[key]
+
+
+def write_reports(tasks, patientdata, assets, workers=1, renderer="docx"):
+    """
+    :param tasks: iterable of (normalised sierrapy result, report file name), read as the
+                  reports are written
+    :param renderer: "docx" or "fast" (see FastRenderer)
+    :return: list of (sample, error) of the reports that could not be written
+    """
+    setup = (patientdata,) + report_templates(assets, renderer)
+    failed = []
+    if workers > 1:
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=setup) as pool:
+            for sample, error in _bounded_imap(pool, _report_task, tasks, workers * 4):
+                if error is not None:
+                    failed.append((sample, error))
+    else:
+        _init_worker(*setup)
+        for task in tasks:
+            sample, error = _report_task(task)
+            if error is not None:
+                failed.append((sample, error))
+    return failed
+
 
 if __name__ == "__main__":
 
@@ -100,8 +616,14 @@ if __name__ == "__main__":
     parser.add_argument('--data', required=True, help='input text-tab delimited file with the dataset of patient data')
     parser.add_argument('--output', required=False, help='name of tab-delimited text file containing sample subtypes')
     parser.add_argument('--reports', required=False, action='store_true', help='if this flag is included, .docx reports will be produced for each sample')
+    parser.add_argument('--reports-dir', required=False, help='directory the .docx reports are written to. Default = <date>_reports')
+    parser.add_argument('--assets', required=False, default='.', help='directory containing the logo images. Default = current directory')
+    parser.add_argument('--subset-data', required=False, action='store_true', help='only load the rows of the patient table whose IDs appear in the json')
+    parser.add_argument('--workers', required=False, type=int, default=1, help='number of processes used to build the .docx reports. Default = 1')
+    parser.add_argument('--renderer', required=False, default='docx', choices=['docx', 'fast'], help='docx: build each report with python-docx; fast: fill pre-serialised XML templates of the same report. Default = docx')
     args = parser.parse_args()
 
+    reports_span = telemetry.get().stage("reports")
     json_in = ""
     subtype_output = ""
 
@@ -121,17 +643,10 @@ if __name__ == "__main__":
     else:
         subtype_output = "subtypes.txt"
 
-    now = datetime.datetime.now()
-    if now.month < 10:
-        time_now = (str(now.day) + "-0" +str(now.month) + "-" + str(now.year))
-    elif now.day <10:
-        time_now = ("0" +str(now.day) + "-" +str(now.month) + "-" + str(now.year))
-    elif now.month < 10 and now.day <10:
-        time_now = ("0" +str(now.day) + "-0" +str(now.month) + "-" + str(now.year))
+    if args.reports_dir:
+        path = os.path.join(args.reports_dir, "")
     else:
-        time_now =(str(now.day) + "-" +str(now.month) + "-" + str(now.year))
-
-    path = time_now + "_reports/"
+        path = default_reports_dir()
     if args.reports:
         try:
             os.makedirs(os.path.dirname(path))
@@ -140,414 +655,54 @@ if __name__ == "__main__":
                 raise
             pass
 
-# genename dictionary
-    genedict = {}
-    genedict["PR"]="Protease"
-    genedict["IN"]="Intergase"
-    genedict["RT"]="Reverse Transcriptase"
 
 # parse the text-tab delimited file with patient DataLossWarning
-    patientdata = {}
-    with open(data_in) as data_file:
-      headerline=data_file.readline()
-      headerline=headerline.rstrip()
-      print(headerline)
-      colnames = headerline.split('\t')
-      #check_list = ['Your Sample ID','Our/Alternative ID','Sample collection date','Date of Birth','Initials or Name','Sex','Facility or clinic name','Sample Type','Viral Load','Viral load Date','Lab Request Date','Requesting Clinician','Email Requesting Clinician','Report prepared by','Report Date','Approved by']
-      #assert colnames == check_list, "Columns are misaligned: {0} vs {1}".format(colnames, check_list)
-      #if colnames[0]=="Your Sample ID" and colnames[1]=="Our/Alternative ID" and colnames[2]=="Sample collection date" and colnames[3]=="Date of Birth":#
-      if headerline=="Your Sample ID	Our/Alternative ID	Sample collection date	Date of Birth	Initials or Name	Sex	Facility or clinic name	Sample Type	Viral Load	Viral load Date	Lab Request Date	Requesting Clinician	Email Requesting Clinician	Report prepared by	Report Date	Approved by":
-        print("Properly formatted dataset")
-        for line in data_file:
-          line=line.rstrip()
-          values=line.split('\t')
-          for i in range(len(colnames)):
-            if i < len(values):
-              patientdata[(values[1],colnames[i])]=values[i]
-            else:
-              patientdata[(values[1],colnames[i])]=""
-        
-      else:
-        print("The column labels in "+data_in+" are not as expected. Expecting:")
-        print("Your Sample ID\tOur/Alternative ID\tSample collection date\tDate of Birth\tInitials or Name\tSex\tFacility or clinic name\tSample Type\tViral Load\tViral load Date\tLab Request Date\tRequesting Clinician\tEmail Requesting Clinician\tReport prepared by\tReport Date\tApproved by")
-      
+    sample_ids = None
+    if args.subset_data:
+        sample_ids = set(i.header for i in load_results(json_in))
+    try:
+        patientdata = load_patient_data(data_in, sample_ids)
+        print("Loaded patient data for " + str(len(patientdata)) + " samples")
+    except ValueError as exc:
+        print("The column labels in "+data_in+" are not as expected (" + str(exc) + "). Expecting:")
+        print("\t".join(label for label, attribute in COLUMNS))
+        if args.reports:
+            reports_span.end("error", error="unexpected column labels in " + data_in)
+            sys.exit(1)
+        patientdata = {}
 
-# parse the sierrapy json output for relevant information - subtype and DRMs
-    with open(json_in) as json_file:
-        data = json.load(json_file)
 
+# parse the sierrapy json output for relevant information - subtype and DRMs
+    def report_tasks(data):
+        global samples
         for i in data:
-            sample = i['inputSequence']['header']
-            report_file_name = path +  sample + "_report.docx"
-            print(patientdata[(sample,"Your Sample ID")])
-            document = Document()
-            #fn='template2.docx'
-            #document = Document(fn)
-            # sorting out the header in a table on the first page
-            document.sections[0].different_first_page_header_footer=True
-            header = document.sections[0].first_page_header
-            htable=header.add_table(1, 3, Inches(6))
-            htab_cells=htable.rows[0].cells
-            htab_cells[1].width = Inches(5.6)
-            ht0=htab_cells[1].add_paragraph('')
-            ht0.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            kh=ht0.add_run()
-            kh.add_picture('UVRIlogo_best.png', width=Inches(4))
-            ht1=htab_cells[2].add_paragraph(sample)
-            ht1.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-           
-            
-            footer = document.sections[0].first_page_footer
-            htable=footer.add_table(1, 2, Inches(6))
-            htab_cells=htable.rows[0].cells
-            htab_cells[0].width = Inches(2)
-            ht0=htab_cells[0].add_paragraph('report produced in collaboration with')
-            ht0.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-            ht1=htab_cells[1].add_paragraph()
-            ht1.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            kh=ht1.add_run()
-            kh.add_picture('CVRlogo.png', width=Inches(3.6))
-            
-            header = document.sections[0].header
-            paragraph = header.paragraphs[0]
-            paragraph.text = "\t\t"+sample
-            
-            # document formating
-            paragraph_format = document.styles['Normal'].paragraph_format
-            paragraph_format.line_spacing = 1
-            paragraph_format.space_after = 1
-            style = document.styles['Normal']
-            font = style.font
-            font.name = 'Calibri'
-            font.size = Pt(12)
-
-            
-            
-            # sorting out the margins
-            document.sections[0].top_margin = Cm(2)
-            document.sections[0].bottom_margin = Cm(2)
-            document.sections[0].left_margin = Cm(2.5)
-            document.sections[0].right_margin = Cm(2.5)
-
-            # add address
-            document.add_paragraph("Molecular Virology Laboratory\nPO Box 49, Entebbe, Uganda.\nTel: (+256) (0)417 704 000\nEmail:\nWorld Health Organisation Designated National and Regional HIV Drug Resistance Laboratory\n")
-
-
-            document.add_heading("Results Report", level=1)
-            table = document.add_table(rows=11, cols=4)
-            table.style = 'Table Grid'
-            table.cell(0,0).width = Cm(4.5)
-            rows_to_merge=[0,1,3,4,5,7,9]
-            respecitve_labels=['Your Sample ID','Our/Alternative ID','Facility or clinic name','Sample Type','Sample collection date','Lab Request Date','Report prepared by']
-            # merge three columns
-            for r in range(len(rows_to_merge)):
-              #row = table.rows[i]
-              a = table.cell(rows_to_merge[r], 1)
-              b = table.cell(rows_to_merge[r], 2)
-              c = table.cell(rows_to_merge[r], 3)
-              A = a.merge(b)
-              C = A.merge(c)
-              
-              rowname=table.cell(rows_to_merge[r], 0)
-              rowname_text=rowname.paragraphs[0].add_run(respecitve_labels[r])
-              rowname_text.bold = True
-              C.text = patientdata[(sample,respecitve_labels[r])]
-            
-            # rows that don't need merging
-            patient_text=table.cell(2, 0).paragraphs[0].add_run("Patient Details:")
-            patient_text.bold=True
-            dob_text=table.cell(2, 1).paragraphs[0].add_run("Date of Birth:\n")
-            dob_text.bold=True
-            dob_text=table.cell(2, 1).paragraphs[0].add_run(patientdata[(sample,"Date of Birth")])            
-            name_text=table.cell(2, 2).paragraphs[0].add_run("Initials (Given then Family Name):\n")
-            name_text.bold=True
-            name_text=table.cell(2, 2).paragraphs[0].add_run(patientdata[(sample,"Initials or Name")])  
-            sex_text=table.cell(2, 3).paragraphs[0].add_run("Sex:\n")
-            sex_text.bold=True
-            sex_text=table.cell(2, 3).paragraphs[0].add_run(patientdata[(sample,"Sex")])  
- 
-            report_text=table.cell(10, 0).paragraphs[0].add_run("Report Date:")
-            report_text.bold=True
-            table.cell(10, 1).paragraphs[0].add_run(patientdata[(sample,"Report Date")])
-            approved_text=table.cell(10, 2).paragraphs[0].add_run("Approved by:")
-            approved_text.bold=True
-            table.cell(10, 3).paragraphs[0].add_run(patientdata[(sample,"Approved by")])
-              
-            # dealing with the 3 column row7 and row 9
-            a = table.cell(6, 2)
-            b = table.cell(6, 3)
-            A = a.merge(b)
-            load_text=table.cell(6, 0).paragraphs[0].add_run("Viral load:")
-            load_text.bold=True
-            table.cell(6, 1).paragraphs[0].add_run(patientdata[(sample,"Viral Load")])
-            loaddate_text=A.paragraphs[0].add_run("Date:")
-            loaddate_text.bold=True
-            loaddate_text=A.paragraphs[0].add_run(patientdata[(sample,"Viral load Date")])
-            
-            a = table.cell(8, 2)
-            b = table.cell(8, 3)
-            A = a.merge(b)
-            load_text=table.cell(8, 0).paragraphs[0].add_run("Requesting Clinician:")
-            load_text.bold=True
-            table.cell(8, 1).paragraphs[0].add_run(patientdata[(sample,"Requesting Clinician")])
-            loaddate_text=A.paragraphs[0].add_run("Email:")
-            loaddate_text.bold=True
-            loaddate_text=A.paragraphs[0].add_run(patientdata[(sample,"Email Requesting Clinician")])
-                        
-            document.add_heading("HIV Drug Resistance Genotype Report", level=1)
-            p0=document.add_paragraph("Below are the results from the ")
-            HIVbold=p0.add_run("HIVdb Program ")
-            HIVbold.bold=True
-            p0.add_run("drug resistance interpretation from Stanford University HIV Drug Resistance Database ")
-            hyperlink = add_hyperlink(p0, 'http://hivdb.stanford.edu/','(http://hivdb.stanford.edu/). ',None,True)
-            p0.add_run("For any queries or assistance interpreting these results please contact the MRC/UVRI Basic Science Virology Lab.")
-            #p0.add_hyperlink(text='foobar', url='http://github.com')
-            
-            
-            document.add_heading("Sequence Summary", level=1)
-# gene name and codon information
-            for j in i["alignedGeneSequences"]:
-                start = j["firstAA"]
-                end = j["lastAA"]
-                gene = j["gene"]["name"]
-
-                p1 = document.add_paragraph("Sequence includes " + genedict[gene] + " (" + gene +"): codons " + str(start) + "-" + str(end))
-# subtype information
-            document.add_heading("HIV Subtype Determination", level=1)
-            subtype = i['subtypeText']
-            subtype_id = str.split(subtype, "(")[0]
-            subtype_message = ""
-            if subtype == 'NA':
-                subtype_message = "No subtype information for sample:\t" + sample
-            else:
+            sample = i.header
+            subtype = i.subtype
+            if subtype != 'NA':
                 sample2subtype[sample] = subtype
-                subtype_message = "Subtype: "+subtype
-            p2 = document.add_paragraph(subtype_message)
+            samples += 1
+            yield i, path + sample + "_report.docx"
+
+    failed = []
+    samples = 0
+    tasks = report_tasks(load_results(json_in))
+
+    if not args.reports:
+        for task in tasks:
+            pass
+    else:
+        failed = write_reports(tasks, patientdata, args.assets, args.workers, args.renderer)
 
-# Drug resistance information
-            for j in i["drugResistance"]:
-                currentGene = j["gene"]["name"]
-                document.add_heading ("Drug Resistance Interpretation: " + currentGene + "\n", level=1)
-                mutations_dict = {}
-                for k in j["mutationsByTypes"]:
-                    mutation_type = k["mutationType"]
-                    mutation_list = []
-                    for m in k["mutations"]:
-                        for key in m:
-                            mutation_list.append(m[key])
-                    mutation_string = ""
-                    if not mutation_list:
-                        mutation_string = "None"
-                    else:
-                        mutation_string = ", ".join(mutation_list)
-                    mutations_dict[mutation_type] = mutation_string
-
-
-                scores_dict = {}
-                numerical_scores_dict = {}
-                drug_class = ""
-                drug_name = ""
-                drug_abbr = ""
-                drug_fullname = ""
-                drug_score = ""
-                drug_text = ""
-                drug_id = ""
-                drug_value = ""
-                m_info = {}
-
-
-                if currentGene == 'RT':
-                    N = {}
-                    NN = {}
-                    for key, value in mutations_dict.items():
-                        if key == 'Other':
-                            p3 = document.add_paragraph(key + " Mutations: " + value)
-                        else:
-                            p3 = document.add_paragraph(key + " Resistance Mutations: " + value)
-                    for k in j["drugScores"]:
-                        drug_class = k["drugClass"]["name"]
-                        drug_name = k["drug"]["name"]
-                        drug_abbr = k["drug"]["displayAbbr"]
-                        drug_fullname = k["drug"]["fullName"]
-                        drug_score = k["score"]
-                        drug_text = k["text"]
-
-                        drug_id = drug_fullname + " (" + drug_abbr + ") "
-                        drug_value = [drug_score, drug_text]
-                        if drug_class == "NRTI":
-                            N[drug_id] = drug_value
-                        elif drug_class =="NNRTI":
-                            NN[drug_id] = drug_value
-
-                        m_name = ""
-                        m_type = ""
-                        m_text = ""
-                        if drug_score != 0.0:
-
-                            for p in k["partialScores"]:
-                                for key, value in p.items():
-                                    if key =='mutations':
-                                        for x, y in value[0].items():
-                                            if x == 'text':
-                                                m_name = y
-                                            if x == 'comments':
-                                                m_text = y[0]["text"]
-                                            m_info[m_name] = m_text
-                    document.add_heading("Nucleoside Reverse Transcriptase Inhibitors", level=2)
-                    p4 = document.add_paragraph()
-                    p4table = document.add_table(rows=len(N.keys()), cols=2)
-                    r=0
-                    for key, value in N.items():
-                        load_text=p4table.cell(r, 0).paragraphs[0].add_run(key)
-                        load_text.bold = True
-                        p4table.cell(r, 1).paragraphs[0].add_run(value[1])
-                        r +=1
-                    p4table=set_col_widths(p4table)
-                        
-                    document.add_heading("Non-Nucleoside Reverse Transcriptase Inhibitors", level=2)
-                    p5 = document.add_paragraph()
-                    p5table = document.add_table(rows=len(NN.keys()), cols=2)
-                    r=0
-                    for key, value in NN.items():
-                        #p5.add_run(key).bold = True
-                        #p5.add_run("\t" + value[1] + "\n")
-                        load_text=p5table.cell(r, 0).paragraphs[0].add_run(key)
-                        load_text.bold = True
-                        p5table.cell(r, 1).paragraphs[0].add_run(value[1])
-                        r += 1
-                    p5table=set_col_widths(p5table)
-
-                    document.add_heading ("Mutation Scoring: " + currentGene + "\n", level=1)
-                    p7 = document.add_paragraph("Nucleoside Reverse Transcriptase Inhibitors\n")
-                    p7table = document.add_table(rows=len(N.keys()), cols=2)
-                    r=0
-                    for key, value in N.items():
-                        #p7.add_run(key).bold = True
-                        load_text=p7table.cell(r, 0).paragraphs[0].add_run(key)
-                        load_text.bold = True
-                        score  = value[0]
-                        if score != 0.0:
-                            #p7.add_run("\t" + str(score) + "\n").bold=True
-                            load_text=p7table.cell(r, 1).paragraphs[0].add_run(str(score))
-                            load_text.bold = True
-                        else:
-                            #p7.add_run("\t" + str(score) + "\n")
-                            p7table.cell(r, 1).paragraphs[0].add_run(str(score))
-                        r +=1
-                    p7table=set_col_widths(p7table)
-                    
-                    p8 = document.add_paragraph("\nNon-Nucleoside Reverse Transcriptase Inhibitors\n")
-                    p8table = document.add_table(rows=len(NN.keys()), cols=2)
-                    r=0
-                    for key, value in NN.items():
-                        #p8.add_run(key).bold = True
-                        load_text=p8table.cell(r, 0).paragraphs[0].add_run(key)
-                        load_text.bold = True
-                        score  = value[0]
-                        if score != 0.0:
-                            #p8.add_run("\t" + str(score) + "\n").bold=True
-                            load_text=p8table.cell(r, 1).paragraphs[0].add_run(str(score))
-                            load_text.bold = True
-                        else:
-                            #p8.add_run("\t" + str(score) + "\n")
-                            p8table.cell(r, 1).paragraphs[0].add_run(str(score))
-                        r +=1
-                    p8table=set_col_widths(p8table) 
-                        
-                    if not m_info:
-                        continue
-                    else:
-                        document.add_heading(currentGene + " Comments", level=2)
-                        for key, value in m_info.items():
-                            p9 = document.add_paragraph(value, style='List Bullet')
-
-
-                elif currentGene =='PR' or currentGene == 'IN':
-                    for key, value in mutations_dict.items():
-                        if key == 'Other':
-                            p3 = document.add_paragraph(drug_class + " " + key + " Mutations: " + value)
-                        else:
-                            p3 = document.add_paragraph(drug_class + " " + key + " Resistance Mutations: " + value)
-
-
-                    for k in j["drugScores"]:
-                        drug_class = k["drugClass"]["name"]
-                        drug_name = k["drug"]["name"]
-                        drug_abbr = k["drug"]["displayAbbr"]
-                        drug_fullname = k["drug"]["fullName"]
-                        drug_score = k["score"]
-                        drug_text = k["text"]
-
-                        drug_id = drug_fullname + " (" + drug_abbr + ") "
-                        drug_value = [drug_score, drug_text]
-
-                        scores_dict[drug_id] = drug_value
-                        # drug scores and comments
-                        m_name = ""
-                        m_type = ""
-                        m_text = ""
-                        if drug_score != 0.0:
-
-                            for p in k["partialScores"]:
-                                for key, value in p.items():
-                                    if key =='mutations':
-                                        for x, y in value[0].items():
-                                            if x == 'text':
-                                                m_name = y
-                                            if x == 'comments':
-                                                m_text = y[0]["text"]
-                                            m_info[m_name] = m_text
-
-
-                    document.add_heading(drug_class, level=2)
-                    p4 = document.add_paragraph()
-
-# THIS IS PROBABLY WHERE I CAN PRINT OUT IN A TABLE
-                    p4table = document.add_table(rows=len(scores_dict.keys()), cols=2)
-                    r=0
-                    for key, value in scores_dict.items():
-                        #p4.add_run(key + "\t").bold = True
-                        #p4.add_run(value[1] + "\n")
-                        load_text=p4table.cell(r, 0).paragraphs[0].add_run(key)
-                        load_text.bold = True
-                        p4table.cell(r, 1).paragraphs[0].add_run(value[1])
-                        r += 1
-                    p4table=set_col_widths(p4table) 
-
-                    document.add_heading ("Mutation Scoring: " + currentGene + "\n", level=1)
-                    p6 = document.add_paragraph()
-                    p6table = document.add_table(rows=len(scores_dict.keys()), cols=2)
-                    r=0
-                    for key, value in scores_dict.items():
-                        #p6.add_run(key).bold = True
-                        load_text=p6table.cell(r, 0).paragraphs[0].add_run(key)
-                        load_text.bold = True
-                        score  = value[0]
-                        if score != 0.0:
-                            #p6.add_run("\t" + str(score) + "\n").bold=True
-                            load_text=p6table.cell(r, 1).paragraphs[0].add_run(str(score))
-                            load_text.bold = True
-                        else:
-                            #p6.add_run("\t" + str(score) + "\n")
-                            p6table.cell(r, 1).paragraphs[0].add_run(str(score))
-                        r += 1
-                    p6table=set_col_widths(p6table)    
-                    
-
-                    if not m_info:
-                        continue
-                    else:
-                        document.add_heading(currentGene + " Comments", level=2)
-                        for key, value in m_info.items():
-                            p7 = document.add_paragraph(value, style='List Bullet')
-                else:
-                    print("Gene is not PR or RT")
-            add_page_number(document.sections[0].footer.paragraphs[0].add_run())
-            if args.reports:
-               # print ("Saving report: " + report_file_name)
-                document.save(report_file_name)
     with open(subtype_output, "w+") as out:
         for i in sample2subtype:
             out.write(i + "\t" + sample2subtype[i] + "\n")
 
-
+    reports_span.count(samples=samples, subtyped=len(sample2subtype),
+                       reports=samples - len(failed) if args.reports else 0, failed=len(failed))
+    if failed:
+        reports_span.end("error", error=str(len(failed)) + " report(s) failed")
+        print("Failed to generate " + str(len(failed)) + " report(s):", file=sys.stderr)
+        for sample, error in failed:
+            print("  " + sample + "\t" + error, file=sys.stderr)
+        sys.exit(1)
+    reports_span.end()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3.6
+
+'''
+Loader for the tab-delimited patient information table. Each row becomes one
+compact record with a fixed slot per known column, indexed on the
+"Our/Alternative ID" column that matches the sequence headers.
+'''
+
+
+# column label in the table -> record attribute
+COLUMNS = [
+    ('Your Sample ID', 'sample_id'),
+    ('Our/Alternative ID', 'alternative_id'),
+    ('Sample collection date', 'collection_date'),
+    ('Date of Birth', 'date_of_birth'),
+    ('Initials or Name', 'initials'),
+    ('Sex', 'sex'),
+    ('Facility or clinic name', 'facility'),
+    ('Sample Type', 'sample_type'),
+    ('Viral Load', 'viral_load'),
+    ('Viral load Date', 'viral_load_date'),
+    ('Lab Request Date', 'lab_request_date'),
+    ('Requesting Clinician', 'clinician'),
+    ('Email Requesting Clinician', 'clinician_email'),
+    ('Report prepared by', 'prepared_by'),
+    ('Report Date', 'report_date'),
+    ('Approved by', 'approved_by'),
+]
+
+ATTRIBUTES = dict(COLUMNS)
+
+ID_COLUMN = 'Our/Alternative ID'
+
+
+def _normalise(label):
+    return " ".join(label.split()).lower()
+
+
+class PatientRecord(object):
+    """
+    Patient information for one sample. Fields can be read as attributes or by
+    their column label, e.g. record['Date of Birth'].
+    """
+
+    __slots__ = [attribute for label, attribute in COLUMNS]
+
+    def __init__(self, values):
+        for (label, attribute), value in zip(COLUMNS, values):
+            setattr(self, attribute, value)
+
+    def __getitem__(self, label):
+        return getattr(self, ATTRIBUTES[label])
+
+    def __getstate__(self):
+        return [getattr(self, attribute) for label, attribute in COLUMNS]
+
+    def __setstate__(self, values):
+        self.__init__(values)
+
+
+def column_positions(headerline):
+    """
+    Work out where each known column is in the table from its header, matching
+    the labels by name so that column order, case, spacing and any extra
+    columns do not matter.
+
+    :return: list of column indexes, in the order of COLUMNS
+    """
+    found = dict((_normalise(label), n) for n, label in enumerate(headerline.rstrip("\r\n").split("\t")))
+    missing = [label for label, attribute in COLUMNS if _normalise(label) not in found]
+    if missing:
+        raise ValueError("missing columns: " + ", ".join(missing))
+    return [found[_normalise(label)] for label, attribute in COLUMNS]
+
+
+def load_patient_data(data_in, sample_ids=None):
+    """
+    Read the patient table into a dict of sample ID -> PatientRecord.
+
+    :param data_in: path to the tab-delimited patient table
+    :param sample_ids: if given, only rows whose ID is in this set are loaded
+    :return: dict keyed on the "Our/Alternative ID" column
+    """
+    patientdata = {}
+    with open(data_in) as data_file:
+        positions = column_positions(data_file.readline())
+        id_position = positions[[label for label, attribute in COLUMNS].index(ID_COLUMN)]
+        for line in data_file:
+            values = line.rstrip().split("\t")
+            if len(values) <= id_position:
+                continue
+            sample = values[id_position]
+            if sample_ids is not None and sample not in sample_ids:
+                continue
+            patientdata[sample] = PatientRecord([values[n] if n < len(values) else "" for n in positions])
+    return patientdata
@@ -9,17 +9,34 @@ __author__ = "Samantha Campbell"
 __email__= "samantha.campbell@glasgow.ac.uk"
 
 import argparse
-import subprocess
 import os.path as osp
 import datetime
+import json
+import sys
+from hivdb_client import SierraClient, SIERRA_URL, QueryError
+from fasta_io import read_fasta
+from hivdb_cache import ResultCache, DEFAULT_CACHE_DIR, analyse_cached
+import telemetry
 
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--fasta', required=True, help='input fasta file')
 parser.add_argument('--json', required=False, help='query results json filename')
 parser.add_argument('--output', required=False, help='output filename')
+parser.add_argument('--url', required=False, default=SIERRA_URL, help='Sierra GraphQL endpoint. Default = ' + SIERRA_URL)
+parser.add_argument('--chunk-size', required=False, type=int, default=40, help='number of sequences sent per request. Default = 40')
+parser.add_argument('--concurrency', required=False, type=int, default=4, help='maximum number of requests in flight. Default = 4')
+parser.add_argument('--retries', required=False, type=int, default=5, help='number of retries for a failed request. Default = 5')
+parser.add_argument('--cache-dir', required=False, default=DEFAULT_CACHE_DIR, help='directory of cached HIVdb results. Default = ' + DEFAULT_CACHE_DIR)
+parser.add_argument('--no-cache', required=False, action='store_true', help='query every sequence, ignoring and not updating the cache')
+parser.add_argument('--cache-max-size', required=False, type=float, help='evict least recently used cache entries above this size (MB)')
+parser.add_argument('--cache-max-age', required=False, type=float, help='evict cache entries not used for this many days')
+parser.add_argument('--algorithm-version', required=False, help='HIVdb algorithm version used in the cache key. Default = ask the webservice')
+parser.add_argument('--sierrapy', required=False, action='store_true', help='run the query through the sierrapy command line tool instead of the built-in client')
 args = parser.parse_args()
 
+query_span = telemetry.get().stage("query")
+
 inputFasta = ""
 output_json = ""
 
@@ -64,9 +81,38 @@ else:
 
 
 # call sierrapy and run on input data
-print ("Performing sierrapy query...\n")
-sierrapy_command = "sierrapy fasta " + inputFasta + " -q " + query_file
-with open (output_json, "w+") as out:
-    subprocess.run(sierrapy_command, shell=True, check=True, stdout = out)
-
-
+if args.sierrapy:
+    print ("Performing sierrapy query...\n")
+    sierrapy_command = ["sierrapy", "fasta", inputFasta, "-q", query_file]
+    with open (output_json, "w+") as out:
+        telemetry.get().run(sierrapy_command, check=True, stdout = out)
+else:
+    records = read_fasta(inputFasta)
+    print ("Performing HIVdb query of " + str(len(records)) + " sequences...\n")
+    with open(query_file) as query_in:
+        client = SierraClient(query_in.read(), url=args.url, chunk_size=args.chunk_size,
+                              concurrency=args.concurrency, retries=args.retries)
+    try:
+        cache = None
+        if not args.no_cache:
+            version = args.algorithm_version or client.current_version()
+            print ("HIVdb algorithm version:\t" + version + "\n")
+            cache = ResultCache(args.cache_dir, client.query, version)
+        results = analyse_cached(client, records, cache)
+    except QueryError as exc:
+        query_span.end("error", error=str(exc))
+        sys.exit("HIVdb query failed: " + str(exc))
+    with open (output_json, "w+") as out:
+        json.dump(results, out, indent=2)
+
+    if cache is not None:
+        print ("Cache hits: " + str(cache.hits) + ", misses: " + str(cache.misses) + "\n")
+        if args.cache_max_size is not None or args.cache_max_age is not None:
+            max_bytes = args.cache_max_size * 1024 * 1024 if args.cache_max_size is not None else None
+            max_age = args.cache_max_age * 86400 if args.cache_max_age is not None else None
+            removed = cache.evict(max_bytes, max_age)
+            print ("Evicted " + str(removed) + " cache entries\n")
+        query_span.count(cache_hits=cache.hits, cache_misses=cache.misses)
+    query_span.count(sequences=len(records), results=len(results))
+
+query_span.end()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3.6
+
+'''
+Newick parsing and rerooting for the RAxML trees drawn by visualise_phylogeny.py.
+Branch lengths, "[support]" branch labels and numeric internal node labels are
+read in a single pass straight into ete3 nodes, and the tree can be rerooted in
+place either at the branch that best balances the subtree lengths (the rule
+raxmlHPC -f I describes, see reroot_balanced) or at the midpoint of its longest
+leaf to leaf path; raxml_rooted runs raxmlHPC -f I itself. For large trees, clades
+of references or of many samples can be collapsed into summary leaves.
+'''
+
+import os
+import re
+import shutil
+import tempfile
+from ete3 import Tree
+import telemetry
+
+
+TOKENS = re.compile(r"\(|\)|,|;|:[^(),;\[]*|\[[^\]]*\]|'[^']*'|[^(),:;\[\]']+")
+
+
+def parse_newick(text):
+    """
+    Read a newick tree, e.g. RAxML_bipartitionsBranchLabels, in one pass.
+    A "[n]" label after a branch length and a numeric internal node name are
+    both taken as the support of the branch above the node.
+
+    :return: ete3 Tree
+    """
+    root = Tree()
+    node = root
+    for token in TOKENS.findall(text):
+        first = token[0]
+        if first == "(":
+            node = node.add_child()
+        elif first == ",":
+            node = node.up.add_child()
+        elif first == ")":
+            node = node.up
+        elif first == ":":
+            node.dist = float(token[1:])
+        elif first == "[":
+            node.support = float(token[1:-1])
+        elif first == ";":
+            break
+        elif first == "'":
+            node.name = token[1:-1]
+        else:
+            token = token.strip()
+            if node.children:
+                try:
+                    node.support = float(token)
+                    continue
+                except ValueError:
+                    pass
+            node.name = token
+    return root
+
+
+def _root_on_branch(tree, node, above):
+    """
+    Root the tree on the branch above node, at distance `above` from node.
+    """
+    length = node.dist
+    tree.set_outgroup(node)
+    node.dist = above
+    tree.children[1].dist = length - above
+
+
+def reroot_balanced(tree):
+    """
+    Root at the branch whose two sides have the most equal total branch
+    length, placing the root on that branch where the two sides balance.
+
+    This follows the rule described for raxmlHPC -f I but is not checked
+    against its output, and may root differently where the rule leaves a
+    choice: a side's length does not count the branch itself, a tie goes to
+    the branch met first in preorder, and when no point on the chosen branch
+    balances the sides the root goes to the end next to the longer side.
+
+    :return: tuple of (subtree length on one side, on the other side)
+    """
+    if len(tree.children) == 2:
+        tree.unroot()
+    # total branch length below each node, not counting the branch above it
+    below = {}
+    for node in tree.traverse("postorder"):
+        below[node] = sum(below[child] + child.dist for child in node.children)
+    total = below[tree]
+
+    best, best_diff = None, None
+    for node in tree.traverse("preorder"):
+        if node is tree:
+            continue
+        diff = abs(below[node] - (total - below[node] - node.dist))
+        if best is None or diff < best_diff:
+            best, best_diff = node, diff
+
+    left = below[best]
+    right = total - left - best.dist
+    above = min(max((right + best.dist - left) / 2.0, 0.0), best.dist)
+    _root_on_branch(tree, best, above)
+    return left, right
+
+
+def raxml_rooted(tree_in):
+    """
+    Root a tree file with raxmlHPC -f I, the root reroot_balanced is meant
+    to reproduce.
+
+    :return: ete3 Tree read from RAxML's rooted tree
+    """
+    work = tempfile.mkdtemp(suffix=".raxml")
+    try:
+        telemetry.get().run(["raxmlHPC", "-f", "I", "-m", "GTRGAMMA", "--JC69", "-t", os.path.abspath(tree_in),
+                             "-n", "visual", "-w", work], check=True)
+        with open(os.path.join(work, "RAxML_rootedTree.visual")) as tree_file:
+            return parse_newick(tree_file.read())
+    finally:
+        shutil.rmtree(work)
+
+
+def reroot_midpoint(tree):
+    """
+    Root halfway along the longest path between two leaves.
+
+    :return: length of that path
+    """
+    if len(tree.children) == 2:
+        tree.unroot()
+    first = tree.get_farthest_leaf()[0]
+    second, length = first.get_farthest_node()
+    ancestor = tree.get_common_ancestor(first, second)
+    # climb from whichever end has the midpoint below the common ancestor
+    node = first if first.get_distance(ancestor) >= length / 2.0 else second
+    climbed = 0.0
+    while climbed + node.dist < length / 2.0:
+        climbed += node.dist
+        node = node.up
+    _root_on_branch(tree, node, length / 2.0 - climbed)
+    return length
+
+
+def collapse_clades(tree, references, max_samples):
+    """
+    Replace clades by single summary leaves: every clade of two or more
+    reference sequences, and every clade of more than max_samples samples
+    without references (none if max_samples is 0). A summary leaf gets the
+    features collapsed_leaves, collapsed_refs and summary.
+
+    :param references: set of reference sequence names
+    :return: number of clades collapsed
+    """
+    leaves, refs = {}, {}
+    for node in tree.traverse("postorder"):
+        if node.is_leaf():
+            leaves[node] = 1
+            refs[node] = 1 if node.name in references else 0
+        else:
+            leaves[node] = sum(leaves[child] for child in node.children)
+            refs[node] = sum(refs[child] for child in node.children)
+
+    collapsed = 0
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node.is_leaf():
+            continue
+        n, r = leaves[node], refs[node]
+        if node is not tree and (r == n or (r == 0 and max_samples and n > max_samples)):
+            if r == n:
+                names = sorted(leaf.name for leaf in node.iter_leaves())
+                summary = ", ".join(names) if len(names) <= 4 else str(n) + " references"
+            else:
+                summary = str(n) + " samples"
+            for child in list(node.children):
+                node.remove_child(child)
+            node.add_features(collapsed_leaves=n, collapsed_refs=r, summary=summary)
+            collapsed += 1
+        else:
+            stack.extend(node.children)
+    return collapsed
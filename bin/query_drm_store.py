@@ -0,0 +1,31 @@
+#!/usr/bin/env python3.6
+
+'''
+Short Python script to report drug resistance prevalence from the cumulative
+DRM database written by parse_json_store_metadata.py --db. The counts are kept
+up to date as each run is added, so this only sums the stored aggregates.
+'''
+
+import argparse
+from drm_store import DRMStore, LEVELS
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--db', required=True, help='SQLite database written by parse_json_store_metadata.py --db')
+parser.add_argument('--by', required=False, default='year,month,facility', help='comma separated grouping: any of year, month, facility. Default = year,month,facility')
+parser.add_argument('--level', required=False, default='low', choices=[level for level, threshold in LEVELS], help='lowest HIVdb resistance level counted as resistant. Default = low (score >= 15)')
+parser.add_argument('--drug', required=False, help='only report this drug')
+parser.add_argument('--runs', required=False, action='store_true', help='list the runs in the database instead')
+args = parser.parse_args()
+
+store = DRMStore(args.db)
+if args.runs:
+    print ("run_id\tsamples\tingested\tsource")
+    for row in store.conn.execute("SELECT run_id, n_samples, ingested, source FROM runs ORDER BY ingested"):
+        print ("\t".join(str(x) for x in row))
+else:
+    by = [column for column in args.by.split(",") if column]
+    print ("\t".join(by + ["drug", "samples", "resistant", "prevalence"]))
+    for row in store.prevalence(by, args.level, args.drug):
+        print ("\t".join(str(x) for x in row[:-1]) + "\t" + "{0:.3f}".format(row[-1]))
+store.close()
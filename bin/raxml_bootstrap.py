@@ -0,0 +1,107 @@
+#!/usr/bin/env python3.6
+
+'''
+ML tree with bootstrap support, with the bootstrap replicates split into
+independent RAxML runs. The replicates are cut into fixed size batches, each
+with its own seed derived from the base seed, so the result only depends on the
+seeds and not on how many cores the batches were spread over. The ML search and
+the batches run side by side; the replicate trees are then concatenated in
+batch order and drawn onto the best ML tree with raxmlHPC -f b, which writes the
+RAxML_bipartitionsBranchLabels file read by visualise_phylogeny.py.
+'''
+
+import os
+import glob
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from fasta_io import read_fasta
+import telemetry
+
+
+MODEL = ["-m", "GTRGAMMA", "--JC69"]
+
+# alignment columns per RAxML thread: below this threads mostly wait on each other
+SITES_PER_THREAD = 1000
+
+
+def plan(cpus, n_sites, jobs):
+    """
+    Threads per RAxML process from the alignment width, then as many processes
+    as there are cores for.
+
+    :return: tuple of (processes, threads per process)
+    """
+    cpus = max(1, cpus)
+    threads = max(1, min(cpus, n_sites // SITES_PER_THREAD))
+    processes = max(1, min(jobs, cpus // threads))
+    return processes, threads
+
+
+def batches(replicates, batch_size, seed):
+    """
+    :return: list of (batch number, replicates, seed)
+    """
+    return [(n, min(batch_size, replicates - start), seed + n)
+            for n, start in enumerate(range(0, replicates, batch_size))]
+
+
+def run_raxml(args, work_dir, log):
+    with open(log, "w") as log_file:
+        telemetry.get().run(["raxmlHPC"] + args + ["-w", work_dir], stdout=log_file, stderr=subprocess.STDOUT, check=True)
+
+
+def bootstrap_tree(alignment, name, work_dir, cpus=1, replicates=100, batch_size=10, seed=12345):
+    """
+    :return: path of RAxML_bipartitionsBranchLabels.<name>
+    """
+    work_dir = os.path.abspath(work_dir)
+    os.makedirs(work_dir, exist_ok=True)
+    alignment = os.path.abspath(alignment)
+    for path in glob.glob(os.path.join(work_dir, "RAxML_*." + name + "*")):
+        os.remove(path)
+
+    records = read_fasta(alignment)
+    n_sites = len(records[0][1]) if records else 0
+    jobs = batches(replicates, batch_size, seed)
+    processes, threads = plan(cpus, n_sites, len(jobs) + 1)
+    print ("Bootstrapping " + str(len(records)) + " sequences x " + str(n_sites) + " sites: " + str(replicates) +
+           " replicates in " + str(len(jobs)) + " batches, " + str(processes) + " process(es) x " + str(threads) + " thread(s)")
+
+    ml_name = name + ".ml"
+    commands = [(["-f", "d"] + MODEL + ["-T", str(threads), "-p", str(seed), "-s", alignment, "-n", ml_name], ml_name)]
+    for n, count, batch_seed in jobs:
+        bs_name = name + ".bs" + str(n)
+        commands.append((MODEL + ["-T", str(threads), "-p", str(batch_seed), "-x", str(batch_seed), "-#", str(count),
+                                  "-s", alignment, "-n", bs_name], bs_name))
+    with ThreadPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(run_raxml, args, work_dir, os.path.join(work_dir, run_name + ".log"))
+                   for args, run_name in commands]
+        for future in futures:
+            future.result()
+
+    replicate_trees = os.path.join(work_dir, "RAxML_bootstrap." + name)
+    with open(replicate_trees, "w") as out:
+        for n, count, batch_seed in jobs:
+            with open(os.path.join(work_dir, "RAxML_bootstrap." + name + ".bs" + str(n))) as batch:
+                out.write(batch.read())
+
+    run_raxml(["-f", "b"] + MODEL + ["-t", os.path.join(work_dir, "RAxML_bestTree." + ml_name),
+                                     "-z", replicate_trees, "-n", name],
+              work_dir, os.path.join(work_dir, name + ".support.log"))
+    return os.path.join(work_dir, "RAxML_bipartitionsBranchLabels." + name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--alignment', required=True, help='aligned references and samples')
+    parser.add_argument('--name', required=True, help='RAxML run name')
+    parser.add_argument('--work-dir', required=False, default='RAxML', help='directory for the RAxML files. Default = RAxML')
+    parser.add_argument('--cpus', required=False, type=int, default=os.cpu_count() or 1, help='number of cores shared by the RAxML runs. Default = all cores')
+    parser.add_argument('--replicates', required=False, type=int, default=100, help='number of bootstrap replicates. Default = 100')
+    parser.add_argument('--batch-size', required=False, type=int, default=10, help='replicates per independent RAxML run. Default = 10')
+    parser.add_argument('--seed', required=False, type=int, default=12345, help='seed of the ML search; batch n uses seed + n. Default = 12345')
+    args = parser.parse_args()
+
+    tree = bootstrap_tree(args.alignment, args.name, args.work_dir, args.cpus, args.replicates, args.batch_size, args.seed)
+    print ("Tree with bootstrap support saved to " + tree)
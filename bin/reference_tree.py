@@ -0,0 +1,115 @@
+#!/usr/bin/env python3.6
+
+'''
+Phylogenetic placement of a run's samples onto a fixed reference tree. The ML
+tree and GTRGAMMA model parameters of the aligned references are inferred once
+and cached under a hash of the reference alignment; each run then only places
+its samples onto that tree with RAxML's evolutionary placement algorithm
+(raxmlHPC -f v), so the cost grows with the number of samples rather than with
+a full tree search over references plus samples.
+'''
+
+import os
+import re
+import shutil
+import hashlib
+import argparse
+import tempfile
+from hivdb_cache import DEFAULT_CACHE_DIR
+import telemetry
+
+
+REFERENCE_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, "reference-trees")
+
+MODEL = ["-m", "GTRGAMMA", "--JC69"]
+SEED = "12345"
+
+TREE_FILE = "RAxML_bestTree.ref"
+MODEL_FILE = "RAxML_binaryModelParameters.model"
+
+
+def reference_key(reference):
+    """
+    Cache key of a reference alignment: its contents and the RAxML model options.
+    """
+    h = hashlib.sha256()
+    h.update(" ".join(MODEL).encode("utf-8") + b"\0")
+    with open(reference, "rb") as ref:
+        for block in iter(lambda: ref.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def build_reference(reference, cache_dir=REFERENCE_CACHE_DIR, threads=1):
+    """
+    Infer the reference tree and model parameters, unless already cached.
+
+    :return: tuple of (tree file, binary model parameter file)
+    """
+    entry = os.path.join(cache_dir, reference_key(reference))
+    tree, model = os.path.join(entry, TREE_FILE), os.path.join(entry, MODEL_FILE)
+    if os.path.exists(tree) and os.path.exists(model):
+        print ("Using cached reference tree " + tree + "\n")
+        return tree, model
+
+    print ("Inferring reference tree from " + reference + " (only needed once)\n")
+    os.makedirs(cache_dir, exist_ok=True)
+    # build in a scratch directory and rename it into place, so an interrupted or
+    # concurrent build never leaves a half written entry
+    work = tempfile.mkdtemp(dir=cache_dir, suffix=".tmp")
+    try:
+        telemetry.get().run(["raxmlHPC", "-f", "d"] + MODEL + ["-T", str(threads), "-p", SEED,
+                             "-s", os.path.abspath(reference), "-n", "ref", "-w", work], check=True)
+        telemetry.get().run(["raxmlHPC", "-f", "e"] + MODEL + ["-T", str(threads), "-t", os.path.join(work, TREE_FILE),
+                             "-s", os.path.abspath(reference), "-n", "model", "-w", work], check=True)
+        try:
+            os.rename(work, entry)
+        except OSError:
+            if not os.path.exists(model):
+                raise
+    finally:
+        if os.path.exists(work):
+            shutil.rmtree(work)
+    return tree, model
+
+
+def place(alignment, tree, model, name, work_dir, threads=1):
+    """
+    Place every sequence of the alignment that is not in the reference tree.
+
+    :param alignment: references plus samples, in the reference alignment's columns
+    :return: path of RAxML's labelled tree with the placed samples
+    """
+    telemetry.get().run(["raxmlHPC", "-f", "v"] + MODEL + ["-T", str(threads), "-R", model, "-t", tree,
+                         "-s", os.path.abspath(alignment), "-n", name, "-w", os.path.abspath(work_dir)], check=True)
+    return os.path.join(work_dir, "RAxML_labelledTree." + name)
+
+
+def placement_newick(labelled_tree):
+    """
+    Plain newick from a RAxML placement tree: the QUERY___ prefix of placed
+    sequences and the [I<n>] branch labels are removed.
+    """
+    with open(labelled_tree) as tree_file:
+        nw = tree_file.read()
+    nw = re.sub(r"\[I\d+\]", "", nw)
+    return nw.replace("QUERY___", "")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reference', required=True, help='aligned HIV-1 reference sequences')
+    parser.add_argument('--alignment', required=True, help='references plus samples aligned to the reference columns (mafft --keeplength)')
+    parser.add_argument('--name', required=True, help='RAxML run name')
+    parser.add_argument('--output', required=True, help='newick file of the reference tree with the samples placed on it')
+    parser.add_argument('--work-dir', required=False, default='RAxML', help='directory for the RAxML placement files. Default = RAxML')
+    parser.add_argument('--cache-dir', required=False, default=REFERENCE_CACHE_DIR, help='directory holding cached reference trees. Default = ' + REFERENCE_CACHE_DIR)
+    parser.add_argument('--threads', required=False, type=int, default=1, help='number of RAxML threads. Default = 1')
+    args = parser.parse_args()
+
+    tree, model = build_reference(args.reference, args.cache_dir, args.threads)
+    os.makedirs(args.work_dir, exist_ok=True)
+    labelled = place(args.alignment, tree, model, args.name, args.work_dir, args.threads)
+    with open(args.output, "w") as out:
+        out.write(placement_newick(labelled))
+    print ("Placement tree saved to " + args.output)
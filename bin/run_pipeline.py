@@ -0,0 +1,550 @@
+#!/usr/bin/env python3.6
+
+'''
+Resumable driver for the HIV DRM report and phylogeny pipeline. Runs the same
+steps as preprocessing.sh (QC, query, reports, overview, alignment, phylogeny
+and tree rendering) inside a results directory, recording a content-hash
+checkpoint for each stage. On a rerun, stages whose inputs and command are
+unchanged and whose outputs are still in place are skipped.
+'''
+
+import os
+import sys
+import json
+import glob
+import time
+import hashlib
+import argparse
+import datetime
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from telemetry import Telemetry, TELEMETRY_ENV, STAGE_ENV, RUN_ENV, read_events, summary_rows, format_summary
+from sierra_ir import ir_path
+
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(script_dir)
+
+STATE_FILE = ".pipeline_state.json"
+TELEMETRY_FILE = "telemetry.jsonl"
+
+
+def file_hash(path):
+    """
+    sha256 of a file, or of the sorted names and contents of a directory.
+    """
+    h = hashlib.sha256()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                h.update(os.path.relpath(full, path).encode("utf-8") + b"\0")
+                h.update(file_hash(full).encode("ascii"))
+        return h.hexdigest()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class Stage(object):
+    """
+    One step of the pipeline.
+
+    :param name: stage name used by --from-stage/--only
+    :param command: argument list, run from the results directory. An element
+                    "{threads}" is replaced by the number of cores given to the stage
+    :param inputs: files the stage reads
+    :param outputs: files the stage writes
+    :param stdout: file the command's standard output is written to, if any
+    :param cleanup: glob patterns removed before the stage runs (e.g. RAxML
+                    refuses to overwrite its own output files)
+    :param threads: number of cores the stage uses from the run's CPU budget
+    """
+
+    def __init__(self, name, command, inputs, outputs, stdout=None, cleanup=(), threads=1):
+        self.name = name
+        self.command = command
+        self.inputs = inputs
+        self.outputs = outputs
+        self.stdout = stdout
+        self.cleanup = cleanup
+        self.threads = threads
+
+    def argv(self):
+        return [str(self.threads) if arg == "{threads}" else arg for arg in self.command]
+
+    def signature(self):
+        # the thread count is left as a placeholder - it does not change the results
+        h = hashlib.sha256()
+        h.update(json.dumps(self.command).encode("utf-8"))
+        for path in self.inputs:
+            h.update(path.encode("utf-8") + b"\0" + file_hash(path).encode("ascii"))
+        return h.hexdigest()
+
+    def run(self, cwd, log, telemetry=None, spawn=None):
+        """
+        :param telemetry: Telemetry that records the stage; its file and run
+                          are passed on to the command so that scripts add
+                          their own events to it
+        :param spawn: replacement for subprocess.Popen to start the command
+                      with (see warm_python.py)
+        :return: exit code of the command, 127 if it could not be started
+        """
+        for pattern in self.cleanup:
+            for path in glob.glob(os.path.join(cwd, pattern)):
+                os.remove(path)
+        telemetry = telemetry or Telemetry(script="run_pipeline.py")
+        env = dict(os.environ)
+        env[STAGE_ENV] = self.name
+        if telemetry.enabled:
+            env[TELEMETRY_ENV] = telemetry.path
+            env[RUN_ENV] = telemetry.context.get("run", "")
+        with open(log, "w") as log_file:
+            try:
+                if self.stdout is not None:
+                    with open(self.stdout, "w") as out:
+                        return telemetry.run(self.argv(), event="stage", name=self.name, spawn=spawn, cwd=cwd,
+                                             env=env, stdout=out, stderr=log_file).returncode
+                return telemetry.run(self.argv(), event="stage", name=self.name, spawn=spawn, cwd=cwd, env=env,
+                                     stdout=log_file, stderr=subprocess.STDOUT).returncode
+            except OSError as exc:
+                # e.g. mafft or raxmlHPC not on the PATH: the stage fails, the
+                # other stages carry on
+                log_file.write("Could not run " + " ".join(self.argv()) + ": " + str(exc) + "\n")
+                return 127
+
+
+class Pipeline(object):
+    """
+    Ordered list of stages sharing a results directory and a checkpoint file.
+
+    :param spawn: replacement for subprocess.Popen to start the stages with
+    """
+
+    def __init__(self, run_dir, stages, spawn=None):
+        self.run_dir = run_dir
+        self.stages = stages
+        self.spawn = spawn
+        self.state_path = os.path.join(run_dir, STATE_FILE)
+        self.state = load_state(self.state_path)
+
+    def stage_names(self):
+        return [stage.name for stage in self.stages]
+
+    def producers(self):
+        return dict((path, stage.name) for stage in self.stages for path in stage.outputs)
+
+    def upstream(self, stage):
+        producers = self.producers()
+        return set(producers[path] for path in stage.inputs if path in producers)
+
+    def downstream(self, name):
+        """
+        The named stage and every stage that uses its outputs, directly or
+        through other stages.
+        """
+        found = set([name])
+        changed = True
+        while changed:
+            changed = False
+            for stage in self.stages:
+                if stage.name not in found and self.upstream(stage) & found:
+                    found.add(stage.name)
+                    changed = True
+        return found
+
+    def is_current(self, stage):
+        """
+        True if the stage's checkpoint matches its current inputs and command
+        and its recorded outputs are unchanged.
+        """
+        checkpoint = self.state["stages"].get(stage.name)
+        if checkpoint is None:
+            return False
+        if any(not os.path.exists(path) for path in stage.inputs + stage.outputs):
+            return False
+        if checkpoint["signature"] != stage.signature():
+            return False
+        return all(checkpoint["outputs"].get(path) == file_hash(path) for path in stage.outputs)
+
+    def record(self, stage):
+        self.state["stages"][stage.name] = {
+            "signature": stage.signature(),
+            "outputs": dict((path, file_hash(path)) for path in stage.outputs),
+            "completed": datetime.datetime.now().isoformat(),
+        }
+        save_state(self.state_path, self.state)
+
+    def selected(self, from_stage=None, only=None):
+        """
+        Stages that may run and stages that must run regardless of checkpoints.
+        """
+        if only:
+            return set(only), set(only)
+        if from_stage:
+            forced = self.downstream(from_stage)
+            return forced, forced
+        return set(self.stage_names()), set()
+
+    def plan(self, from_stage=None, only=None):
+        """
+        Decide which stages would execute, without running anything. A stage
+        downstream of one that will execute is reported as pending, since
+        whether it reruns depends on whether its inputs actually change.
+
+        :return: list of (stage, action) with action one of run, pending, skip
+        """
+        allowed, forced = self.selected(from_stage, only)
+        plan = []
+        will_run = set()
+        for stage in self.stages:
+            if stage.name not in allowed:
+                action = "skip"
+            elif stage.name in forced or not self.is_current(stage):
+                action = "run"
+            elif self.upstream(stage) & will_run:
+                action = "pending"
+            else:
+                action = "skip"
+            if action != "skip":
+                will_run.add(stage.name)
+            plan.append((stage, action))
+        return plan
+
+    def run(self, from_stage=None, only=None, cpus=1):
+        """
+        Run the stages as a dependency graph. A stage starts as soon as the
+        stages producing its inputs have finished and enough of the `cpus`
+        budget is free, so independent branches run side by side. Telemetry
+        of every stage is appended to logs/telemetry.jsonl and summarised at
+        the end.
+
+        :return: 0 on success, otherwise the exit code of the first failed stage
+        """
+        allowed, forced = self.selected(from_stage, only)
+        log_dir = os.path.join(self.run_dir, "logs")
+        os.makedirs(log_dir, exist_ok=True)
+        telemetry = Telemetry(os.path.join(log_dir, TELEMETRY_FILE), script="run_pipeline.py")
+        telemetry.context["run"] = datetime.datetime.now().isoformat()
+
+        waiting = list(self.stages)
+        finished = set()
+        running = {}
+        free = cpus
+        failure = 0
+        run_start = time.time()
+        stage_time = 0.0
+        executor = ThreadPoolExecutor(max_workers=len(self.stages))
+
+        while waiting or running:
+            # start every stage whose upstream stages are done, while cores are free
+            progress = False
+            for stage in list(waiting):
+                if failure:
+                    break
+                if not self.upstream(stage) <= finished:
+                    continue
+                if stage.name not in allowed:
+                    print ("[" + stage.name + "] not selected, skipping")
+                    telemetry.emit("stage", stage.name, status="skipped")
+                elif stage.name not in forced and self.is_current(stage):
+                    print ("[" + stage.name + "] inputs unchanged, skipping")
+                    telemetry.emit("stage", stage.name, status="current")
+                else:
+                    missing = [path for path in stage.inputs if not os.path.exists(path)]
+                    if missing:
+                        print ("[" + stage.name + "] missing inputs: " + ", ".join(missing))
+                        failure = 1
+                        break
+                    threads = min(stage.threads, cpus)
+                    if threads > free:
+                        continue
+                    free -= threads
+                    log = os.path.join(log_dir, stage.name + ".log")
+                    print ("[" + stage.name + "] started on " + str(threads) + " core(s): " + " ".join(stage.argv()))
+                    future = executor.submit(stage.run, self.run_dir, log, telemetry, self.spawn)
+                    running[future] = (stage, threads, time.time(), log)
+                    waiting.remove(stage)
+                    progress = True
+                    continue
+                waiting.remove(stage)
+                finished.add(stage.name)
+                progress = True
+
+            if not running:
+                if failure or not waiting:
+                    break
+                if not progress:
+                    print ("Stages " + ", ".join(stage.name for stage in waiting) + " cannot run because an upstream stage did not finish")
+                    failure = 1
+                    break
+                continue
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, threads, start, log = running.pop(future)
+                free += threads
+                elapsed = time.time() - start
+                stage_time += elapsed
+                returncode = future.result()
+                if returncode != 0:
+                    print ("[" + stage.name + "] failed with exit code " + str(returncode) + ", see " + log)
+                    failure = failure or returncode
+                    continue
+                self.record(stage)
+                finished.add(stage.name)
+                print ("[" + stage.name + "] finished in " + "{0:.1f}".format(elapsed) + "s")
+
+        executor.shutdown()
+        wall = time.time() - run_start
+        if stage_time > 0:
+                print ("\nWall time " + "{0:.1f}".format(wall) + "s for " + "{0:.1f}".format(stage_time) +
+                       "s of stage time (" + "{0:.1f}".format(stage_time - wall) + "s saved by running stages concurrently)")
+        print ("\n" + format_summary(summary_rows(read_events(telemetry.path, telemetry.context["run"]))))
+        return failure
+
+
+def load_state(state_path):
+    if os.path.exists(state_path):
+        with open(state_path) as state_file:
+            return json.load(state_file)
+    return {"stages": {}}
+
+
+def save_state(state_path, state):
+    tmp = state_path + ".tmp"
+    with open(tmp, "w") as out:
+        json.dump(state, out, indent=2)
+    os.replace(tmp, state_path)
+
+
+def open_run_dir(run_dir, create=True):
+    """
+    Create a results directory or reopen one to resume.
+
+    :param create: False only reads the directory's state, if there is one,
+                   and leaves the filesystem untouched (for --dry-run)
+    :return: the date used in its file names; a resumed run keeps the date
+             of the day it was started
+    """
+    state = load_state(os.path.join(run_dir, STATE_FILE))
+    now = state.setdefault("date", datetime.datetime.now().strftime("%d-%m-%Y"))
+    if create:
+        os.makedirs(os.path.join(run_dir, "RAxML"), exist_ok=True)
+        save_state(os.path.join(run_dir, STATE_FILE), state)
+    return now
+
+
+def share_cpus(cpus):
+    """
+    Split the CPU budget between the two branches of the pipeline, which run
+    side by side: query -> reports -> overview and align -> phylogeny -> render.
+    The alignment and tree get most of the cores; the report workers get the rest.
+
+    :return: tuple of (report workers, alignment/phylogeny threads)
+    """
+    if cpus < 2:
+        return 1, 1
+    workers = max(1, cpus // 4)
+    return workers, cpus - workers
+
+
+def build_stages(fasta, data, reference, run_dir, now, sierra_url=None, cpus=8, db=None, tree_mode="full", aligner="mafft", preview=True, sketch_index=None, qc_exclude=False, renderer="docx", single_pass=False):
+    """
+    The stages of preprocessing.sh, with every file placed in run_dir.
+
+    :param tree_mode: "full" infers the tree and 100 bootstraps over references
+                      plus samples; "split" does the same with the bootstraps split
+                      into concurrent seeded runs (see raxml_bootstrap.py);
+                      "placement" places the samples onto a cached reference tree
+                      (see reference_tree.py); "subtype" builds one tree per
+                      subtype (see subtype_trees.py)
+    :param aligner: "mafft" runs a single mafft --add; "chunked" adds the samples
+                    to a cached reference profile in parallel chunks (see chunked_align.py)
+    :param preview: draw a quick neighbour-joining tree from the alignment while
+                    the ML tree is inferred (see nj_preview.py)
+    :param sketch_index: SQLite k-mer sketch index of earlier runs to look the
+                         samples up in and append them to (see sketch_index.py)
+    :param qc_exclude: leave the samples that fail QC out of the query and the
+                       tree; otherwise they are only flagged (see fasta_qc.py)
+    :param renderer: "docx" builds each report with python-docx; "fast" fills
+                     XML templates of the same report (see docx_template.py)
+    :param single_pass: write the reports, subtype table and DRM overview in
+                        one "reports" stage that reads the json once (see
+                        parse_json_outputs.py), instead of separate reports
+                        and overview stages
+    """
+    workers, tree_threads = share_cpus(cpus)
+    filename = os.path.splitext(os.path.basename(fasta))[0]
+    python = sys.executable
+
+    def out(name):
+        return os.path.join(run_dir, name)
+
+    # every stage after QC reads the normalised samples rather than the input file
+    raw_fasta = fasta
+    fasta = out(now + "." + filename + "_normalised.fas")
+    qc_table = out(now + "_QC.txt")
+
+    json_out = out(now + "." + filename + ".json")
+    # the normalised results, which the scripts reading the json look for beside it
+    results = ir_path(json_out)
+    subtypes = out(now + "." + filename + ".txt")
+    overview = out(now + "_DRM-overview.txt")
+    alignment = out(now + "." + filename + ".fasta")
+    raxml_dir = out("RAxML")
+    tree = os.path.join(raxml_dir, "RAxML_bipartitionsBranchLabels." + now)
+    pdf = out("RAxML_tree-rerooted.pdf")
+
+    if aligner == "chunked":
+        align = Stage("align",
+                      [python, os.path.join(script_dir, "chunked_align.py"), "--fasta", fasta, "--reference", reference,
+                       "--output", alignment, "--cpus", "{threads}"],
+                      inputs=[fasta, reference], outputs=[alignment], threads=tree_threads)
+    elif tree_mode == "placement":
+        align = Stage("align",
+                      ["mafft", "--thread", "{threads}", "--keeplength", "--add", fasta, "--reorder", reference],
+                      inputs=[fasta, reference], outputs=[alignment], stdout=alignment, threads=tree_threads)
+    else:
+        align = Stage("align",
+                      ["mafft", "--thread", "{threads}", "--add", fasta, "--reorder", reference],
+                      inputs=[fasta, reference], outputs=[alignment], stdout=alignment, threads=tree_threads)
+
+    if tree_mode == "subtype":
+        summary = out(now + "_subtype-trees.txt")
+        tree_stages = [
+            Stage("phylogeny",
+                  [python, os.path.join(script_dir, "subtype_trees.py"), "--fasta", fasta, "--reference", reference,
+                   "--json", json_out, "--output-dir", out("subtypes"), "--name", now, "--summary", summary,
+                   "--cpus", "{threads}"],
+                  inputs=[fasta, reference, json_out, results], outputs=[summary], threads=tree_threads),
+        ]
+    elif tree_mode == "placement":
+        tree = os.path.join(raxml_dir, "RAxML_placementTree." + now)
+        tree_stages = [
+            align,
+            Stage("phylogeny",
+                  [python, os.path.join(script_dir, "reference_tree.py"), "--reference", reference,
+                   "--alignment", alignment, "--name", now, "--output", tree, "--work-dir", raxml_dir,
+                   "--threads", "{threads}"],
+                  inputs=[alignment, reference], outputs=[tree], cleanup=[os.path.join("RAxML", "RAxML_*." + now)],
+                  threads=tree_threads),
+        ]
+    elif tree_mode == "split":
+        tree_stages = [
+            align,
+            Stage("phylogeny",
+                  [python, os.path.join(script_dir, "raxml_bootstrap.py"), "--alignment", alignment, "--name", now,
+                   "--work-dir", raxml_dir, "--cpus", "{threads}"],
+                  inputs=[alignment], outputs=[tree], threads=tree_threads),
+        ]
+    else:
+        tree_stages = [
+            align,
+            Stage("phylogeny",
+                  ["raxmlHPC", "-f", "a", "-m", "GTRGAMMA", "--JC69", "-T", "{threads}", "-p", "12345", "-x", "12345",
+                   "-#", "100", "-s", alignment, "-n", now, "-w", raxml_dir],
+                  inputs=[alignment], outputs=[tree], cleanup=[os.path.join("RAxML", "RAxML_*." + now)],
+                  threads=tree_threads),
+        ]
+
+    store_args = ["--db", db, "--data", data, "--run-id", os.path.basename(run_dir)] if db else []
+    if single_pass:
+        output_stages = [
+            Stage("reports",
+                  [python, os.path.join(script_dir, "parse_json_outputs.py"), "--json", json_out,
+                   "--output", subtypes, "--reports", "--data", data,
+                   "--reports-dir", out(now + "_reports"), "--assets", repo_dir,
+                   "--workers", "{threads}", "--renderer", renderer, "--overview", overview] + store_args,
+                  inputs=[json_out, results, data], outputs=[subtypes, overview], threads=workers),
+        ]
+    else:
+        output_stages = [
+            Stage("reports",
+                  [python, os.path.join(script_dir, "parse_json_write_docx.py"), "--json", json_out,
+                   "--output", subtypes, "--reports", "--data", data,
+                   "--reports-dir", out(now + "_reports"), "--assets", repo_dir, "--subset-data",
+                   "--workers", "{threads}", "--renderer", renderer],
+                  inputs=[json_out, results, data], outputs=[subtypes], threads=workers),
+            Stage("overview",
+                  [python, os.path.join(script_dir, "parse_json_store_metadata.py"), "--json", json_out,
+                   "--output", overview] + store_args,
+                  inputs=[json_out, results] + ([data] if db else []), outputs=[overview]),
+        ]
+
+    return [
+        Stage("qc",
+              [python, os.path.join(script_dir, "fasta_qc.py"), "--fasta", raw_fasta, "--output", fasta,
+               "--table", qc_table] + (["--exclude"] if qc_exclude else []),
+              inputs=[raw_fasta], outputs=[fasta, qc_table]),
+        Stage("query",
+              [python, os.path.join(script_dir, "perform_query.py"), "--fasta", fasta, "--json", json_out]
+              + (["--url", sierra_url] if sierra_url else []),
+              inputs=[fasta], outputs=[json_out]),
+        Stage("normalise",
+              [python, os.path.join(script_dir, "sierra_ir.py"), "--json", json_out, "--output", results],
+              inputs=[json_out], outputs=[results]),
+    ] + output_stages + ([] if not sketch_index else [
+        Stage("sketch",
+              [python, os.path.join(script_dir, "sketch_index.py"), "--index", sketch_index, "--fasta", fasta,
+               "--run-id", os.path.basename(run_dir), "--output", out(now + "_near-samples.tsv")],
+              inputs=[fasta], outputs=[out(now + "_near-samples.tsv")]),
+    ]) + tree_stages + ([] if tree_mode == "subtype" or not preview else [
+        Stage("preview",
+              [python, os.path.join(script_dir, "nj_preview.py"), "--alignment", alignment,
+               "--tree", out(now + "_NJ-preview.nwk"), "--output", out("NJ_tree-preview.pdf")],
+              inputs=[alignment], outputs=[out(now + "_NJ-preview.nwk"), out("NJ_tree-preview.pdf")]),
+    ]) + ([] if tree_mode == "subtype" else [
+        Stage("render",
+              [python, os.path.join(script_dir, "visualise_phylogeny.py"), "--tree", tree, "--reroot",
+               "--output", pdf],
+              inputs=[tree], outputs=[pdf]),
+    ])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--fasta', required=True, help='input sequences in single multi-sample fasta format file')
+    parser.add_argument('-t', '--data', required=True, help='text-tab delimited (.tsv) file with the patient information')
+    parser.add_argument('--reference', required=False, default=os.path.join(repo_dir, 'HIV_aligned_references.fasta'), help='aligned HIV-1 reference sequences. Default = HIV_aligned_references.fasta in the pipeline directory')
+    parser.add_argument('--sierra-url', required=False, help='Sierra GraphQL endpoint passed to perform_query.py')
+    parser.add_argument('--db', required=False, help='SQLite database of all runs that the overview stage appends this run to')
+    parser.add_argument('--tree-mode', required=False, default='full', choices=['full', 'split', 'placement', 'subtype'], help='full: infer the tree with 100 bootstraps over references plus samples; split: the same with the bootstraps split into concurrent seeded RAxML runs; placement: place the samples onto a cached reference tree; subtype: one tree per subtype, built side by side. Default = full')
+    parser.add_argument('--aligner', required=False, default='mafft', choices=['mafft', 'chunked'], help='mafft: a single mafft --add of all samples; chunked: add the samples to a cached reference profile in parallel chunks, keeping the reference columns. Default = mafft')
+    parser.add_argument('--no-preview', required=False, action='store_true', help='do not draw the neighbour-joining preview tree from the alignment')
+    parser.add_argument('--sketch-index', required=False, help='SQLite k-mer sketch index of all runs; earlier samples close to each new sample are listed in the results directory')
+    parser.add_argument('--qc-exclude', required=False, action='store_true', help='leave samples that fail QC (see <date>_QC.txt) out of the HIVdb query, reports and tree')
+    parser.add_argument('--renderer', required=False, default='docx', choices=['docx', 'fast'], help='docx: build the reports with python-docx; fast: fill pre-serialised XML templates of the same reports, much faster for large runs. Default = docx')
+    parser.add_argument('--single-pass', required=False, action='store_true', help='write the reports, subtype table and DRM overview from one read of the json in a single "reports" stage, instead of separate reports and overview stages')
+    parser.add_argument('--cpus', required=False, type=int, default=os.cpu_count() or 1, help='number of cores shared by all concurrently running stages. Default = all cores')
+    parser.add_argument('--run-dir', required=False, help='results directory to create or resume. Default = results_<date>')
+    parser.add_argument('--from-stage', required=False, help='rerun this stage and every stage that uses its outputs, directly or through other stages')
+    parser.add_argument('--only', required=False, action='append', help='run only this stage (may be repeated)')
+    parser.add_argument('--dry-run', required=False, action='store_true', help='print which stages would execute and exit')
+    args = parser.parse_args()
+
+    run_dir = os.path.abspath(args.run_dir or "results_" + datetime.datetime.now().strftime("%d-%m-%Y"))
+    now = open_run_dir(run_dir, create=not args.dry_run)
+
+    stages = build_stages(os.path.abspath(args.fasta), os.path.abspath(args.data),
+                          os.path.abspath(args.reference), run_dir, now, args.sierra_url, args.cpus,
+                          os.path.abspath(args.db) if args.db else None, args.tree_mode, args.aligner,
+                          not args.no_preview, os.path.abspath(args.sketch_index) if args.sketch_index else None,
+                          args.qc_exclude, args.renderer, args.single_pass)
+    pipeline = Pipeline(run_dir, stages)
+
+    names = pipeline.stage_names()
+    for name in ([args.from_stage] if args.from_stage else []) + (args.only or []):
+        if name not in names:
+            parser.error("unknown stage " + name + ", expected one of: " + ", ".join(names))
+
+    print ("Results directory: " + run_dir + "\n")
+    if args.dry_run:
+        for stage, action in pipeline.plan(args.from_stage, args.only):
+            print (action.ljust(8) + stage.name.ljust(10) + str(min(stage.threads, args.cpus)) + " core(s)")
+        sys.exit(0)
+
+    sys.exit(pipeline.run(args.from_stage, args.only, args.cpus))
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3.6
+
+'''
+Normalised form of the sierrapy results of a run. normalise() reduces one
+decoded sequence result to the fields the reports, DRM overview, database and
+subtype trees use, with the drugs interned and each gene's mutation comments
+collected once. A run of them is stored in a compact binary file: tables of
+the distinct samples, subtypes, genes, drugs, mutations, levels and comment
+texts, tables of the distinct drug scores, partial scores and mutation lists
+built from them, and flat integer arrays that code each sample against those,
+with the nesting kept as offset arrays.
+
+load_results() is the reader of every consumer. It reads the binary file kept
+beside the json (<json>.ir), memory-mapped when it is large, so regenerating
+the reports or the overview of a run does not decode the json again. When the
+binary file is missing or older than the json, the json is decoded and the
+binary file written for the next time.
+'''
+
+import os
+import sys
+import json
+import mmap
+import array
+import struct
+import argparse
+import collections
+from sierra_json import iter_results
+import telemetry
+
+
+MAGIC = b"SIERRAIR"
+VERSION = 1
+# magic, format version, length of the manifest that follows
+HEADER = struct.Struct("<8sII")
+# files of at least this size are memory-mapped rather than read
+MMAP_SIZE = 1 << 24
+
+AlignedGene = collections.namedtuple("AlignedGene", ["gene", "first", "last"])
+# label is the drug's name in the report: "full name (abbreviation) "
+Drug = collections.namedtuple("Drug", ["drug_class", "name", "abbr", "full_name", "label"])
+# mutations holds the text of each mutation of the partial score
+Partial = collections.namedtuple("Partial", ["mutations", "score"])
+DrugScore = collections.namedtuple("DrugScore", ["drug", "score", "text", "partials"])
+# mutation_types is a tuple of (mutation type, tuple of mutations); comments
+# holds the comment on each scored mutation, once per mutation
+GeneResistance = collections.namedtuple("GeneResistance", ["gene", "mutation_types", "scores", "comments"])
+Result = collections.namedtuple("Result", ["header", "subtype", "genes", "resistance"])
+
+STRING_TABLES = ["header", "subtype", "gene", "mutation_type", "mutation", "level", "comment",
+                 "drug_class", "drug_name", "drug_abbr", "drug_full_name"]
+# integer arrays: per sample, per gene of a sample ("resistance") and for the
+# distinct aligned genes, mutation lists, drug scores and partial scores they
+# code into. Those in OFFSETS have one more entry than the rows they index;
+# entries offsets[n] to offsets[n + 1] of the array they point into belong to row n
+INT_ARRAYS = ["sample_header", "sample_subtype", "sample_genes", "sample_gene", "sample_resistance",
+              "resistance_gene", "resistance_types", "resistance_type", "resistance_scores", "resistance_score",
+              "resistance_comments", "resistance_comment",
+              "aligned_gene", "aligned_first", "aligned_last",
+              "type_type", "type_mutations", "type_mutation",
+              "score_drug", "score_text", "score_partials", "score_partial",
+              "partial_mutations", "partial_mutation"]
+OFFSETS = ["sample_genes", "sample_resistance", "resistance_types", "resistance_scores", "resistance_comments",
+           "type_mutations", "score_partials", "partial_mutations"]
+SCORE_ARRAYS = ["score_value", "partial_value"]
+ENTRY_TABLES = ["aligned", "type", "score", "partial"]
+
+
+_drugs = {}
+
+def drug(drug_class, name, abbr, full_name):
+    """
+    :return: the Drug of these names, the same object for every sample
+    """
+    key = (drug_class, name, abbr, full_name)
+    found = _drugs.get(key)
+    if found is None:
+        found = _drugs[key] = Drug(drug_class, name, abbr, full_name, full_name + " (" + abbr + ") ")
+    return found
+
+
+def normalise(i):
+    """
+    :param i: decoded sierrapy result of one sequence
+    :return: Result
+    """
+    genes = tuple(AlignedGene(j["gene"]["name"], j["firstAA"], j["lastAA"]) for j in i["alignedGeneSequences"])
+    resistance = []
+    for j in i["drugResistance"]:
+        # every field of each mutation is listed in the report
+        mutation_types = tuple((k["mutationType"], tuple(value for m in k["mutations"] for value in m.values()))
+                               for k in j["mutationsByTypes"])
+        scores = []
+        comments = {}
+        for k in j["drugScores"]:
+            partials = tuple(Partial(tuple(m["text"] for m in p["mutations"]), p["score"]) for p in k["partialScores"])
+            scores.append(DrugScore(drug(k["drugClass"]["name"], k["drug"]["name"], k["drug"]["displayAbbr"],
+                                         k["drug"]["fullName"]), k["score"], k["text"], partials))
+            # the first comment on the first mutation of each partial score of
+            # a resistant drug; a mutation without one keeps the drug's last
+            comment = ""
+            if k["score"] != 0.0:
+                for p in k["partialScores"]:
+                    first = p["mutations"][0]
+                    if "comments" in first:
+                        comment = first["comments"][0]["text"]
+                    comments[first["text"]] = comment
+        resistance.append(GeneResistance(j["gene"]["name"], mutation_types, tuple(scores), tuple(comments.values())))
+    return Result(i["inputSequence"]["header"], i["subtypeText"], genes, tuple(resistance))
+
+
+class _Table(object):
+    """
+    Distinct values in order of first use; code() returns a value's index.
+    """
+
+    def __init__(self):
+        self.values = []
+        self.index = {}
+
+    def code(self, value):
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def _aligned(offset):
+    return (offset + 7) & ~7
+
+
+class Writer(object):
+    """
+    Builds the binary form of a run, one normalised result at a time.
+    """
+
+    def __init__(self):
+        self.tables = dict((name, _Table()) for name in STRING_TABLES)
+        self.drugs = _Table()
+        self.entries = dict((name, _Table()) for name in ENTRY_TABLES)
+        self.arrays = dict((name, array.array('i', [0] if name in OFFSETS else [])) for name in INT_ARRAYS)
+        self.scores = dict((name, array.array('d')) for name in SCORE_ARRAYS)
+        # whether each score was a float or an int in the json, as they print differently
+        self.is_float = dict((name, array.array('b')) for name in SCORE_ARRAYS)
+        self.samples = 0
+
+    def score_types(self):
+        """
+        :return: "float" or "int" if every score is one, otherwise "mixed"
+        """
+        kinds = set(kind for name in SCORE_ARRAYS for kind in set(self.is_float[name]))
+        return "mixed" if len(kinds) > 1 else "int" if 0 in kinds else "float"
+
+    def _score(self, name, value):
+        self.scores[name].append(value)
+        self.is_float[name].append(isinstance(value, float))
+
+    def _aligned_gene(self, gene):
+        a = self.arrays
+        if gene not in self.entries["aligned"].index:
+            a["aligned_gene"].append(self.tables["gene"].code(gene.gene))
+            a["aligned_first"].append(gene.first)
+            a["aligned_last"].append(gene.last)
+        return self.entries["aligned"].code(gene)
+
+    def _mutation_type(self, entry):
+        a = self.arrays
+        if entry not in self.entries["type"].index:
+            mutation_type, mutations = entry
+            a["type_type"].append(self.tables["mutation_type"].code(mutation_type))
+            a["type_mutation"].extend(self.tables["mutation"].code(m) for m in mutations)
+            a["type_mutations"].append(len(a["type_mutation"]))
+        return self.entries["type"].code(entry)
+
+    def _partial(self, p):
+        a = self.arrays
+        # 10 and 10.0 are the same key otherwise
+        key = (p.mutations, p.score, isinstance(p.score, float))
+        if key not in self.entries["partial"].index:
+            a["partial_mutation"].extend(self.tables["mutation"].code(m) for m in p.mutations)
+            a["partial_mutations"].append(len(a["partial_mutation"]))
+            self._score("partial_value", p.score)
+        return self.entries["partial"].code(key)
+
+    def _drug_score(self, k):
+        a = self.arrays
+        partials = tuple(self._partial(p) for p in k.partials)
+        key = (k.drug, k.score, isinstance(k.score, float), k.text, partials)
+        if key not in self.entries["score"].index:
+            a["score_drug"].append(self.drugs.code(k.drug))
+            self._score("score_value", k.score)
+            a["score_text"].append(self.tables["level"].code(k.text))
+            a["score_partial"].extend(partials)
+            a["score_partials"].append(len(a["score_partial"]))
+        return self.entries["score"].code(key)
+
+    def add(self, result):
+        a, t = self.arrays, self.tables
+        a["sample_header"].append(t["header"].code(result.header))
+        a["sample_subtype"].append(t["subtype"].code(result.subtype))
+        a["sample_gene"].extend(self._aligned_gene(gene) for gene in result.genes)
+        a["sample_genes"].append(len(a["sample_gene"]))
+        for j in result.resistance:
+            a["resistance_gene"].append(t["gene"].code(j.gene))
+            a["resistance_type"].extend(self._mutation_type(entry) for entry in j.mutation_types)
+            a["resistance_types"].append(len(a["resistance_type"]))
+            a["resistance_score"].extend(self._drug_score(k) for k in j.scores)
+            a["resistance_scores"].append(len(a["resistance_score"]))
+            a["resistance_comment"].extend(t["comment"].code(c) for c in j.comments)
+            a["resistance_comments"].append(len(a["resistance_comment"]))
+        a["sample_resistance"].append(len(a["resistance_gene"]))
+        self.samples += 1
+
+    def sections(self):
+        """
+        :return: list of (section name, kind, bytes); kind is the array
+                 typecode, or "utf-8" for the text of a string table
+        """
+        tables = dict((name, self.tables[name].values) for name in STRING_TABLES[:7])
+        drugs = self.drugs.values
+        tables.update(drug_class=[d.drug_class for d in drugs], drug_name=[d.name for d in drugs],
+                      drug_abbr=[d.abbr for d in drugs], drug_full_name=[d.full_name for d in drugs])
+        sections = []
+        for name in STRING_TABLES:
+            # one text per table, cut at the character offsets of its strings
+            offsets = array.array('i', [0])
+            for value in tables[name]:
+                offsets.append(offsets[-1] + len(value))
+            sections.append((name, "utf-8", "".join(tables[name]).encode("utf-8")))
+            sections.append((name + "_offsets", 'i', offsets.tobytes()))
+        for name in INT_ARRAYS:
+            sections.append((name, 'i', self.arrays[name].tobytes()))
+        # scores are whole numbers, stored as integers unless one is not
+        for name in SCORE_ARRAYS:
+            values = self.scores[name]
+            if all(v.is_integer() and -2 ** 31 <= v < 2 ** 31 for v in values):
+                sections.append((name, 'i', array.array('i', (int(v) for v in values)).tobytes()))
+            else:
+                sections.append((name, 'd', values.tobytes()))
+            if self.score_types() == "mixed":
+                sections.append((name + "_float", 'b', self.is_float[name].tobytes()))
+        return sections
+
+    def write(self, path, source=None):
+        """
+        Write the file in one go, replacing any earlier one.
+
+        :param source: (size, mtime in ns) of the json the results came from
+        """
+        manifest = {"samples": self.samples, "byteorder": sys.byteorder, "score_types": self.score_types(),
+                    "source": list(source) if source else None, "sections": {}}
+        data = []
+        offset = 0
+        for name, kind, values in self.sections():
+            manifest["sections"][name] = [kind, offset, len(values)]
+            data.append(values + b"\0" * (_aligned(len(values)) - len(values)))
+            offset += len(data[-1])
+        manifest = json.dumps(manifest).encode("ascii")
+        head = HEADER.pack(MAGIC, VERSION, len(manifest)) + manifest
+        tmp = path + "." + str(os.getpid()) + ".tmp"
+        with open(tmp, "wb") as out:
+            out.write(head + b"\0" * (_aligned(len(head)) - len(head)))
+            for values in data:
+                out.write(values)
+        os.replace(tmp, path)
+
+
+class Results(object):
+    """
+    The normalised results of a run read from its binary file. Iterating over
+    it gives a Result per sample, in the order of the json.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as ir_file:
+            if os.fstat(ir_file.fileno()).st_size >= MMAP_SIZE:
+                buf = mmap.mmap(ir_file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buf = ir_file.read()
+        view = memoryview(buf)
+        if len(view) < HEADER.size:
+            raise ValueError(path + " is not a sierrapy results file")
+        magic, version, length = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(path + " is not a sierrapy results file of version " + str(VERSION))
+        manifest = json.loads(bytes(view[HEADER.size:HEADER.size + length]).decode("ascii"))
+        if manifest["byteorder"] != sys.byteorder:
+            raise ValueError(path + " was written on a machine of different byte order")
+        base = _aligned(HEADER.size + length)
+        self.samples = manifest["samples"]
+        self.source = manifest["source"]
+        self.score_types = manifest["score_types"]
+        sections = {}
+        for name, (kind, offset, size) in manifest["sections"].items():
+            values = view[base + offset:base + offset + size]
+            sections[name] = bytes(values).decode("utf-8") if kind == "utf-8" else values.cast(kind)
+        self.arrays = dict((name, sections[name]) for name in INT_ARRAYS + SCORE_ARRAYS)
+        if self.score_types == "mixed":
+            self.arrays.update((name + "_float", sections[name + "_float"]) for name in SCORE_ARRAYS)
+        self.tables = {}
+        for name in STRING_TABLES:
+            text, offsets = sections[name], sections[name + "_offsets"].tolist()
+            self.tables[name] = [text[start:end] for start, end in zip(offsets, offsets[1:])]
+
+    def __len__(self):
+        return self.samples
+
+    def _scores(self, name):
+        values = self.arrays[name]
+        if self.score_types == "mixed":
+            return [float(value) if is_float else int(value) for value, is_float in zip(values, self.arrays[name + "_float"])]
+        kind = float if self.score_types == "float" else int
+        return [kind(value) for value in values]
+
+    def __iter__(self):
+        a, t = self.arrays, self.tables
+
+        def pick(table, codes, offsets, n):
+            return tuple(table[code] for code in codes[offsets[n]:offsets[n + 1]])
+
+        # the distinct entries are built once and shared by the samples
+        genes, mutations = t["gene"], t["mutation"]
+        drugs = [drug(*names) for names in zip(t["drug_class"], t["drug_name"], t["drug_abbr"], t["drug_full_name"])]
+        aligned = [AlignedGene(genes[gene], first, last)
+                   for gene, first, last in zip(a["aligned_gene"], a["aligned_first"], a["aligned_last"])]
+        types = [(t["mutation_type"][code], pick(mutations, a["type_mutation"], a["type_mutations"], n))
+                 for n, code in enumerate(a["type_type"])]
+        partials = [Partial(pick(mutations, a["partial_mutation"], a["partial_mutations"], n), value)
+                    for n, value in enumerate(self._scores("partial_value"))]
+        scores = [DrugScore(drugs[code], value, t["level"][level], pick(partials, a["score_partial"], a["score_partials"], n))
+                  for n, (code, value, level) in enumerate(zip(a["score_drug"], self._scores("score_value"), a["score_text"]))]
+
+        headers, subtypes, comments = t["header"], t["subtype"], t["comment"]
+        sample_header, sample_subtype, sample_genes, sample_gene, sample_resistance = (
+            a[name] for name in INT_ARRAYS[:5])
+        resistance_gene, resistance_types, resistance_type, resistance_scores, resistance_score, \
+            resistance_comments, resistance_comment = (a[name] for name in INT_ARRAYS[5:12])
+        for n in range(self.samples):
+            resistance = tuple(GeneResistance(genes[resistance_gene[r]],
+                                              pick(types, resistance_type, resistance_types, r),
+                                              pick(scores, resistance_score, resistance_scores, r),
+                                              pick(comments, resistance_comment, resistance_comments, r))
+                               for r in range(sample_resistance[n], sample_resistance[n + 1]))
+            yield Result(headers[sample_header[n]], subtypes[sample_subtype[n]],
+                         pick(aligned, sample_gene, sample_genes, n), resistance)
+
+
+def ir_path(json_in):
+    """
+    :return: path of the binary file kept beside a sierrapy json file
+    """
+    return json_in + ".ir"
+
+
+def source_stamp(json_in):
+    """
+    :return: (size, mtime in ns) of the json, recorded in the binary file to
+             tell whether it is still up to date
+    """
+    st = os.stat(json_in)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def is_ir(path):
+    with open(path, "rb") as in_file:
+        return in_file.read(len(MAGIC)) == MAGIC
+
+
+def _decode(json_in, cache):
+    writer = Writer() if cache else None
+    stamp = source_stamp(json_in)
+    for i in iter_results(json_in):
+        result = normalise(i)
+        if writer is not None:
+            writer.add(result)
+        yield result
+    if writer is not None:
+        try:
+            writer.write(cache, stamp)
+        except OSError:
+            # the results directory may be read-only; the json is decoded again next time
+            pass
+
+
+def load_results(json_in, cache=True):
+    """
+    The normalised results of a run.
+
+    :param json_in: sierrapy json file, or a binary file written by this module
+    :param cache: when the json has to be decoded, write its binary file
+                  (see ir_path) for the next time
+    :return: iterable of Result, one per queried sequence in the order of the json
+    """
+    if is_ir(json_in):
+        return Results(json_in)
+    try:
+        results = Results(ir_path(json_in))
+        if results.source == source_stamp(json_in):
+            return results
+    except (OSError, ValueError):
+        pass
+    return _decode(json_in, ir_path(json_in) if cache else None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--json', required=True, help='input json file containing query results')
+    parser.add_argument('--output', required=False, help='binary file to write. Default = <json>.ir, where the other scripts look for it')
+    args = parser.parse_args()
+
+    span = telemetry.get().stage("normalise")
+    output = args.output or ir_path(args.json)
+    writer = Writer()
+    stamp = source_stamp(args.json)
+    for i in iter_results(args.json):
+        writer.add(normalise(i))
+    writer.write(output, stamp)
+    print("Normalised " + str(writer.samples) + " results of " + args.json + " into " + output + " (" +
+          str(os.path.getsize(output)) + " of " + str(stamp[0]) + " bytes)")
+    span.count(samples=writer.samples, bytes=os.path.getsize(output))
+    span.end()
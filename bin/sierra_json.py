@@ -0,0 +1,67 @@
+#!/usr/bin/env python3.6
+
+'''
+Incremental reader for the json returned by a sierrapy query. The response is
+a single top-level array with one object per sequence; the objects are decoded
+and yielded one at a time so memory use does not grow with the size of the run.
+'''
+
+import json
+
+
+def iter_results(json_in, chunk_size=1 << 16):
+    """
+    Yield each sequence result from a sierrapy json file in turn.
+
+    :param json_in: path to the sierrapy json file
+    :param chunk_size: number of characters read from the file at a time
+    :return: generator of dicts, one per queried sequence
+    """
+    decoder = json.JSONDecoder()
+    with open(json_in) as json_file:
+        buf = ""
+        pos = 0
+        eof = False
+
+        def fill(buf, pos, size):
+            chunk = json_file.read(size)
+            return buf[pos:] + chunk, 0, not chunk
+
+        # find the opening bracket of the top-level array
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf):
+                break
+            if eof:
+                return
+            buf, pos, eof = fill(buf, pos, chunk_size)
+        if buf[pos] != "[":
+            raise ValueError(json_in + " does not contain a json array of sequence results")
+        pos += 1
+
+        read_size = chunk_size
+        while True:
+            # skip separators between objects
+            while pos < len(buf) and (buf[pos].isspace() or buf[pos] == ","):
+                pos += 1
+            if pos == len(buf):
+                if eof:
+                    raise ValueError("Unexpected end of file in " + json_in)
+                buf, pos, eof = fill(buf, pos, chunk_size)
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                result, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # object is incomplete - read more of the file, doubling the read
+                # size so a single very large object is not re-decoded many times
+                if eof:
+                    raise
+                buf, pos, eof = fill(buf, pos, read_size)
+                read_size *= 2
+                continue
+            read_size = chunk_size
+            pos = end
+            yield result
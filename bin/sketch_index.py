@@ -0,0 +1,216 @@
+#!/usr/bin/env python3.6
+
+'''
+Persistent MinHash sketch index of every sample sequenced so far, for spotting
+possible contamination or transmission clusters across runs. Each sequence is
+reduced to a MinHash signature of its k-mers; the signatures are stored in a
+SQLite file together with locality sensitive hashing (LSH) band keys, so the
+earlier samples close to a new one are found by a few indexed lookups rather
+than by comparing it with every sample in the index.
+'''
+
+import os
+import hashlib
+import sqlite3
+import argparse
+import datetime
+import numpy as np
+from fasta_io import read_fasta
+
+
+K = 15
+NUM_HASHES = 128
+BANDS = 32
+SEED = 42
+
+# a sequence needs this many distinct k-mers for a usable signature
+MIN_KMERS = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    source TEXT,
+    added TEXT,
+    n_samples INTEGER
+);
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    header TEXT NOT NULL,
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bands (
+    band INTEGER NOT NULL,
+    key INTEGER NOT NULL,
+    sample INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_run_id ON samples (run_id);
+CREATE INDEX IF NOT EXISTS bands_key ON bands (band, key);
+CREATE INDEX IF NOT EXISTS bands_sample ON bands (sample);
+"""
+
+# 2-bit code of each base; anything else ends the k-mers that span it
+BASE_CODES = np.full(256, 255, dtype=np.uint8)
+for n, base in enumerate("ACGT"):
+    BASE_CODES[ord(base)] = BASE_CODES[ord(base.lower())] = n
+BASE_CODES[ord("U")] = BASE_CODES[ord("u")] = 3
+
+
+def _hash_params(num_hashes, seed):
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, 2 ** 62, size=num_hashes, dtype=np.uint64) | np.uint64(1)
+    b = rng.randint(0, 2 ** 62, size=num_hashes, dtype=np.uint64)
+    return a, b
+
+
+def kmers(sequence, k=K):
+    """
+    :return: uint64 array of the distinct k-mers without ambiguity codes or gaps
+    """
+    codes = BASE_CODES[np.frombuffer(sequence.encode("ascii"), dtype=np.uint8)]
+    if len(codes) < k:
+        return np.zeros(0, dtype=np.uint64)
+    bad = np.concatenate(([0], np.cumsum(codes > 3)))
+    ok = (bad[k:] - bad[:-k]) == 0
+    # k-mer starting at each position, built up one base at a time (numpy
+    # 1.19, the last release for Python 3.6, has no sliding_window_view)
+    n = len(codes) - k + 1
+    values = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        values = (values << np.uint64(2)) | (codes[j:j + n] & 3).astype(np.uint64)
+    return np.unique(values[ok])
+
+
+def jaccard_to_distance(jaccard, k=K):
+    """
+    Mash distance, an estimate of the per-base divergence of two sequences.
+    """
+    if jaccard <= 0:
+        return 1.0
+    return min(1.0, -np.log(2.0 * jaccard / (1.0 + jaccard)) / k)
+
+
+class SketchIndex(object):
+    """
+    SQLite file of MinHash signatures with LSH band keys.
+    """
+
+    def __init__(self, path, k=K, num_hashes=NUM_HASHES, bands=BANDS, seed=SEED):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        params = {"k": str(k), "num_hashes": str(num_hashes), "bands": str(bands), "seed": str(seed)}
+        stored = dict(self.conn.execute("SELECT key, value FROM meta"))
+        if stored and stored != params:
+            raise ValueError(path + " was built with " + ", ".join(key + "=" + value for key, value in sorted(stored.items())))
+        if not stored:
+            with self.conn:
+                self.conn.executemany("INSERT INTO meta VALUES (?, ?)", params.items())
+        if num_hashes % bands:
+            raise ValueError("num_hashes must be a multiple of bands")
+        self.k, self.num_hashes, self.bands = k, num_hashes, bands
+        self.rows = num_hashes // bands
+        self.a, self.b = _hash_params(num_hashes, seed)
+
+    def close(self):
+        self.conn.close()
+
+    def signature(self, sequence):
+        """
+        :return: uint64 array of num_hashes minimum hash values, or None if the
+                 sequence has too few clean k-mers
+        """
+        values = kmers(sequence, self.k)
+        if len(values) < MIN_KMERS:
+            return None
+        return (values[:, None] * self.a[None, :] + self.b[None, :]).min(axis=0)
+
+    def band_keys(self, signature):
+        keys = []
+        for band in range(self.bands):
+            digest = hashlib.blake2b(signature[band * self.rows:(band + 1) * self.rows].tobytes(), digest_size=8).digest()
+            keys.append((band, int.from_bytes(digest, "little", signed=True)))
+        return keys
+
+    def nearest(self, signature, max_distance, limit=10, exclude_run=None):
+        """
+        Earlier samples within max_distance of a signature, closest first.
+
+        :return: list of (distance, jaccard, run_id, header)
+        """
+        candidates = set()
+        for band, key in self.band_keys(signature):
+            candidates.update(row[0] for row in self.conn.execute(
+                "SELECT sample FROM bands WHERE band = ? AND key = ?", (band, key)))
+        hits = []
+        for sample in candidates:
+            run_id, header, blob = self.conn.execute(
+                "SELECT run_id, header, signature FROM samples WHERE id = ?", (sample,)).fetchone()
+            if run_id == exclude_run:
+                continue
+            jaccard = float(np.mean(np.frombuffer(blob, dtype=np.uint64) == signature))
+            distance = jaccard_to_distance(jaccard, self.k)
+            if distance <= max_distance:
+                hits.append((distance, jaccard, run_id, header))
+        hits.sort()
+        return hits[:limit]
+
+    def add_run(self, run_id, signatures, source=None):
+        """
+        Add one run's signatures, replacing any earlier copy of the run.
+
+        :param signatures: list of (header, signature)
+        """
+        with self.conn:
+            old = [row[0] for row in self.conn.execute("SELECT id FROM samples WHERE run_id = ?", (run_id,))]
+            self.conn.executemany("DELETE FROM bands WHERE sample = ?", [(sample,) for sample in old])
+            self.conn.execute("DELETE FROM samples WHERE run_id = ?", (run_id,))
+            self.conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+            for header, signature in signatures:
+                sample = self.conn.execute("INSERT INTO samples (run_id, header, signature) VALUES (?, ?, ?)",
+                                           (run_id, header, signature.tobytes())).lastrowid
+                self.conn.executemany("INSERT INTO bands VALUES (?, ?, ?)",
+                                      [(band, key, sample) for band, key in self.band_keys(signature)])
+            self.conn.execute("INSERT INTO runs VALUES (?, ?, ?, ?)",
+                              (run_id, source, datetime.datetime.now().isoformat(), len(signatures)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--index', required=True, help='SQLite sketch index of all earlier runs; created if missing')
+    parser.add_argument('--fasta', required=True, help='input sequences in single multi-sample fasta format file')
+    parser.add_argument('--run-id', required=False, help='identifier of this run in the index. Default = fasta file name')
+    parser.add_argument('--output', required=True, help='tab-delimited file of the earlier samples close to each sample of this run')
+    parser.add_argument('--max-distance', required=False, type=float, default=0.015, help='report earlier samples up to this estimated divergence. Default = 0.015')
+    parser.add_argument('--max-hits', required=False, type=int, default=10, help='earlier samples reported per sample. Default = 10')
+    args = parser.parse_args()
+
+    run_id = args.run_id or os.path.basename(args.fasta)
+    index = SketchIndex(args.index)
+    signatures = []
+    skipped = []
+    for header, sequence in read_fasta(args.fasta):
+        signature = index.signature(sequence)
+        if signature is None:
+            skipped.append(header)
+        else:
+            signatures.append((header, signature))
+
+    close = 0
+    with open(args.output, "w") as out:
+        out.write("sample\tprevious_run\tprevious_sample\tdistance\tshared_hashes\n")
+        for header, signature in signatures:
+            hits = index.nearest(signature, args.max_distance, args.max_hits, exclude_run=run_id)
+            close += 1 if hits else 0
+            for distance, jaccard, previous_run, previous in hits:
+                out.write("\t".join([header, previous_run, previous, "{0:.4f}".format(distance), "{0:.3f}".format(jaccard)]) + "\n")
+
+    index.add_run(run_id, signatures, source=os.path.abspath(args.fasta))
+    index.close()
+    if skipped:
+        print ("Not indexed, too few unambiguous " + str(K) + "-mers: " + ", ".join(skipped))
+    print (str(close) + " of " + str(len(signatures)) + " samples are within " + str(args.max_distance) +
+           " of an earlier sample, see " + args.output)
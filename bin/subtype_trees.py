@@ -0,0 +1,171 @@
+#!/usr/bin/env python3.6
+
+'''
+One phylogeny per HIV-1 subtype. The samples are split by the subtype HIVdb
+assigned them (subtypeText in the sierrapy json, or the subtype table written
+by parse_json_write_docx.py --output), each group is paired with the reference
+sequences of its subtype, and the groups are aligned, inferred and rendered
+side by side, one PDF per subtype. Samples of subtypes without references, or
+without a subtype, are drawn against every reference.
+'''
+
+import os
+import re
+import sys
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from fasta_io import read_fasta, write_fasta
+from chunked_align import drop_gap_columns
+from sierra_ir import load_results
+import telemetry
+
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+OTHER = "other"
+
+# RAxML needs at least four sequences for a tree
+MIN_TAXA = 4
+
+
+def subtype_key(subtype):
+    """
+    Group name of a subtype or reference name: "A1 (3.1%)" and "A2" -> "A",
+    "CRF01_AE (2.0%)" -> "AE", "NA" -> "other".
+    """
+    subtype = subtype.split("(")[0].strip()
+    if not subtype or subtype == "NA":
+        return OTHER
+    if subtype.startswith("CRF") and "_" in subtype:
+        subtype = subtype.split("_", 1)[1]
+    return re.sub(r"\d+$", "", subtype) or subtype
+
+
+def read_subtypes(json_in=None, subtypes_in=None):
+    """
+    :return: dict of sample header -> subtype text
+    """
+    subtypes = {}
+    if json_in:
+        for i in load_results(json_in):
+            subtypes[i.header] = i.subtype
+    if subtypes_in:
+        with open(subtypes_in) as subtype_file:
+            for line in subtype_file:
+                values = line.rstrip("\r\n").split("\t")
+                if len(values) >= 2:
+                    subtypes[values[0]] = values[1]
+    return subtypes
+
+
+def partition(samples, references, subtypes):
+    """
+    Group the samples by subtype and pair each group with its references.
+
+    :return: list of (group, sample records, reference records), largest group first
+    """
+    groups = {}
+    for record in samples:
+        groups.setdefault(subtype_key(subtypes.get(record[0], "NA")), []).append(record)
+    ref_groups = {}
+    for record in references:
+        ref_groups.setdefault(subtype_key(record[0]), []).append(record)
+
+    partitions = []
+    for group, members in groups.items():
+        refs = ref_groups.get(group, [])
+        if not refs or len(refs) + len(members) < MIN_TAXA:
+            refs = references
+        partitions.append((group, members, drop_gap_columns(refs)))
+    partitions.sort(key=lambda p: len(p[1]), reverse=True)
+    return partitions
+
+
+def run_logged(command, cwd, log, stdout=None):
+    with open(log, "a") as log_file:
+        telemetry.get().run(command, cwd=cwd, stdout=stdout or log_file, stderr=log_file, check=True)
+
+
+def subtype_tree(group, samples, references, out_dir, name, threads, render_options):
+    """
+    Align, infer and render the tree of one subtype group.
+
+    :return: path of the rendered tree
+    """
+    work = os.path.join(out_dir, group)
+    os.makedirs(os.path.join(work, "RAxML"), exist_ok=True)
+    log = os.path.join(work, group + ".log")
+    open(log, "w").close()
+    sample_fasta = os.path.join(work, "samples.fasta")
+    ref_fasta = os.path.join(work, "references.fasta")
+    alignment = os.path.join(work, name + "." + group + ".fasta")
+    write_fasta(samples, sample_fasta)
+    write_fasta(references, ref_fasta)
+
+    with open(alignment, "w") as out:
+        run_logged(["mafft", "--thread", str(threads), "--add", sample_fasta, "--reorder", ref_fasta], work, log, out)
+    for old in os.listdir(os.path.join(work, "RAxML")):
+        if old.endswith("." + name):
+            os.remove(os.path.join(work, "RAxML", old))
+    run_logged(["raxmlHPC", "-f", "a", "-m", "GTRGAMMA", "--JC69", "-T", str(threads), "-p", "12345", "-x", "12345",
+                "-#", "100", "-s", alignment, "-n", name, "-w", os.path.join(work, "RAxML")], work, log)
+    pdf = os.path.join(out_dir, "RAxML_tree-rerooted." + group + ".pdf")
+    run_logged([sys.executable, os.path.join(script_dir, "visualise_phylogeny.py"), "--tree",
+                os.path.join(work, "RAxML", "RAxML_bipartitionsBranchLabels." + name), "--reroot",
+                "--output", pdf] + render_options, work, log)
+    return pdf
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fasta', required=True, help='input sequences in single multi-sample fasta format file')
+    parser.add_argument('--reference', required=True, help='aligned HIV-1 reference sequences')
+    parser.add_argument('--json', required=False, help='sierrapy json of the run, for the subtype of each sample')
+    parser.add_argument('--subtypes', required=False, help='tab-delimited sample/subtype table written by parse_json_write_docx.py --output')
+    parser.add_argument('--output-dir', required=False, default='subtypes', help='directory for the per-subtype files and trees. Default = subtypes')
+    parser.add_argument('--name', required=True, help='RAxML run name')
+    parser.add_argument('--summary', required=False, help='tab-delimited file listing each subtype, its number of samples and its tree')
+    parser.add_argument('--cpus', required=False, type=int, default=os.cpu_count() or 1, help='number of cores shared by the subtype trees. Default = all cores')
+    parser.add_argument('--scalable', required=False, action='store_true', help='render with visualise_phylogeny.py --scalable')
+    args = parser.parse_args()
+
+    if not args.json and not args.subtypes:
+        parser.error("one of --json or --subtypes is required")
+
+    subtypes = read_subtypes(args.json, args.subtypes)
+    partitions = partition(read_fasta(args.fasta), read_fasta(args.reference), subtypes)
+    processes = max(1, min(len(partitions), args.cpus))
+    threads = max(1, args.cpus // processes)
+    print ("Building " + str(len(partitions)) + " subtype trees, " + str(processes) + " at a time with " +
+           str(threads) + " thread(s) each: " + ", ".join(group + " (" + str(len(members)) + ")" for group, members, refs in partitions))
+
+    out_dir = os.path.abspath(args.output_dir)
+    render_options = ["--scalable"] if args.scalable else []
+    failed = 0
+    with ThreadPoolExecutor(max_workers=processes) as executor:
+        futures = [(group, members, executor.submit(subtype_tree, group, members, refs, out_dir, args.name, threads, render_options))
+                   for group, members, refs in partitions]
+        rows = []
+        for group, members, future in futures:
+            try:
+                pdf = future.result()
+                print ("Tree for subtype " + group + " saved to " + pdf)
+            except subprocess.CalledProcessError as exc:
+                pdf = ""
+                failed += 1
+                print ("Tree for subtype " + group + " failed (" + " ".join(exc.cmd[:3]) + "), see " +
+                       os.path.join(out_dir, group, group + ".log"))
+            except OSError as exc:
+                # a tool that is not installed fails the group, not the others
+                pdf = ""
+                failed += 1
+                print ("Tree for subtype " + group + " failed (" + str(exc) + ")")
+            rows.append((group, str(len(members)), pdf))
+
+    if args.summary:
+        with open(args.summary, "w") as out:
+            out.write("subtype\tsamples\ttree\n")
+            for row in rows:
+                out.write("\t".join(row) + "\n")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3.6
+
+'''
+Per-stage and per-sample timing and resource telemetry, shared by the pipeline
+scripts and run_pipeline.py. Events are appended as JSON lines to the file
+named by the PIPELINE_TELEMETRY environment variable (run_pipeline.py sets it
+for every stage); without it nothing is recorded. Each event carries its wall
+time, CPU time and peak resident memory, any item counts, and for external
+tools (sierrapy, mafft, raxmlHPC) the exit code. Run directly to print the
+summary table of a telemetry file.
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import datetime
+import subprocess
+
+
+TELEMETRY_ENV = "PIPELINE_TELEMETRY"
+# set by run_pipeline.py so events can be matched to its stages and run
+STAGE_ENV = "PIPELINE_STAGE"
+RUN_ENV = "PIPELINE_RUN"
+
+
+def _usage():
+    """
+    :return: tuple of (CPU seconds of this process and its finished children,
+             peak RSS in MB of this process or its largest finished child)
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+    # ru_maxrss is in kilobytes on Linux
+    return cpu, max(own.ru_maxrss, children.ru_maxrss) / 1024.0
+
+
+class Telemetry(object):
+    """
+    Writer of telemetry events for one script.
+
+    :param path: JSON-lines file to append to. Default = $PIPELINE_TELEMETRY;
+                 if neither is set, events are discarded
+    :param script: name recorded with every event. Default = the running script
+    """
+
+    def __init__(self, path=None, script=None):
+        self.path = path or os.environ.get(TELEMETRY_ENV)
+        self.script = script or os.path.basename(sys.argv[0])
+        self.context = {}
+        for key, env in (("run", RUN_ENV), ("pipeline_stage", STAGE_ENV)):
+            if os.environ.get(env):
+                self.context[key] = os.environ[env]
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def emit(self, event, name, **fields):
+        if not self.path:
+            return
+        record = {"time": datetime.datetime.now().isoformat(), "script": self.script, "pid": os.getpid(),
+                  "event": event, "name": name}
+        record.update(self.context)
+        record.update(fields)
+        # one write per event on an O_APPEND file, so processes writing to
+        # the same file at once do not interleave their lines
+        with open(self.path, "a") as out:
+            out.write(json.dumps(record) + "\n")
+
+    def stage(self, name, **counts):
+        """
+        Span covering one step of a script, emitted as a "stage" event when it ends.
+        """
+        return Span(self, "stage", name, counts)
+
+    def sample(self, name, **counts):
+        """
+        Span covering the work on one sample, emitted as a "sample" event.
+        """
+        return Span(self, "sample", name, counts)
+
+    def run(self, command, check=False, event="tool", name=None, spawn=None, **kwargs):
+        """
+        subprocess.run for an external tool, emitting a "tool" event with the
+        tool's own wall time, CPU time, peak RSS and exit code.
+
+        :param name: name of the event. Default = the program name
+        :param spawn: callable starting the command in a child process, with
+                      the signature of subprocess.Popen and returning an object
+                      with its pid, kill() and wait(), and wait4() if the
+                      process is not a child of this one. Default = subprocess.Popen
+        :param kwargs: passed to subprocess.Popen (stdout, stderr, cwd, env, ...)
+        :return: subprocess.CompletedProcess (output is not captured)
+        """
+        start = time.perf_counter()
+        process = (spawn or subprocess.Popen)(command, **kwargs)
+        try:
+            pid, status, usage = process.wait4() if hasattr(process, "wait4") else os.wait4(process.pid, 0)
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+        self.emit(event, name or os.path.basename(command[0]), status="ok" if process.returncode == 0 else "failed",
+                  wall_s=round(time.perf_counter() - start, 3),
+                  cpu_s=round(usage.ru_utime + usage.ru_stime, 3), peak_rss_mb=round(usage.ru_maxrss / 1024.0, 1),
+                  exit_code=process.returncode, command=[str(arg) for arg in command])
+        if check and process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command)
+        return subprocess.CompletedProcess(command, process.returncode)
+
+
+class Span(object):
+    """
+    Timed section of a script. Use as a context manager, or call end()
+    yourself; counts of items processed are added with count().
+    """
+
+    def __init__(self, telemetry, event, name, counts):
+        self.telemetry = telemetry
+        self.event = event
+        self.name = name
+        self.counts = dict(counts)
+        self.done = False
+        self.start = time.perf_counter()
+        self.start_cpu = _usage()[0]
+
+    def count(self, **counts):
+        self.counts.update(counts)
+
+    def end(self, status="ok", **fields):
+        if self.done:
+            return
+        self.done = True
+        cpu, peak = _usage()
+        self.telemetry.emit(self.event, self.name, status=status, wall_s=round(time.perf_counter() - self.start, 3),
+                            cpu_s=round(cpu - self.start_cpu, 3), peak_rss_mb=round(peak, 1), counts=self.counts, **fields)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None or issubclass(exc_type, SystemExit) and not exc.code:
+            self.end()
+        else:
+            self.end("error", error="{0}: {1}".format(exc_type.__name__, exc))
+        return False
+
+
+_default = None
+
+
+def get():
+    """
+    The Telemetry of this process, created from the environment on first use.
+    """
+    global _default
+    if _default is None:
+        _default = Telemetry()
+    return _default
+
+
+def read_events(path, run=None):
+    events = []
+    if not os.path.exists(path):
+        return events
+    with open(path) as events_file:
+        for line in events_file:
+            line = line.strip()
+            if line:
+                event = json.loads(line)
+                if run is None or event.get("run") == run:
+                    events.append(event)
+    return events
+
+
+def summary_rows(events):
+    """
+    One row per pipeline stage (or per script stage, for events recorded
+    outside run_pipeline.py), merging the counts reported by the scripts and
+    the exit codes of the external tools each stage ran.
+
+    :return: list of dicts with stage, status, wall_s, cpu_s, peak_rss_mb, exit_code, items
+    """
+    rows = {}
+    order = []
+
+    def row(name):
+        if name not in rows:
+            order.append(name)
+            rows[name] = {"stage": name, "status": "", "wall_s": None, "cpu_s": None, "peak_rss_mb": None,
+                          "exit_code": None, "items": {}, "tools": [], "samples": 0}
+        return rows[name]
+
+    for event in events:
+        stage = event.get("pipeline_stage")
+        if event["script"] == "run_pipeline.py" and event["event"] == "stage":
+            # the driver's own measurement of the whole stage process
+            current = row(event["name"])
+            for key in ("status", "wall_s", "cpu_s", "peak_rss_mb", "exit_code"):
+                if key in event:
+                    current[key] = event[key]
+            continue
+        current = row(stage or event["script"] + ":" + event["name"])
+        if event["event"] == "stage":
+            current["items"].update(event.get("counts", {}))
+            if stage is None:
+                for key in ("status", "wall_s", "cpu_s", "peak_rss_mb"):
+                    current[key] = event[key]
+        elif event["event"] == "sample":
+            current["samples"] += 1
+        elif event["event"] == "tool":
+            current["tools"].append(event["name"] + "=" + str(event["exit_code"]))
+    return [rows[name] for name in order]
+
+
+def format_summary(rows):
+    def number(value, fmt):
+        return "" if value is None else fmt.format(value)
+
+    lines = ["stage".ljust(12) + "status".ljust(9) + "wall (s)".rjust(10) + "CPU (s)".rjust(10) +
+             "peak RSS (MB)".rjust(15) + "exit".rjust(6) + "  items"]
+    for current in rows:
+        items = [key + "=" + str(value) for key, value in sorted(current["items"].items())]
+        if current["samples"]:
+            items.append("timed_samples=" + str(current["samples"]))
+        if current["tools"]:
+            items.append("tools: " + " ".join(current["tools"]))
+        lines.append(current["stage"].ljust(12) + current["status"].ljust(9) +
+                     number(current["wall_s"], "{0:.1f}").rjust(10) + number(current["cpu_s"], "{0:.1f}").rjust(10) +
+                     number(current["peak_rss_mb"], "{0:.0f}").rjust(15) + number(current["exit_code"], "{0}").rjust(6) +
+                     "  " + ", ".join(items))
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('events', help='JSON-lines telemetry file, e.g. <results>/logs/telemetry.jsonl')
+    parser.add_argument('--run', required=False, help='only summarise the events of this run. Default = the last run in the file')
+    parser.add_argument('--all', required=False, action='store_true', help='summarise every event in the file')
+    args = parser.parse_args()
+
+    events = read_events(args.events)
+    run = args.run
+    if run is None and not args.all:
+        runs = [event["run"] for event in events if event.get("run")]
+        run = runs[-1] if runs else None
+    if run is not None:
+        events = [event for event in events if event.get("run") == run]
+        print ("Run " + run)
+    print (format_summary(summary_rows(events)))
@@ -1,18 +1,28 @@
 #!/usr/bin/env python3
 
 '''
-Short Python script to read in a tree file and save it as a pdf. Also has the option to rerot the tree first using RAxML. 
+Short Python script to read in a tree file and save it as a pdf. Also has the option to reroot the tree first, either at the branch that best balances the subtree lengths (with RAxML -f I, or in-process with phylo_tree.reroot_balanced) or at its midpoint. 
 '''
 __author__ = "Samantha Campbell"
 
-import re 
 import argparse
-import subprocess as sp
-from ete3 import Tree, TreeStyle, NodeStyle, TextFace
+from ete3 import TreeStyle, NodeStyle, AttrFace, DynamicItemFace
+from ete3.treeview.qt import QGraphicsRectItem, QGraphicsPolygonItem, QPolygonF, QPointF, QColor, QBrush, QPen, Qt
+from phylo_tree import parse_newick, raxml_rooted, reroot_balanced, reroot_midpoint, collapse_clades
+import telemetry
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--tree', required=True, help='Requires tree from RaxML')
-parser.add_argument('--reroot', required=False, action='store_true', help='If true, the tree will be rerooted at the branch that best balances the subtree lengths by RAxML. Default = False')
+parser.add_argument('--output', required=False, default='RAxML_tree-rerooted.pdf', help='file name of the rendered tree; .pdf, .svg or .png. Default = RAxML_tree-rerooted.pdf')
+parser.add_argument('--reroot', required=False, action='store_true', help='If true, the tree will be rerooted at the branch that best balances the subtree lengths (see --reroot-with). Default = False')
+parser.add_argument('--reroot-with', required=False, default='raxml', choices=['raxml', 'balanced'], help='with --reroot, raxml runs raxmlHPC -f I; balanced applies the same rule in-process, without RAxML, but is not yet confirmed to give the same root (see phylo_tree.reroot_balanced). Default = raxml')
+parser.add_argument('--midpoint', required=False, action='store_true', help='If true, the tree will be rooted at the midpoint of its longest leaf to leaf path. Default = False')
+parser.add_argument('--scalable', required=False, action='store_true', help='If true, reference clades and large sample-only clades are collapsed into summary triangles, for trees of thousands of leaves. Default = False')
+parser.add_argument('--collapse-size', required=False, type=int, default=25, help='with --scalable, collapse sample-only clades of more than this many samples; 0 keeps them. Default = 25')
+parser.add_argument('--layout', required=False, default='rectangular', choices=['rectangular', 'circular'], help='tree layout. Default = rectangular')
+parser.add_argument('--hide-support', required=False, action='store_true', help='If true, branch support values are not drawn. Default = False')
+parser.add_argument('--width', required=False, type=int, default=183, help='width of the rendered tree in mm. Default = 183')
+parser.add_argument('--dpi', required=False, type=int, default=300, help='resolution of .png output. Default = 300')
 args=parser.parse_args()
 
 tree_in = ""
@@ -29,24 +39,35 @@ if args.reroot:
 
 refSeqs = set(['A1', 'A2', 'AE', 'AG', 'B1', 'B2', 'C1', 'C2', 'D1', 'D2', 'F1', 'G1', 'G2', 'H', 'J', 'K'])
 
-t = ''
-if reroot == True:
-    print ("Running RAxML to reroot " + tree_in + "\n")
-    raxml_command = 'raxmlHPC -f I -m GTRGAMMA --JC69 -t ' + tree_in + ' -n visual'
-    rooted_tree = sp.run(raxml_command, shell=True, check=True)
-    
-    new_tree = "RAxML_rootedTree.visual"
-
-    print ("Rerooted tree saved as: " + new_tree + "\n")
+with telemetry.get().stage("parse") as span:
+    with open(tree_in) as tree_file:
+        t = parse_newick(tree_file.read())
+    span.count(leaves=len(t))
 
-    nw = re.sub(":(\d+\.\d+)\[(\d+)\]", ":\\1[&&NHX:support=\\2]", open(new_tree).read())
-    t = Tree(nw, quoted_node_names=True, format=1)
-else:
-    t = Tree(tree_in)
+if reroot == True and args.reroot_with == 'raxml':
+    print ("Running RAxML to reroot " + tree_in + "\n")
+    with telemetry.get().stage("reroot"):
+        t = raxml_rooted(tree_in)
+elif reroot == True:
+    print ("Rerooting " + tree_in + " at the branch that best balances the subtree lengths\n")
+    with telemetry.get().stage("reroot"):
+        reroot_balanced(t)
+elif args.midpoint:
+    print ("Rooting " + tree_in + " at its midpoint\n")
+    with telemetry.get().stage("reroot"):
+        reroot_midpoint(t)
+
+if args.scalable:
+    with telemetry.get().stage("collapse") as span:
+        collapsed = collapse_clades(t, refSeqs, args.collapse_size)
+        span.count(clades=collapsed)
+    print ("Collapsed " + str(collapsed) + " clades")
 
 ts = TreeStyle()
-ts.show_branch_support = True
+ts.show_branch_support = not args.hide_support
 ts.show_leaf_name=False
+if args.layout == 'circular':
+    ts.mode = "c"
 
 nstyle = NodeStyle()
 nstyle["size"] = 0
@@ -61,21 +82,44 @@ t.set_style(nstyle)
 print ("Formatting tree...")
 
 
+def triangle(node, colour):
+    # summary of a collapsed clade, taller for more leaves
+    height = min(60.0, 4.0 + 2.0 * node.collapsed_leaves ** 0.5)
+    width = min(60.0, 10.0 + 4.0 * node.collapsed_leaves ** 0.25)
+    box = QGraphicsRectItem(0, 0, width, height)
+    box.setPen(QPen(Qt.NoPen))
+    shape = QGraphicsPolygonItem(QPolygonF([QPointF(0, height / 2), QPointF(width, 0), QPointF(width, height)]), box)
+    shape.setBrush(QBrush(QColor(colour)))
+    shape.setPen(QPen(QColor(colour)))
+    return box
+
+
+# one face object per kind of label, shared by every leaf that shows it. The
+# triangles hold their drawn item, so each collapsed clade needs its own
+ref_face = AttrFace("name", fgcolor="blue", fsize=6)
+sample_face = AttrFace("name", fgcolor="red", fsize=6)
+ref_summary_face = AttrFace("summary", fgcolor="blue", fsize=6)
+sample_summary_face = AttrFace("summary", fgcolor="red", fsize=6)
+
 for n in t.traverse():
-    if n.is_leaf():
-        if n.name in refSeqs:
-            name_face = TextFace(n.name, fgcolor="blue", fsize=6)
-            n.add_face(name_face, column=0, position='branch-right')
-            n.set_style(nstyle)
+    n.set_style(nstyle)
+    if not n.is_leaf():
+        continue
+    if hasattr(n, "collapsed_leaves"):
+        if n.collapsed_refs:
+            n.add_face(DynamicItemFace(triangle, "blue"), column=0, position='branch-right')
+            n.add_face(ref_summary_face, column=1, position='branch-right')
         else:
-            name_face = TextFace(n.name, fgcolor="red", fsize=6)
-            n.add_face(name_face, column=0, position='branch-right')
-            n.set_style(nstyle)
+            n.add_face(DynamicItemFace(triangle, "red"), column=0, position='branch-right')
+            n.add_face(sample_summary_face, column=1, position='branch-right')
+    elif n.name in refSeqs:
+        n.add_face(ref_face, column=0, position='branch-right')
     else:
-         n.set_style(nstyle)
+        n.add_face(sample_face, column=0, position='branch-right')
 
-t.set_style(nstyle)
-tree_out = "RAxML_tree-rerooted.pdf"
-t.render(tree_out, w=183, units="mm", tree_style = ts)
+tree_out = args.output
+with telemetry.get().stage("render") as span:
+    t.render(tree_out, w=args.width, units="mm", dpi=args.dpi, tree_style = ts)
+    span.count(drawn_leaves=len(t))
 
 print ("Tree saved to " + tree_out)
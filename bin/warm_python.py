@@ -0,0 +1,241 @@
+#!/usr/bin/env python3.6
+
+'''
+Warm start of the pipeline's Python stages. A long-running process imports
+the heavy modules (numpy, lxml, python-docx, pandas) and builds the report
+templates once with preload(), which then forks a server process holding
+all of it. spawn() hands each Python stage to that server, which forks a
+child running the script, rather than starting a new interpreter that
+imports everything again. The server is forked before the process starts
+any thread and stays single-threaded, so the stages are never forked from
+the pipeline's stage threads, whose locks (stdout, logging, the telemetry
+file) could be held at the moment of the fork. Each stage still runs in a
+process of its own, with its own arguments, environment, working directory
+and output files; its exit status and resource usage are sent back to the
+caller. Commands that are not Python scripts, and any command if no server
+was started, are run with subprocess.Popen.
+'''
+
+import os
+import sys
+import array
+import runpy
+import pickle
+import signal
+import socket
+import threading
+import traceback
+import importlib
+import subprocess
+import telemetry
+
+
+# modules imported by the report, overview and QC stages; ete3 and Qt (tree
+# rendering) are left out, since a Qt application cannot be forked safely
+PRELOAD = ["numpy", "lxml.etree", "docx", "pandas", "sierra_json", "sierra_ir", "patient_data", "drm_store", "drm_columns",
+           "fasta_qc", "parse_json_write_docx", "parse_json_store_metadata"]
+
+# connection to the fork server, set by preload()
+_server = None
+
+# the stage connection, stdout and stderr of a request
+REQUEST_FDS = 3
+
+
+def preload(modules=PRELOAD, assets=None, renderer="docx"):
+    """
+    Import the stage modules and, given the assets directory, build the
+    report templates, then fork the server that starts every later stage
+    with them. Must be called before the process starts any thread.
+    """
+    global _server
+    if threading.active_count() > 1:
+        raise RuntimeError("preload() must be called before any thread is started")
+    for module in modules:
+        importlib.import_module(module)
+    if assets is not None:
+        import parse_json_write_docx
+        parse_json_write_docx.report_templates(assets, renderer)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    connection, requests = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    if os.fork() == 0:
+        connection.close()
+        _serve(requests)
+    requests.close()
+    _server = connection
+
+
+def is_script(command):
+    return len(command) > 1 and command[0] == sys.executable and command[1].endswith(".py")
+
+
+class ForkedScript(object):
+    """
+    The part of the subprocess.Popen interface used by Telemetry.run, for a
+    script started by the fork server. The script is not a child of this
+    process: wait4() reads its exit status and resource usage from the
+    server instead of waiting for it.
+    """
+
+    def __init__(self, pid, connection):
+        self.pid = pid
+        self.returncode = None
+        self.connection = connection
+        self.result = None
+
+    def kill(self):
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def wait4(self):
+        """
+        :return: (pid, status, rusage) like os.wait4
+        """
+        if self.result is None:
+            message = self.connection.recv(65536)
+            self.connection.close()
+            if message:
+                self.result = pickle.loads(message)
+            else:
+                # the server was stopped, and the stage with it
+                self.result = (signal.SIGKILL, _no_usage())
+        return (self.pid,) + self.result
+
+    def wait(self):
+        if self.returncode is None:
+            pid, status, usage = self.wait4()
+            self.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+        return self.returncode
+
+
+def _no_usage():
+    import resource
+    return resource.struct_rusage((0,) * resource.struct_rusage.n_fields)
+
+
+def _fileno(target, default, opened):
+    if target is None:
+        return default
+    if target == subprocess.DEVNULL:
+        opened.append(os.open(os.devnull, os.O_RDWR))
+        return opened[-1]
+    return target if isinstance(target, int) else target.fileno()
+
+
+def _run_script(command, cwd, env, stdout, stderr):
+    """
+    Body of the forked child: set up the process like subprocess.Popen would
+    and run the script as __main__. Never returns.
+    """
+    code = 1
+    try:
+        # signal handling of a new interpreter, whatever the forking process set
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(env)
+        os.dup2(stdout, 1)
+        os.dup2(stderr, 2)
+        sys.stdout = open(1, "w", closefd=False)
+        sys.stderr = open(2, "w", buffering=1, closefd=False)
+        sys.argv = list(command[1:])
+        sys.path[0] = os.path.dirname(os.path.abspath(command[1]))
+        # the events of the stage go to the telemetry file named in its environment
+        telemetry._default = None
+        runpy.run_path(command[1], run_name="__main__")
+        code = 0
+    except SystemExit as exc:
+        if exc.code is None or isinstance(exc.code, int):
+            code = exc.code or 0
+        else:
+            print(exc.code, file=sys.stderr)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def _wait_script(request, status, stdout, stderr):
+    """
+    Body of the process the server forks for each request: fork the script,
+    send its pid, then its exit status and resource usage, on the stage
+    connection. Never returns.
+    """
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        command, cwd, env = request
+        try:
+            pid = os.fork()
+        except OSError as exc:
+            os.write(status, pickle.dumps(exc))
+            return
+        if pid == 0:
+            os.close(status)
+            _run_script(command, cwd, env, stdout, stderr)
+        os.write(status, pickle.dumps(pid))
+        os.write(status, pickle.dumps(os.wait4(pid, 0)[1:]))
+    finally:
+        os._exit(0)
+
+
+def _serve(requests):
+    """
+    Body of the fork server: start a script for every request until the
+    process that forked it closes the connection. Never returns.
+    """
+    try:
+        # the waiting processes are reaped by the kernel
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        size = socket.CMSG_SPACE(REQUEST_FDS * array.array("i").itemsize)
+        while True:
+            message, ancdata, flags, address = requests.recvmsg(1 << 20, size)
+            if not message:
+                break
+            fds = array.array("i")
+            for level, kind, data in ancdata:
+                fds.frombytes(data[:len(data) - len(data) % fds.itemsize])
+            try:
+                pid = os.fork()
+            except OSError:
+                # the caller reads the end of the stage connection
+                pid = None
+            if pid == 0:
+                requests.close()
+                _wait_script(pickle.loads(message), *fds)
+            for fd in fds:
+                os.close(fd)
+    finally:
+        os._exit(0)
+
+
+def spawn(command, cwd=None, env=None, stdout=None, stderr=None, **kwargs):
+    """
+    subprocess.Popen for the pipeline stages: [sys.executable, script.py, ...]
+    is run by the fork server, anything else by subprocess.Popen.
+    """
+    if _server is None or not is_script(command) or kwargs or subprocess.PIPE in (stdout, stderr):
+        return subprocess.Popen(command, cwd=cwd, env=env, stdout=stdout, stderr=stderr, **kwargs)
+    connection, remote = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    opened = []
+    try:
+        out = _fileno(stdout, 1, opened)
+        err = out if stderr == subprocess.STDOUT else _fileno(stderr, 2, opened)
+        request = pickle.dumps((list(command), cwd or os.getcwd(), dict(os.environ if env is None else env)))
+        _server.sendmsg([request], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", [remote.fileno(), out, err]))])
+    finally:
+        remote.close()
+        for fd in opened:
+            os.close(fd)
+    reply = pickle.loads(connection.recv(65536) or pickle.dumps(OSError("the fork server has stopped")))
+    if isinstance(reply, Exception):
+        connection.close()
+        raise reply
+    return ForkedScript(reply, connection)
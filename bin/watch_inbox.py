@@ -0,0 +1,432 @@
+#!/usr/bin/env python3.6
+
+'''
+Service mode of the pipeline: watches an inbox directory for sequencing runs
+and processes each one with run_pipeline.py, without anyone launching it.
+
+A run is a fasta file and a patient table with the same name, e.g.
+run42.fas + run42.tsv (.fas/.fasta/.fa and .tsv/.txt). Once both have been
+left unchanged for --settle seconds, the pair is moved out of the inbox into
+the job's own directory and queued in a SQLite database, so jobs survive a
+restart of the service. Up to --concurrency jobs run at once, in worker
+processes that keep python-docx, pandas and the report templates loaded
+between jobs and start the Python stages from a fork server holding them
+(see warm_python.py). A job whose worker dies, e.g. killed when out of
+memory, is marked failed.
+Each job writes to results_<job> with the usual checkpoints, so a job
+interrupted by a restart is queued again and resumes after its last
+completed stage. The queue depth and the state of every job are written to
+a JSON status file after each change.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import sqlite3
+import argparse
+import datetime
+import contextlib
+import multiprocessing
+import run_pipeline
+
+
+FASTA_EXTENSIONS = (".fas", ".fasta", ".fa")
+TABLE_EXTENSIONS = (".tsv", ".txt")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE,
+    fasta TEXT NOT NULL,
+    data TEXT NOT NULL,
+    run_dir TEXT NOT NULL,
+    options TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    queued TEXT NOT NULL,
+    started TEXT,
+    finished TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+"""
+
+COLUMNS = ["id", "name", "fasta", "data", "run_dir", "options", "status", "attempts", "queued", "started",
+           "finished", "error"]
+
+
+def timestamp():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+class JobQueue(object):
+    """
+    Durable queue of pipeline jobs. A job is queued, running, done or failed;
+    every change is committed before the call returns.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _job(self, row):
+        job = dict(zip(COLUMNS, row))
+        job["options"] = json.loads(job["options"])
+        return job
+
+    def add(self, name, fasta, data, run_dir, options):
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO jobs (name, fasta, data, run_dir, options, status, queued) VALUES (?, ?, ?, ?, ?, 'queued', ?)",
+                (name, fasta, data, run_dir, json.dumps(options), timestamp()))
+        return cursor.lastrowid
+
+    def names(self):
+        return set(row[0] for row in self.conn.execute("SELECT name FROM jobs"))
+
+    def recover(self):
+        """
+        Queue again the jobs left running by a service that stopped.
+
+        :return: number of jobs requeued
+        """
+        with self.conn:
+            return self.conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'").rowcount
+
+    def retry_failed(self, options):
+        """
+        Queue the failed jobs again with new options. Their completed stages
+        whose commands are unchanged by the new options are not rerun.
+        """
+        with self.conn:
+            return self.conn.execute("UPDATE jobs SET status = 'queued', error = NULL, options = ? WHERE status = 'failed'",
+                                     (json.dumps(options),)).rowcount
+
+    def next(self):
+        """
+        Mark the oldest queued job as running.
+
+        :return: the job as a dict, or None if nothing is queued
+        """
+        with self.conn:
+            row = self.conn.execute("SELECT " + ", ".join(COLUMNS) + " FROM jobs WHERE status = 'queued' "
+                                    "ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, started = ?, "
+                              "finished = NULL, error = NULL WHERE id = ?", (timestamp(), row[0]))
+        job = self._job(row)
+        job["attempts"] += 1
+        return job
+
+    def finish(self, job_id, error=None):
+        with self.conn:
+            self.conn.execute("UPDATE jobs SET status = ?, finished = ?, error = ? WHERE id = ?",
+                              ("failed" if error else "done", timestamp(), error, job_id))
+
+    def depth(self):
+        return self.conn.execute("SELECT count(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+    def jobs(self, recent=50):
+        """
+        Every queued, running and failed job and the last `recent` done jobs.
+        """
+        return [self._job(row) for row in self.conn.execute(
+            "SELECT " + ", ".join(COLUMNS) + " FROM jobs WHERE status != 'done' OR id IN "
+            "(SELECT id FROM jobs WHERE status = 'done' ORDER BY id DESC LIMIT ?) ORDER BY id", (recent,))]
+
+
+def find_pairs(inbox, settle):
+    """
+    Runs in the inbox whose fasta and patient table have both been left
+    unchanged for `settle` seconds. Hidden files, e.g. partial uploads, are
+    ignored.
+
+    :return: list of (name, fasta path, table path)
+    """
+    fastas, tables = {}, {}
+    now = time.time()
+    for entry in os.listdir(inbox):
+        path = os.path.join(inbox, entry)
+        if entry.startswith(".") or not os.path.isfile(path):
+            continue
+        name, extension = os.path.splitext(entry)
+        if now - os.path.getmtime(path) < settle:
+            continue
+        if extension.lower() in FASTA_EXTENSIONS:
+            fastas[name] = path
+        elif extension.lower() in TABLE_EXTENSIONS:
+            tables[name] = path
+    return [(name, fastas[name], tables[name]) for name in sorted(fastas) if name in tables]
+
+
+def job_name(name, taken):
+    """
+    Directory name of a new job: the run name, made unique if a run of the
+    same name was queued before.
+    """
+    if name not in taken:
+        return name
+    return name + "_" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+
+
+class Service(object):
+    """
+    :param options: run_pipeline.build_stages options given to every new job
+    """
+
+    def __init__(self, inbox, results, queue_path, status_path, concurrency, cpus, options, settle=30):
+        self.inbox = inbox
+        self.results = results
+        self.spool = os.path.join(results, "inbox_jobs")
+        self.queue = JobQueue(queue_path)
+        self.status_path = status_path
+        self.concurrency = concurrency
+        self.cpus = cpus
+        self.options = options
+        self.settle = settle
+        self.running = {}
+        os.makedirs(self.spool, exist_ok=True)
+
+    def ingest(self):
+        """
+        Move every complete run out of the inbox and queue it. A job directory
+        left without a queue entry by a stop between the two is queued too.
+
+        :return: number of jobs queued
+        """
+        taken = self.queue.names()
+        added = 0
+        for name, fasta, table in find_pairs(self.inbox, self.settle):
+            job = job_name(name, taken | set(os.listdir(self.spool)))
+            # the pair becomes a job directory in one rename, so a stop while
+            # the files are moved never leaves a job with only one of them
+            tmp = os.path.join(self.spool, "." + job)
+            os.makedirs(tmp)
+            shutil.move(table, os.path.join(tmp, os.path.basename(table)))
+            shutil.move(fasta, os.path.join(tmp, os.path.basename(fasta)))
+            os.rename(tmp, os.path.join(self.spool, job))
+        for job in sorted(set(entry for entry in os.listdir(self.spool) if not entry.startswith(".")) - taken):
+            job_dir = os.path.join(self.spool, job)
+            pairs = find_pairs(job_dir, 0)
+            if not pairs:
+                continue
+            name, fasta, table = pairs[0]
+            self.queue.add(job, fasta, table, os.path.join(self.results, "results_" + job), self.options)
+            print (timestamp() + " queued " + job)
+            added += 1
+        return added
+
+    def restore(self):
+        """
+        Put back in the inbox the files of a run whose move to the spool was
+        cut short by a stop, to be ingested again.
+        """
+        for entry in os.listdir(self.spool):
+            tmp = os.path.join(self.spool, entry)
+            if not entry.startswith(".") or not os.path.isdir(tmp):
+                continue
+            for name in os.listdir(tmp):
+                if os.path.exists(os.path.join(self.inbox, name)):
+                    # the copy was not finished: the original is still in the inbox
+                    os.remove(os.path.join(tmp, name))
+                else:
+                    shutil.move(os.path.join(tmp, name), os.path.join(self.inbox, name))
+            os.rmdir(tmp)
+
+    def dispatch(self, pool):
+        while len(self.running) < self.concurrency:
+            job = self.queue.next()
+            if job is None:
+                break
+            print (timestamp() + " started " + job["name"] + " (attempt " + str(job["attempts"]) + ")")
+            self.running[job["id"]] = (job, pool.apply_async(_run_job, (job, self.cpus)))
+
+    def collect(self):
+        for job_id, (job, result) in list(self.running.items()):
+            if result.ready():
+                try:
+                    error = result.get()
+                except Exception as exc:
+                    error = "{0}: {1}".format(type(exc).__name__, exc)
+            else:
+                # the pool replaces a worker that dies, but its job never returns
+                pid = worker_pid(job)
+                if pid is None or is_alive(pid):
+                    continue
+                error = "worker process " + str(pid) + " died"
+                # with the stages and fork server in its process group
+                with contextlib.suppress(ProcessLookupError, PermissionError):
+                    os.killpg(pid, signal.SIGTERM)
+            self.queue.finish(job_id, error)
+            del self.running[job_id]
+            print (timestamp() + " " + job["name"] + (" failed: " + error if error else " done"))
+
+    def write_status(self):
+        jobs = []
+        for job in self.queue.jobs():
+            state = run_pipeline.load_state(os.path.join(job["run_dir"], run_pipeline.STATE_FILE))
+            jobs.append({
+                "id": job["id"], "name": job["name"], "status": job["status"], "attempts": job["attempts"],
+                "queued": job["queued"], "started": job["started"], "finished": job["finished"],
+                "error": job["error"], "run_dir": job["run_dir"],
+                # stages with a checkpoint, i.e. completed and not rerun if the job restarts
+                "stages_done": sorted(state["stages"]),
+            })
+        status = {"updated": timestamp(), "pid": os.getpid(), "inbox": self.inbox, "concurrency": self.concurrency,
+                  "queue_depth": self.queue.depth(), "running": len(self.running), "jobs": jobs}
+        tmp = self.status_path + ".tmp"
+        with open(tmp, "w") as out:
+            json.dump(status, out, indent=2)
+        os.replace(tmp, self.status_path)
+
+    def serve(self, poll=10, once=False):
+        """
+        Ingest, run and report until stopped, or with once=True until the
+        inbox and the queue are empty.
+        """
+        self.restore()
+        requeued = self.queue.recover()
+        if requeued:
+            print (timestamp() + " " + str(requeued) + " interrupted job(s) queued again")
+        pool = multiprocessing.Pool(self.concurrency, initializer=_init_worker,
+                                    initargs=(self.options.get("renderer", "docx"),))
+        try:
+            while True:
+                self.ingest()
+                self.collect()
+                self.dispatch(pool)
+                self.write_status()
+                if once and not self.running and not self.queue.depth() and not find_pairs(self.inbox, 0):
+                    break
+                time.sleep(min(poll, 1) if self.running else poll)
+        finally:
+            # the pool is stopped first: an idle worker killed from outside
+            # would leave the pool's task queue locked
+            workers = [worker.pid for worker in multiprocessing.active_children()]
+            pool.terminate()
+            pool.join()
+            # then the stages of the jobs that were running, in the process
+            # group each worker led
+            for pid in workers:
+                with contextlib.suppress(ProcessLookupError, PermissionError):
+                    os.killpg(pid, signal.SIGTERM)
+            self.queue.close()
+
+
+def worker_file(job):
+    return os.path.join(os.path.dirname(job["fasta"]), "worker.json")
+
+
+def worker_pid(job):
+    """
+    :return: pid of the worker running this attempt of the job, or None if
+             it has not started yet
+    """
+    try:
+        with open(worker_file(job)) as handle:
+            worker = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    return worker["pid"] if worker["attempt"] == job["attempts"] else None
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _init_worker(renderer):
+    # the worker and the stages it starts form one process group, stopped together
+    os.setpgid(0, 0)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    import warm_python
+    warm_python.preload(assets=run_pipeline.repo_dir, renderer=renderer)
+
+
+def _run_job(job, cpus):
+    """
+    Run (or resume) one job's pipeline in a worker.
+
+    :return: None on success, otherwise the error
+    """
+    import warm_python
+    with open(worker_file(job), "w") as out:
+        json.dump({"attempt": job["attempts"], "pid": os.getpid()}, out)
+    run_dir = job["run_dir"]
+    now = run_pipeline.open_run_dir(run_dir)
+    os.makedirs(os.path.join(run_dir, "logs"), exist_ok=True)
+    options = job["options"]
+    with open(os.path.join(run_dir, "logs", "service.log"), "a") as log, contextlib.redirect_stdout(log):
+        print ("\n" + timestamp() + " attempt " + str(job["attempts"]))
+        stages = run_pipeline.build_stages(job["fasta"], job["data"], options["reference"], run_dir, now,
+                                           cpus=cpus, **dict((key, value) for key, value in options.items()
+                                                             if key != "reference"))
+        returncode = run_pipeline.Pipeline(run_dir, stages, spawn=warm_python.spawn).run(cpus=cpus)
+    if returncode != 0:
+        return "pipeline exited with code " + str(returncode) + ", see " + os.path.join(run_dir, "logs")
+    return None
+
+
+def _stop(signum, frame):
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--inbox', required=True, help='directory to watch for <run>.fas + <run>.tsv pairs')
+    parser.add_argument('--results', required=False, default='.', help='directory the results_<run> directories are written to. Default = current directory')
+    parser.add_argument('--queue', required=False, help='SQLite job queue. Default = <results>/inbox_queue.sqlite')
+    parser.add_argument('--status', required=False, help='JSON file with the queue depth and the state of each job. Default = <results>/inbox_status.json')
+    parser.add_argument('--concurrency', required=False, type=int, default=1, help='number of jobs run at once. Default = 1')
+    parser.add_argument('--cpus', required=False, type=int, help='cores given to each job. Default = all cores shared between the concurrent jobs')
+    parser.add_argument('--poll', required=False, type=float, default=10, help='seconds between looks at the inbox. Default = 10')
+    parser.add_argument('--settle', required=False, type=float, default=30, help='seconds a file must be left unchanged before it is taken from the inbox. Default = 30')
+    parser.add_argument('--once', required=False, action='store_true', help='exit once the inbox and the queue are empty')
+    parser.add_argument('--retry-failed', required=False, action='store_true', help='queue the failed jobs again on start, with the options given now')
+    parser.add_argument('--reference', required=False, default=os.path.join(run_pipeline.repo_dir, 'HIV_aligned_references.fasta'), help='aligned HIV-1 reference sequences. Default = HIV_aligned_references.fasta in the pipeline directory')
+    parser.add_argument('--sierra-url', required=False, help='Sierra GraphQL endpoint passed to perform_query.py')
+    parser.add_argument('--db', required=False, help='SQLite database of all runs that every job is appended to')
+    parser.add_argument('--tree-mode', required=False, default='full', choices=['full', 'split', 'placement', 'subtype'], help='see run_pipeline.py. Default = full')
+    parser.add_argument('--aligner', required=False, default='mafft', choices=['mafft', 'chunked'], help='see run_pipeline.py. Default = mafft')
+    parser.add_argument('--no-preview', required=False, action='store_true', help='do not draw the neighbour-joining preview tree')
+    parser.add_argument('--sketch-index', required=False, help='SQLite k-mer sketch index of all runs (see run_pipeline.py)')
+    parser.add_argument('--qc-exclude', required=False, action='store_true', help='leave samples that fail QC out of the query, reports and tree')
+    parser.add_argument('--renderer', required=False, default='fast', choices=['docx', 'fast'], help='report renderer, see run_pipeline.py. Default = fast')
+    args = parser.parse_args()
+
+    results = os.path.abspath(args.results)
+    os.makedirs(results, exist_ok=True)
+    cpus = args.cpus or max(1, (os.cpu_count() or 1) // args.concurrency)
+    # fixed when a job is queued, so a resumed job reruns none of its stages
+    options = {"reference": os.path.abspath(args.reference), "sierra_url": args.sierra_url,
+               "db": os.path.abspath(args.db) if args.db else None, "tree_mode": args.tree_mode,
+               "aligner": args.aligner, "preview": not args.no_preview,
+               "sketch_index": os.path.abspath(args.sketch_index) if args.sketch_index else None,
+               "qc_exclude": args.qc_exclude, "renderer": args.renderer, "single_pass": True}
+
+    service = Service(os.path.abspath(args.inbox), results,
+                      os.path.abspath(args.queue or os.path.join(results, "inbox_queue.sqlite")),
+                      os.path.abspath(args.status or os.path.join(results, "inbox_status.json")),
+                      args.concurrency, cpus, options, args.settle)
+    if args.retry_failed:
+        print (str(service.queue.retry_failed(options)) + " failed job(s) queued again")
+    signal.signal(signal.SIGTERM, _stop)
+    print ("Watching " + service.inbox + " with " + str(args.concurrency) + " job(s) at a time, status in " +
+           service.status_path)
+    try:
+        service.serve(args.poll, args.once)
+    except KeyboardInterrupt:
+        pass
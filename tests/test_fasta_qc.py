@@ -0,0 +1,61 @@
+#!/usr/bin/env python3.6
+
+'''
+Tests of the fasta QC of fasta_qc.py on small files written for each test.
+Run from the repository directory with `python -m unittest discover tests`.
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+from fasta_qc import run_qc
+
+
+class RunQcTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def qc(self, text, **kwargs):
+        fasta_in = os.path.join(self.work, "in.fas")
+        with open(fasta_in, "w", encoding="utf-8") as fasta:
+            fasta.write(text)
+        fasta_out = os.path.join(self.work, "out.fas")
+        table_out = os.path.join(self.work, "qc.tsv")
+        totals = run_qc(fasta_in, fasta_out, table_out, min_length=10, **kwargs)
+        with open(table_out) as table:
+            rows = [line.rstrip("\n").split("\t") for line in table][1:]
+        with open(fasta_out) as out:
+            written = out.read()
+        return totals, rows, written
+
+    def test_pass_and_normalise(self):
+        totals, rows, written = self.qc(">s1\nacg-tu\nACGTAC\n")
+        self.assertEqual(totals, {"pass": 1, "warn": 0, "fail": 0, "written": 1})
+        self.assertEqual(rows[0][1], "11")
+        self.assertEqual(written, ">s1\nACGTTACGTAC\n")
+
+    def test_characters_outside_latin1_are_invalid(self):
+        # an en-dash pasted from a document in place of a gap
+        totals, rows, written = self.qc(">s1\nACGTA–CGTAC\n>s2\nACGTACGTACGT\n", exclude=True)
+        self.assertEqual(totals, {"pass": 1, "warn": 0, "fail": 1, "written": 1})
+        self.assertEqual(rows[0][4], "1")
+        self.assertEqual(rows[0][7], "fail")
+        self.assertIn("1 invalid characters", rows[0][8])
+        self.assertEqual(written, ">s2\nACGTACGTACGT\n")
+
+    def test_invalid_latin1_character_becomes_n(self):
+        totals, rows, written = self.qc(">s1\nACGTAéCGTAC\n")
+        self.assertEqual(rows[0][7], "fail")
+        self.assertEqual(written, ">s1\nACGTANCGTAC\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3.6
+
+'''
+Tests of the HIVdb result cache, through the Sierra client and perform_query.py
+against the local stand-in for the GraphQL webservice of test_hivdb_client.py.
+Run from the repository directory with `python -m unittest discover tests`.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import subprocess
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+BIN = os.path.join(TESTS, '..', 'bin')
+sys.path.insert(0, TESTS)
+sys.path.insert(0, BIN)
+from hivdb_client import SierraClient, QueryError
+from hivdb_cache import ResultCache, analyse_cached
+from test_hivdb_client import _Server, _Handler, analysis
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = _Server(("127.0.0.1", 0), _Handler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.answer = self.ok
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:" + str(self.server.server_address[1]) + "/graphql"
+        self.cache_dir = tempfile.mkdtemp()
+        self.records = [("sample" + str(n), "ACGT" * (n + 1)) for n in range(23)]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_dir)
+
+    def ok(self, number, body):
+        if "variables" not in body:
+            return 200, json.dumps({"data": {"currentVersion": {"text": "9.0", "publishDate": "2021-04-06"}}}).encode("utf-8")
+        return 200, json.dumps(analysis(body["variables"]["sequences"])).encode("utf-8")
+
+    def client(self):
+        return SierraClient("inputSequence { header }", url=self.url, chunk_size=5, concurrency=3,
+                            retries=1, backoff=0.01, timeout=5)
+
+    def cache(self):
+        return ResultCache(self.cache_dir, "inputSequence { header }", "9.0")
+
+    def sent(self):
+        return [s["header"] for body in self.server.requests for s in body["variables"]["sequences"]]
+
+    def entries(self):
+        return sum(len(files) for root, dirs, files in os.walk(self.cache_dir))
+
+    def test_duplicates_sent_once(self):
+        records = [("a", "ACGT"), ("b", "acg t"), ("c", "GGGGG"), ("d", "ACGT\n"), ("e", "ACGT")]
+        results = analyse_cached(self.client(), records)
+        self.assertEqual(sorted(self.sent()), ["a", "c"])
+        self.assertEqual([r["inputSequence"]["header"] for r in results], ["a", "b", "c", "d", "e"])
+        self.assertEqual([r["length"] for r in results], [4, 4, 5, 4, 4])
+
+    def test_hits_and_misses_merged_in_input_order(self):
+        cache = self.cache()
+        for header, sequence in self.records[::3]:
+            cache.put(sequence, {"inputSequence": {"header": "old"}, "cached": True})
+        results = analyse_cached(self.client(), self.records, cache)
+        self.assertEqual([r["inputSequence"]["header"] for r in results], [h for h, s in self.records])
+        self.assertEqual([n for n, r in enumerate(results) if r.get("cached")], list(range(0, 23, 3)))
+        self.assertEqual(sorted(self.sent()), sorted(h for h, s in self.records if int(h[6:]) % 3))
+        self.assertEqual((cache.hits, cache.misses), (8, 15))
+
+        # everything is cached now
+        del self.server.requests[:]
+        again = analyse_cached(self.client(), self.records, self.cache())
+        self.assertEqual(self.server.requests, [])
+        self.assertEqual([r["inputSequence"]["header"] for r in again], [h for h, s in self.records])
+
+    def test_answered_chunks_cached_when_one_fails(self):
+        # the second chunk (sample5 to sample9) is rejected
+        failing = lambda number, body: ((400, b"bad sequence")
+                                        if any(s["header"] == "sample7" for s in body["variables"]["sequences"])
+                                        else self.ok(number, body))
+        self.server.answer = failing
+        with self.assertRaisesRegex(QueryError, "HTTP 400: bad sequence"):
+            analyse_cached(self.client(), self.records, self.cache())
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertEqual(self.entries(), 18)
+
+        self.server.answer = self.ok
+        del self.server.requests[:]
+        results = analyse_cached(self.client(), self.records, self.cache())
+        self.assertEqual(self.sent(), ["sample" + str(n) for n in range(5, 10)])
+        self.assertEqual([r["inputSequence"]["header"] for r in results], [h for h, s in self.records])
+
+    def test_evict_by_age(self):
+        cache = self.cache()
+        for n, (header, sequence) in enumerate(self.records[:4]):
+            cache.put(sequence, {"n": n})
+            path = cache._path(cache.key(sequence))
+            os.utime(path, (time.time() - n * 86400 - 60, time.time() - n * 86400 - 60))
+        self.assertEqual(cache.evict(max_age=1.5 * 86400), 2)
+        self.assertEqual([cache.get(s) for h, s in self.records[:4]], [{"n": 0}, {"n": 1}, None, None])
+
+    def test_evict_least_recently_used_by_size(self):
+        cache = self.cache()
+        for n, (header, sequence) in enumerate(self.records[:4]):
+            cache.put(sequence, {"n": n})
+            path = cache._path(cache.key(sequence))
+            os.utime(path, (time.time() - 1000 + n, time.time() - 1000 + n))
+        size = os.path.getsize(cache._path(cache.key(self.records[0][1])))
+        # reading the oldest entry makes it the most recently used
+        cache.get(self.records[0][1])
+        self.assertEqual(cache.evict(max_bytes=2 * size), 2)
+        self.assertEqual([cache.get(s) for h, s in self.records[:4]], [{"n": 0}, None, None, {"n": 3}])
+        self.assertEqual(cache.evict(max_bytes=2 * size), 0)
+
+    def test_no_cache(self):
+        # an earlier run fills the cache
+        self.cache().put(self.records[0][1], {"inputSequence": {"header": "old"}, "cached": True})
+        work = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work)
+        with open(os.path.join(work, "samples.fas"), "w") as fasta:
+            for header, sequence in self.records:
+                fasta.write(">" + header + "\n" + sequence + "\n")
+        subprocess.run([sys.executable, os.path.join(BIN, "perform_query.py"), "--fasta", "samples.fas",
+                        "--json", "samples.json", "--url", self.url, "--cache-dir", self.cache_dir,
+                        "--chunk-size", "5", "--no-cache"],
+                       cwd=work, check=True, stdout=subprocess.DEVNULL)
+        with open(os.path.join(work, "samples.json")) as out:
+            results = json.load(out)
+        self.assertFalse(any(r.get("cached") for r in results))
+        self.assertEqual(sorted(self.sent()), sorted(h for h, s in self.records))
+        # no version query and nothing added to the cache
+        self.assertTrue(all("variables" in body for body in self.server.requests))
+        self.assertEqual(self.entries(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
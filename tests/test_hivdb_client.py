@@ -0,0 +1,163 @@
+#!/usr/bin/env python3.6
+
+'''
+Tests of the concurrent Sierra client against a local stand-in for the
+GraphQL webservice, which answers with canned responses. Run from the
+repository directory with `python -m unittest discover tests`.
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import threading
+import unittest
+from socketserver import ThreadingMixIn
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+from hivdb_client import SierraClient, QueryError
+
+
+def analysis(sequences):
+    """
+    Canned sequenceAnalysis answer: one result per sequence, naming it.
+    """
+    return {"data": {"viewer": {"sequenceAnalysis": [
+        {"inputSequence": {"header": s["header"]}, "length": len(s["sequence"])} for s in sequences]}}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8"))
+        with self.server.lock:
+            self.server.requests.append(body)
+            number = len(self.server.requests)
+        answer = self.server.answer(number, body)
+        if answer is None:
+            # drop the connection without a response
+            self.close_connection = True
+            return
+        status, payload = answer
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # the client closes the connections of the chunks it stopped
+        if not issubclass(sys.exc_info()[0], ConnectionError):
+            HTTPServer.handle_error(self, request, client_address)
+
+
+class SierraClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = _Server(("127.0.0.1", 0), _Handler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.answer = self.ok
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:" + str(self.server.server_address[1]) + "/graphql"
+        self.records = [("sample" + str(n), "ACGT" * (n + 1)) for n in range(23)]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def client(self, **kwargs):
+        options = dict(url=self.url, chunk_size=5, concurrency=3, retries=2, backoff=0.01, timeout=5)
+        options.update(kwargs)
+        return SierraClient("inputSequence { header }", **options)
+
+    def ok(self, number, body):
+        if "variables" not in body:
+            return 200, json.dumps({"data": {"currentVersion": {"text": "9.0", "publishDate": "2021-04-06"}}}).encode("utf-8")
+        time.sleep(random.random() * 0.05)
+        return 200, json.dumps(analysis(body["variables"]["sequences"])).encode("utf-8")
+
+    def test_results_in_input_order(self):
+        results = self.client().analyse(self.records)
+        self.assertEqual([r["inputSequence"]["header"] for r in results], [h for h, s in self.records])
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertEqual(sorted(len(b["variables"]["sequences"]) for b in self.server.requests), [3, 5, 5, 5, 5])
+
+    def test_no_records(self):
+        self.assertEqual(self.client().analyse([]), [])
+        self.assertEqual(self.server.requests, [])
+
+    def test_retries_server_errors(self):
+        self.server.answer = lambda number, body: (503, b"busy") if number <= 2 else self.ok(number, body)
+        results = self.client(chunk_size=100).analyse(self.records)
+        self.assertEqual(len(results), len(self.records))
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_retries_dropped_connection(self):
+        self.server.answer = lambda number, body: None if number == 1 else self.ok(number, body)
+        results = self.client(chunk_size=100).analyse(self.records)
+        self.assertEqual(len(results), len(self.records))
+
+    def test_gives_up_after_retries(self):
+        self.server.answer = lambda number, body: (502, b"bad gateway")
+        with self.assertRaisesRegex(QueryError, "failed after 3 attempts: HTTP 502"):
+            self.client(chunk_size=100).analyse(self.records)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_client_error_not_retried(self):
+        self.server.answer = lambda number, body: (400, b"bad query")
+        with self.assertRaisesRegex(QueryError, "HTTP 400: bad query"):
+            self.client(chunk_size=100).analyse(self.records)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_truncated_json(self):
+        self.server.answer = lambda number, body: (200, self.ok(number, body)[1][:-20])
+        with self.assertRaisesRegex(QueryError, "invalid json"):
+            self.client().analyse(self.records)
+
+    def test_not_json(self):
+        self.server.answer = lambda number, body: (200, b"<html>Service Unavailable</html>")
+        with self.assertRaisesRegex(QueryError, "invalid json"):
+            self.client().analyse(self.records)
+
+    def test_missing_analysis(self):
+        for payload in [{"data": {"viewer": {}}}, {"data": None}, {"data": {"viewer": {"sequenceAnalysis": None}}}, []]:
+            self.server.answer = lambda number, body: (200, json.dumps(payload).encode("utf-8"))
+            with self.assertRaisesRegex(QueryError, "no data.viewer.sequenceAnalysis"):
+                self.client().analyse(self.records)
+
+    def test_graphql_errors(self):
+        self.server.answer = lambda number, body: (200, b'{"errors": [{"message": "unknown field"}], "data": null}')
+        with self.assertRaisesRegex(QueryError, "unknown field"):
+            self.client().analyse(self.records)
+
+    def test_result_count_mismatch(self):
+        self.server.answer = lambda number, body: (200, json.dumps(analysis(body["variables"]["sequences"][1:])).encode("utf-8"))
+        with self.assertRaisesRegex(QueryError, "sent 5 sequences but received 4 results"):
+            self.client().analyse(self.records)
+
+    def test_current_version(self):
+        self.assertEqual(self.client().current_version(), "9.0 (2021-04-06)")
+        self.server.answer = lambda number, body: (200, b'{"data": {}}')
+        with self.assertRaisesRegex(QueryError, "version query"):
+            self.client().current_version()
+
+    def test_unreachable(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with self.assertRaisesRegex(QueryError, "failed after 3 attempts"):
+            self.client(chunk_size=100).analyse(self.records)
+
+
+if __name__ == "__main__":
+    unittest.main()
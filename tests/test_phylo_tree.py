@@ -0,0 +1,128 @@
+#!/usr/bin/env python3.6
+
+'''
+Tests of the in-process rerooting of phylo_tree.py. The side length, tie and
+root placement rules of reroot_balanced are checked on small trees worked out
+by hand. Where a real raxmlHPC is installed, its -f I root is compared with
+reroot_balanced on random trees; otherwise that comparison is skipped.
+Run from the repository directory with `python -m unittest discover tests`.
+'''
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+from phylo_tree import parse_newick, raxml_rooted, reroot_balanced
+
+
+def root_split(tree):
+    """
+    The bipartition of the leaves made by the root.
+    """
+    return frozenset(frozenset(child.get_leaf_names()) for child in tree.children)
+
+
+def split(*sides):
+    return frozenset(frozenset(side) for side in sides)
+
+
+def raxml_installed():
+    if shutil.which("raxmlHPC") is None:
+        return False
+    try:
+        output = subprocess.run(["raxmlHPC", "-v"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=30).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return b"RAxML version" in output
+
+
+def random_tree(n, rng):
+    """
+    Unrooted RAxML style newick with n leaves and "[support]" branch labels.
+    """
+    clades = ["S" + str(i) + ":" + "{0:.6f}".format(rng.random() / 10) for i in range(n)]
+    while len(clades) > 3:
+        a = clades.pop(rng.randrange(len(clades)))
+        b = clades.pop(rng.randrange(len(clades)))
+        clades.append("(" + a + "," + b + "):" + "{0:.6f}".format(rng.random() / 10) + "[" + str(rng.randint(0, 100)) + "]")
+    return "(" + ",".join(clades) + ");"
+
+
+class RerootBalancedTest(unittest.TestCase):
+
+    def test_side_length_leaves_out_the_branch(self):
+        # branches A 1, B 1, (C,D) 2, C 1, D 5: total 10. Above (C,D) the
+        # sides are 6 and 2 (difference 4), above D 0 and 5 (difference 5)
+        tree = parse_newick("(A:1,B:1,(C:1,D:5):2);")
+        self.assertEqual(reroot_balanced(tree), (6.0, 2.0))
+        self.assertEqual(root_split(tree), split("CD", "AB"))
+
+    def test_root_at_the_end_next_to_the_longer_side(self):
+        # the sides 6 and 2 cannot be balanced on a branch of length 2
+        tree = parse_newick("(A:1,B:1,(C:1,D:5):2);")
+        reroot_balanced(tree)
+        lengths = dict((frozenset(child.get_leaf_names()), child.dist) for child in tree.children)
+        self.assertEqual(lengths, {frozenset("CD"): 0.0, frozenset("AB"): 2.0})
+
+    def test_root_where_the_sides_balance(self):
+        # sides 2 and 2 either side of a branch of length 4: rooted halfway
+        tree = parse_newick("(A:1,B:1,(C:1,D:1):4);")
+        self.assertEqual(reroot_balanced(tree), (2.0, 2.0))
+        lengths = dict((frozenset(child.get_leaf_names()), child.dist) for child in tree.children)
+        self.assertEqual(lengths, {frozenset("CD"): 2.0, frozenset("AB"): 2.0})
+
+    def test_tie_goes_to_first_branch_in_preorder(self):
+        tree = parse_newick("(A:1,B:1,C:1);")
+        reroot_balanced(tree)
+        self.assertEqual(root_split(tree), split("A", "BC"))
+        tree = parse_newick("(C:1,B:1,A:1);")
+        reroot_balanced(tree)
+        self.assertEqual(root_split(tree), split("C", "AB"))
+
+    def test_rooted_input_is_unrooted_first(self):
+        tree = parse_newick("((A:1,B:1):0.5,(C:1,D:5):1.5);")
+        self.assertEqual(reroot_balanced(tree), (6.0, 2.0))
+        self.assertEqual(root_split(tree), split("CD", "AB"))
+
+    def test_keeps_support_and_total_length(self):
+        tree = parse_newick("(A:1,B:1,(C:1,D:1):4[87]);")
+        reroot_balanced(tree)
+        self.assertAlmostEqual(sum(node.dist for node in tree.iter_descendants()), 8.0)
+        self.assertEqual(sorted(tree.get_leaf_names()), ["A", "B", "C", "D"])
+        self.assertEqual(tree.get_common_ancestor("C", "D").support, 87.0)
+
+
+@unittest.skipUnless(raxml_installed(), "needs a real raxmlHPC on the PATH")
+class RaxmlRootTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def assertSameRoot(self, newick):
+        path = os.path.join(self.work, "tree.nwk")
+        with open(path, "w") as tree_file:
+            tree_file.write(newick + "\n")
+        tree = parse_newick(newick)
+        reroot_balanced(tree)
+        self.assertEqual(root_split(tree), root_split(raxml_rooted(path)), newick)
+
+    def test_hand_built_trees(self):
+        for newick in ["(A:1,B:1,(C:1,D:5):2);", "(A:1,B:1,(C:1,D:1):4);", "(A:0.1,(B:0.3,C:0.2):0.05,(D:0.4,E:0.1):0.2);"]:
+            self.assertSameRoot(newick)
+
+    def test_random_trees(self):
+        rng = random.Random(1)
+        for n in [5, 20, 100, 500]:
+            self.assertSameRoot(random_tree(n, rng))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3.6
+
+'''
+Tests of the stage selection of run_pipeline.py, which follows the inputs and
+outputs the stages declare rather than their order in the list.
+Run from the repository directory with `python -m unittest discover tests`.
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+from run_pipeline import Stage, Pipeline
+
+
+class SelectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.run_dir = tempfile.mkdtemp()
+        # two branches from one input, listed interleaved like build_stages does
+        self.pipeline = Pipeline(self.run_dir, [
+            Stage("query", ["query"], inputs=["in.fas"], outputs=["run.json"]),
+            Stage("reports", ["reports"], inputs=["run.json"], outputs=["reports.txt"]),
+            Stage("overview", ["overview"], inputs=["run.json", "reports.txt"], outputs=["overview.txt"]),
+            Stage("align", ["align"], inputs=["in.fas"], outputs=["aln.fas"]),
+            Stage("phylogeny", ["phylogeny"], inputs=["aln.fas"], outputs=["tree.nwk"]),
+            Stage("render", ["render"], inputs=["tree.nwk"], outputs=["tree.pdf"]),
+        ])
+
+    def tearDown(self):
+        shutil.rmtree(self.run_dir)
+
+    def test_from_stage_forces_only_its_consumers(self):
+        allowed, forced = self.pipeline.selected(from_stage="reports")
+        self.assertEqual(forced, {"reports", "overview"})
+        self.assertEqual(allowed, forced)
+
+    def test_from_stage_follows_consumers_transitively(self):
+        self.assertEqual(self.pipeline.selected(from_stage="query")[1], {"query", "reports", "overview"})
+        self.assertEqual(self.pipeline.selected(from_stage="align")[1], {"align", "phylogeny", "render"})
+
+    def test_last_stage(self):
+        self.assertEqual(self.pipeline.selected(from_stage="render")[1], {"render"})
+
+    def test_plan_from_stage(self):
+        actions = dict((stage.name, action) for stage, action in self.pipeline.plan(from_stage="reports"))
+        self.assertEqual(actions, {"query": "skip", "reports": "run", "overview": "run", "align": "skip",
+                                   "phylogeny": "skip", "render": "skip"})
+
+    def test_only_and_default(self):
+        self.assertEqual(self.pipeline.selected(only=["align"]), ({"align"}, {"align"}))
+        allowed, forced = self.pipeline.selected()
+        self.assertEqual(len(allowed), 6)
+        self.assertEqual(forced, set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3.6
+
+'''
+Round trip tests of sierra_ir.py: small sierrapy json files are decoded into
+Results, written to their binary file and read back through load_results.
+Run from the repository directory with `python -m unittest discover tests`.
+'''
+
+import os
+import sys
+import json
+import mmap
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+import sierra_ir
+from sierra_ir import Results, load_results, ir_path
+
+
+def mutation(text, comment=None):
+    found = {"text": text, "primaryType": "NNRTI"}
+    if comment is not None:
+        found["comments"] = [{"type": "Major", "text": comment}]
+    return found
+
+
+def drug_score(abbr, score, partials, text="High-Level Resistance"):
+    """
+    :param partials: list of (list of mutations, score)
+    """
+    return {"drugClass": {"name": "NNRTI"}, "drug": {"name": abbr, "displayAbbr": abbr, "fullName": abbr.lower()},
+            "score": score, "text": text,
+            "partialScores": [{"mutations": mutations, "score": value} for mutations, value in partials]}
+
+
+def result(header, subtype, scores):
+    return {"inputSequence": {"header": header}, "subtypeText": subtype, "validationResults": [],
+            "alignedGeneSequences": [{"firstAA": 1, "lastAA": 300, "gene": {"name": "RT", "length": 560}, "DRM": []}],
+            "drugResistance": [{"gene": {"name": "RT"}, "drugScores": scores,
+                                "mutationsByTypes": [{"mutationType": "NNRTI", "mutations": [{"text": "K103N"}, {"text": "Y181C"}]},
+                                                     {"mutationType": "Other", "mutations": []}]}]}
+
+
+def score_types(results):
+    """
+    Every score of the results with its type, as 10 and 10.0 compare equal.
+    """
+    return [(type(value), value) for r in results for j in r.resistance for k in j.scores
+            for value in [k.score] + [p.score for p in k.partials]]
+
+
+class RoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.json_in = os.path.join(self.work, "run.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def write_json(self, results):
+        with open(self.json_in, "w") as out:
+            json.dump(results, out, indent=2)
+
+    def round_trip(self, results):
+        """
+        :return: the results decoded from the json and those read back from its binary file
+        """
+        self.write_json(results)
+        decoded = load_results(self.json_in)
+        self.assertNotIsInstance(decoded, Results)
+        decoded = list(decoded)
+        loaded = load_results(self.json_in)
+        self.assertIsInstance(loaded, Results)
+        loaded = list(loaded)
+        self.assertEqual(loaded, decoded)
+        self.assertEqual(score_types(loaded), score_types(decoded))
+        return decoded, loaded
+
+    def test_mixed_int_and_float_scores(self):
+        decoded, loaded = self.round_trip([
+            result("s1", "A1", [drug_score("EFV", 60, [([mutation("K103N", "c1")], 60)]),
+                                drug_score("NVP", 7.5, [([mutation("Y181C", "c2")], 7.5)])]),
+            result("s2", "C", [drug_score("EFV", 60.0, [([mutation("K103N", "c1")], 60.0)])]),
+        ])
+        self.assertEqual(score_types(loaded), [(int, 60), (int, 60), (float, 7.5), (float, 7.5),
+                                               (float, 60.0), (float, 60.0)])
+        self.assertEqual(Results(ir_path(self.json_in)).score_types, "mixed")
+
+    def test_whole_number_scores_of_both_types(self):
+        decoded, loaded = self.round_trip([
+            result("s1", "A1", [drug_score("EFV", 60, [([mutation("K103N", "c1")], 60)])]),
+            result("s2", "C", [drug_score("EFV", 30.0, [([mutation("K103N", "c1")], 30.0)])]),
+        ])
+        self.assertEqual(score_types(loaded), [(int, 60), (int, 60), (float, 30.0), (float, 30.0)])
+
+    def test_mutation_without_comment_keeps_the_previous(self):
+        decoded, loaded = self.round_trip([
+            result("s1", "A1", [
+                drug_score("EFV", 70.0, [([mutation("K103N", "on K103N")], 60.0),
+                                         ([mutation("V106A")], 10.0)]),
+                # not resistant: its comments are not collected
+                drug_score("ETR", 0.0, [([mutation("E138A", "on E138A")], 0.0)], "Susceptible"),
+            ]),
+        ])
+        self.assertEqual(loaded[0].resistance[0].comments, ("on K103N", "on K103N"))
+        self.assertEqual(loaded[0].resistance[0].scores[0].partials[1].mutations, ("V106A",))
+
+    def test_empty_run(self):
+        decoded, loaded = self.round_trip([])
+        self.assertEqual(loaded, [])
+        self.assertEqual(len(Results(ir_path(self.json_in))), 0)
+
+    def test_memory_mapped(self):
+        self.write_json([result("s" + str(n), "B", [drug_score("EFV", 10 * n, [([mutation("K103N", "c")], 10 * n)])])
+                         for n in range(5)])
+        decoded = list(load_results(self.json_in))
+        with mock.patch.object(sierra_ir, "MMAP_SIZE", 0), \
+                mock.patch.object(sierra_ir.mmap, "mmap", wraps=mmap.mmap) as mapped:
+            loaded = load_results(self.json_in)
+            self.assertTrue(mapped.called)
+            self.assertEqual(list(loaded), decoded)
+            self.assertEqual(score_types(loaded), score_types(decoded))
+
+    def test_rebuilt_when_the_json_changes(self):
+        self.round_trip([result("s1", "B", [])])
+
+        # a different size
+        self.write_json([result("s1", "B", []), result("s2", "C", [])])
+        changed = load_results(self.json_in)
+        self.assertNotIsInstance(changed, Results)
+        self.assertEqual([r.header for r in changed], ["s1", "s2"])
+        self.assertEqual(len(load_results(self.json_in)), 2)
+
+        # the same size, written again later
+        self.write_json([result("s1", "B", []), result("s3", "C", [])])
+        st = os.stat(self.json_in)
+        os.utime(self.json_in, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        changed = load_results(self.json_in)
+        self.assertNotIsInstance(changed, Results)
+        self.assertEqual([r.header for r in changed], ["s1", "s3"])
+        loaded = load_results(self.json_in)
+        self.assertIsInstance(loaded, Results)
+        self.assertEqual([r.header for r in loaded], ["s1", "s3"])
+
+    def test_no_cache(self):
+        self.write_json([result("s1", "B", [])])
+        self.assertEqual(len(list(load_results(self.json_in, cache=False))), 1)
+        self.assertFalse(os.path.exists(ir_path(self.json_in)))
+
+
+if __name__ == "__main__":
+    unittest.main()